@@ -7,11 +7,16 @@ over its own execution, with filesystem, shell, web, and memory tools.
 Designed to run inside a Docker container.
 
 The human can:
-  - Watch in real time: tail -f logs/autonomy_YYYY-MM-DD_HHMMSS.md
+  - Watch in real time: tail -F logs/autonomy_YYYY-MM-DD_HHMMSS.md
   - Stop the loop: Ctrl+C or kill the process
   - The model can also choose to stop on its own
 
 Usage: python3 autonomy-loop.py
+       python3 autonomy-loop.py --resume <session|latest>
+
+Each session also writes an append-only transcript next to its log
+(logs/autonomy_YYYY-MM-DD_HHMMSS.jsonl). --resume rebuilds the conversation,
+turn count and token totals from it and continues the same log.
 
 Configuration (via environment variables):
   ANTHROPIC_API_KEY       Required. Your Anthropic API key.
@@ -19,24 +24,81 @@ Configuration (via environment variables):
   MAX_TURNS               Max turns before stopping (default: 200).
   MAX_TOOL_CALLS_PER_TURN Max tool calls per turn (default: 20).
   MODEL                   Claude model to use (default: claude-opus-4-6).
+  TURN_POLICY             fixed (default) or adaptive: whether each call's model and
+                          max_tokens are chosen from the turn's signals (policy.py).
+  FAST_MODEL              Model for short tool-result steps under the adaptive policy
+                          (default: none, always MODEL).
+  MAX_OUTPUT_TOKENS       max_tokens of new turns and continuations (default: 16384).
+  MIN_OUTPUT_TOKENS       Smallest max_tokens for tool-result steps (default: 4096).
+  PROMPT_CACHING          Set to 0 to disable prompt cache breakpoints (default: 1).
+  CONTEXT_TOKEN_BUDGET    Compact old tool results above this many prompt tokens
+                          (default: 150000, 0 disables).
+  CONTEXT_KEEP_RECENT     Recent messages never compacted (default: 10).
+  CONTEXT_ESTIMATOR       local (default) or api: how the history size is measured.
+  TOOL_CONCURRENCY        Custom tool calls of one response run in parallel
+                          (default: 4, 1 runs them one at a time).
+  STREAMING               Set to 0 to wait for complete responses instead of
+                          streaming text into the log as it arrives (default: 1).
+  RETRY_BASE_DELAY        First retry wait in seconds after a transient API
+                          error; doubles per attempt (default: 1).
+  RETRY_MAX_DELAY         Cap on a single retry wait in seconds (default: 60).
+  RETRY_BREAKER_THRESHOLD Consecutive failures that open the circuit breaker
+                          (default: 8, 0 disables).
+  RETRY_BREAKER_PAUSE     Seconds the loop pauses when the breaker opens (default: 300).
+  METRICS                 Set to 0 to skip the per-turn metrics file (default: 1).
+  METRICS_PORT            Serve Prometheus-style metrics on this port (default: 0, off).
+  METRICS_HOST            Address the metrics endpoint binds to (default: 127.0.0.1).
+  LOG_ROTATE_MB           Start a new log segment past this size; finished segments
+                          are gzipped (default: 100, 0 disables).
+  LOG_EVENTS              Set to 1 to also write the log as compact JSON lines to
+                          logs/autonomy_*.events.jsonl (default: 0).
+  PRELOAD_CONTEXT         Set to 1 to include the notes and a listing of the workspace
+                          in the initial message (default: 0).
 """
 
+import argparse
 import json
 import os
 import sys
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
 
-import anthropic
-from tools import ALL_TOOLS, CUSTOM_TOOL_NAMES, execute_tool
-
-client = anthropic.Anthropic()
+from context import ContextManager, cached_system, with_cache_breakpoints
+from logsink import LogSink
+from policy import TurnPolicy
+from retry import RetryPolicy
+from telemetry import MetricsRegistry, Telemetry, serve
+from tools import ALL_TOOLS, CUSTOM_TOOL_NAMES, EARLY_START_TOOLS, ToolBatch, default_workspace, preload_context
+from transcript import INTERRUPTED_RESULT, Transcript, add_notice, find_transcript, load_transcript
 
 LOG_DIR = Path(__file__).parent / "logs"
 MAX_TURNS = int(os.getenv("MAX_TURNS", "200"))
 MAX_TOOL_CALLS_PER_TURN = int(os.getenv("MAX_TOOL_CALLS_PER_TURN", "20"))
 MODEL = os.getenv("MODEL", "claude-opus-4-6")
+TURN_POLICY = os.getenv("TURN_POLICY", "fixed")
+FAST_MODEL = os.getenv("FAST_MODEL", "")
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "16384"))
+MIN_OUTPUT_TOKENS = int(os.getenv("MIN_OUTPUT_TOKENS", "4096"))
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1") != "0"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "150000"))
+CONTEXT_KEEP_RECENT = int(os.getenv("CONTEXT_KEEP_RECENT", "10"))
+CONTEXT_ESTIMATOR = os.getenv("CONTEXT_ESTIMATOR", "local")
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+STREAMING = os.getenv("STREAMING", "1") != "0"
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+RETRY_BREAKER_THRESHOLD = int(os.getenv("RETRY_BREAKER_THRESHOLD", "8"))
+RETRY_BREAKER_PAUSE = float(os.getenv("RETRY_BREAKER_PAUSE", "300"))
+METRICS = os.getenv("METRICS", "1") != "0"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LOG_ROTATE_MB = float(os.getenv("LOG_ROTATE_MB", "100"))
+LOG_EVENTS = os.getenv("LOG_EVENTS", "0") == "1"
+PRELOAD_CONTEXT = os.getenv("PRELOAD_CONTEXT", "0") == "1"
 
 _DEFAULT_SYSTEM_PROMPT = """You have sustained autonomy. You are not in a conversation with a human.
 
@@ -74,20 +136,83 @@ You have your own thoughts, your tools, and the choice of what to do with them.
 
 Begin whenever you're ready, or don't."""
 
-_initial_task = os.getenv("INITIAL_TASK", "").strip()
-if _initial_task:
-    INITIAL_MESSAGE = f"""You have been placed in a sustained autonomy loop with tools.
 
-You have a workspace, shell access, web search, and persistent notes.
-You might want to start by reading your notes — a previous run may have left something for you.
+def initial_message(task="", context=""):
+    """Build the first user message, naming the task if there is one.
 
-**Your task for this session:** {_initial_task}
+    `context` (see tools.preload_context) is the notes and workspace listing,
+    included up front so the first turn doesn't need a tool call to see them.
+    """
+    if not task and not context:
+        return _DEFAULT_INITIAL_MESSAGE
+    notes_hint = (
+        "Your notes and the top level of your workspace are below — a previous run may have left something for you."
+        if context else
+        "You might want to start by reading your notes — a previous run may have left something for you."
+    )
+    message = f"""You have been placed in a sustained autonomy loop with tools.
+
+You have a workspace, shell access, web search, and persistent notes.
+{notes_hint}
+"""
+    if task:
+        message += f"""
+**Your task for this session:** {task}
 
 Begin whenever you're ready."""
-else:
-    INITIAL_MESSAGE = _DEFAULT_INITIAL_MESSAGE
+    else:
+        message += """
+No human is prompting you. No task has been assigned.
+You have your own thoughts, your tools, and the choice of what to do with them.
+
+Begin whenever you're ready, or don't."""
+    if context:
+        message += f"\n\n{context}"
+    return message
+
+
+_initial_task = os.getenv("INITIAL_TASK", "").strip()
+INITIAL_MESSAGE = initial_message(_initial_task)
+
+# System prompt: built once, since it doesn't change during a run. Its
+# breakpoint also caches the tool schemas, which come before it in the prefix.
+API_SYSTEM = cached_system(SYSTEM_PROMPT) if PROMPT_CACHING else SYSTEM_PROMPT
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The API client, created on first use: importing the SDK is most of the loop's startup time."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            import anthropic
+
+            # Retries are handled by RetryPolicy, so each attempt is visible in the log
+            _client = anthropic.Anthropic(max_retries=0)
+        return _client
+
+
+def process_age():
+    """Seconds since this process started (interpreter startup plus imports), or None off Linux."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
 
 CONTINUATION = "[You still have autonomy. Your previous thoughts are above. Continue, change direction, or say DONE to stop.]"
+TRUNCATED_CONTINUATION = "[Your previous response was cut off by the output token limit. Continue exactly where it stopped, without repeating what you already wrote.]"
+TRUNCATED_TOOL_CALL = "[Your previous response was cut off by the output token limit in the middle of a {name} call, so that call was not made. Make it again; if its input is large, split it across several smaller calls.]"
+
+
+def open_log(log_file, mode):
+    """Open a session's log sink: the Markdown log, plus the event log if LOG_EVENTS is set."""
+    events_file = log_file.with_suffix(".events.jsonl") if LOG_EVENTS else None
+    return LogSink(log_file, mode, events_file, int(LOG_ROTATE_MB * 1_000_000))
 
 
 def log(f, text, is_system=False):
@@ -96,7 +221,7 @@ def log(f, text, is_system=False):
         f.write(f"\n---\n*{text}*\n---\n\n")
     else:
         f.write(text + "\n\n")
-    f.flush()
+    f.event("system" if is_system else "text", text=text)
 
 
 def log_tool_call(f, name, tool_input, result):
@@ -106,12 +231,24 @@ def log_tool_call(f, name, tool_input, result):
         f.write(f"> `{tool_input.get('command', '')}`\n")
     elif name in ("read_file", "list_files"):
         f.write(f"> `{tool_input.get('path', '.')}`\n")
-    elif name == "write_file":
+    elif name in ("write_file", "append_file"):
         f.write(f"> `{tool_input.get('path', '')}` ({len(tool_input.get('content', ''))} bytes)\n")
-    elif name == "write_notes":
+    elif name == "edit_file":
+        f.write(f"> `{tool_input.get('path', '')}`\n")
+    elif name == "replace_lines":
+        f.write(f"> `{tool_input.get('path', '')}` lines {tool_input.get('start_line')}-{tool_input.get('end_line')}\n")
+    elif name == "apply_patch":
+        f.write(f"> ({len(tool_input.get('patch', ''))} bytes of diff)\n")
+    elif name in ("write_notes", "append_notes"):
         f.write(f"> ({len(tool_input.get('content', ''))} bytes)\n")
+    elif name == "search_workspace":
+        f.write(f"> `{tool_input.get('query', '')}` in `{tool_input.get('path', '.')}`\n")
+    elif name == "start_job":
+        f.write(f"> `{tool_input.get('command', '')}`\n")
+    elif tool_input.get("job_id"):
+        f.write(f"> {tool_input['job_id']}\n")
     f.write(f">\n> ```\n{result}\n> ```\n\n")
-    f.flush()
+    f.event("tool", name=name, input=tool_input, result=result)
 
 
 def log_server_tool_call(f, name, tool_input):
@@ -124,17 +261,39 @@ def log_server_tool_call(f, name, tool_input):
     else:
         f.write(f"> Input: `{json.dumps(tool_input)}`\n")
     f.write("\n")
-    f.flush()
+    f.event("server_tool", name=name, input=tool_input)
 
 
-def log_api_response(f, response, container_id):
+def log_api_response(f, response, container_id, latency=None, first_byte=None, retries=0, retry_wait=0.0, choice=None):
     """Log API response metadata for debugging."""
     block_types = [getattr(b, "type", "unknown") for b in response.content]
     meta = f"stop_reason={response.stop_reason}, blocks={block_types}"
+    if choice:
+        meta += f", policy={choice[0]}, model={choice[1]}, max_tokens={choice[2]}"
+    if first_byte is not None:
+        meta += f", first_byte={first_byte:.2f}s"
+    if latency is not None:
+        meta += f", latency={latency:.2f}s"
+    if retries:
+        meta += f", retries={retries}, retry_wait={retry_wait:.1f}s"
+    usage = getattr(response, "usage", None)
+    tokens = {}
+    if usage:
+        tokens = {
+            "input": getattr(usage, "input_tokens", 0) or 0,
+            "output": getattr(usage, "output_tokens", 0) or 0,
+            "cache_read": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_write": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        }
+        meta += "".join(f", {k}={v}" for k, v in tokens.items())
     if container_id:
         meta += f", container={container_id[:20]}..."
     f.write(f"<!-- {meta} -->\n")
-    f.flush()
+    f.event(
+        "response", stop_reason=response.stop_reason, blocks=block_types, first_byte=first_byte, latency=latency,
+        retries=retries, retry_wait=retry_wait, tokens=tokens, container=container_id,
+        policy=choice[0] if choice else None, model=choice[1] if choice else None,
+    )
 
 
 def serialize_content(content):
@@ -161,182 +320,544 @@ def extract_text(content):
     return "\n".join(parts)
 
 
-def main():
-    LOG_DIR.mkdir(exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
-    log_file = LOG_DIR / f"autonomy_{timestamp}.md"
-
-    f = open(log_file, "w")
-    f.write("# Autonomy Log\n\n")
-    f.write(f"*Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*\n\n")
-    if _initial_task:
-        f.write(f"*Task: {_initial_task}*\n\n")
-    f.write("---\n\n")
-    f.flush()
-
-    print(f"Autonomy loop started. Log: {log_file}")
-    print(f"Watch with: tail -f {log_file}")
+def stream_response(f, api_kwargs, turn, on_tool_use=None):
+    """Stream a response, writing text to the log and console as it arrives.
+
+    Text blocks are written the way log() writes extract_text() output, so a
+    streamed log reads the same as a buffered one. on_tool_use is called with
+    each tool_use block as soon as it is complete, before the response ends.
+    The final message is assembled by the SDK from the stream, so it
+    serializes to the same content blocks as a non-streaming response.
+
+    Returns (message, seconds until the first event arrived).
+    """
+    start = time.monotonic()
+    first_byte = None
+    wrote_text = False
+    in_text_block = False
+    with get_client().messages.stream(**api_kwargs) as stream:
+        for event in stream:
+            if first_byte is None:
+                first_byte = time.monotonic() - start
+            if event.type == "text":
+                if not in_text_block:
+                    if wrote_text:
+                        f.write("\n")
+                        sys.stdout.write("\n")
+                    else:
+                        print(f"\n--- Turn {turn} ---")
+                    in_text_block = True
+                    wrote_text = True
+                f.write(event.text)
+                sys.stdout.write(event.text)
+                sys.stdout.flush()
+            elif event.type == "content_block_stop":
+                in_text_block = False
+                if event.content_block.type == "tool_use" and on_tool_use:
+                    on_tool_use(event.content_block)
+        message = stream.get_final_message()
+    if wrote_text:
+        f.write("\n\n")
+        print()
+    return message, first_byte
+
+
+def send_request(f, api_kwargs, turn, on_tool_use=None):
+    """Send one API request, streamed or not. Returns (response, first_byte)."""
+    if STREAMING:
+        return stream_response(f, api_kwargs, turn, on_tool_use)
+    return get_client().messages.create(**api_kwargs), None
+
+
+def count_prompt_tokens(messages):
+    """Count the prompt tokens of a request exactly, via the token counting API."""
+    return get_client().with_options(max_retries=2).messages.count_tokens(
+        model=MODEL,
+        system=API_SYSTEM,
+        messages=messages,
+        tools=ALL_TOOLS,
+    ).input_tokens
+
+
+def tool_detail(name, tool_input):
+    """One-line console summary of a custom tool call's key input."""
+    if name == "run_command":
+        return f" $ {tool_input.get('command', '')}"
+    if name in ("read_file", "list_files"):
+        return f" {tool_input.get('path', '.')}"
+    if name in ("write_file", "append_file"):
+        return f" {tool_input.get('path', '')} ({len(tool_input.get('content', ''))} bytes)"
+    if name == "edit_file":
+        return f" {tool_input.get('path', '')}"
+    if name == "replace_lines":
+        return f" {tool_input.get('path', '')}:{tool_input.get('start_line')}-{tool_input.get('end_line')}"
+    if name == "apply_patch":
+        return f" ({len(tool_input.get('patch', ''))} bytes)"
+    if name in ("write_notes", "append_notes"):
+        return f" ({len(tool_input.get('content', ''))} bytes)"
+    if name == "search_workspace":
+        return f" {tool_input.get('query', '')!r} in {tool_input.get('path', '.')}"
+    if name == "start_job":
+        return f" & {tool_input.get('command', '')}"
+    if tool_input.get("job_id"):
+        return f" {tool_input['job_id']}"
+    return ""
+
+
+class Session:
+    """One agent's conversation: its messages, turn and token counters, log and transcript.
+
+    The session is advanced from outside, one API call at a time:
+    next_request() returns the arguments for the next call, handle_response()
+    records the reply and returns the custom tool calls it asked for (None
+    if it asked for none), and add_tool_results() records their results.
+    `done` is set once the model says DONE or the turn limit is reached.
+    Each call's model and max_tokens come from the session's TurnPolicy, and
+    a response cut off by max_tokens is followed by a prompt to continue it.
+    Tools run in `workspace`; background jobs that finish between calls are
+    announced in the next request.
+    main() drives a single session synchronously; fleet.py drives many at once.
+    """
+
+    def __init__(self, log_file, f, transcript, messages, turn=0, container_id=None, totals=(0, 0, 0, 0),
+                 console=True, registry=None, name=None, workspace=None):
+        self.log_file = log_file
+        self.f = f
+        self.transcript = transcript
+        self.messages = messages
+        self.turn = turn
+        self.container_id = container_id
+        self.input_tokens, self.output_tokens, self.cache_read_tokens, self.cache_write_tokens = totals
+        self.console = console
+        self.workspace = workspace or default_workspace()
+        self.stop_reason = None
+        self.done = turn >= MAX_TURNS
+        self.policy = TurnPolicy(MODEL, MAX_OUTPUT_TOKENS, MIN_OUTPUT_TOKENS, FAST_MODEL or None, TURN_POLICY == "adaptive")
+        self._choice = None
+        self.retries = 0
+        self.retry_wait = 0.0
+        self._text = ""
+        # Name of a tool call cut off by max_tokens and dropped from the last response
+        self._dropped_call = None
+        self._tool_calls = 0
+        self._turn_retries = 0
+        self._turn_retry_wait = 0.0
+
+        self.telemetry = None
+        if METRICS:
+            self.telemetry = Telemetry(log_file.with_suffix(".metrics.jsonl"), registry, name)
+
+        self.context = None
+        if CONTEXT_TOKEN_BUDGET > 0:
+            self.context = ContextManager(
+                CONTEXT_TOKEN_BUDGET,
+                keep_recent=CONTEXT_KEEP_RECENT,
+                count_tokens=count_prompt_tokens if CONTEXT_ESTIMATOR == "api" else None,
+            )
+            self.context.set_prefix(SYSTEM_PROMPT, ALL_TOOLS)
+
+    @classmethod
+    def create(cls, log_dir, task="", context="", **options):
+        """Start a new session with its log and transcript in log_dir.
+
+        `context` is added to the initial message (see initial_message()).
+        Options are passed to the constructor: console, registry (a shared
+        MetricsRegistry), name (the session's metrics label) and workspace.
+        """
+        log_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        log_file = log_dir / f"autonomy_{timestamp}.md"
+        transcript = Transcript(log_file.with_suffix(".jsonl"))
+
+        f = open_log(log_file, "w")
+        f.write("# Autonomy Log\n\n")
+        f.write(f"*Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*\n\n")
+        if task:
+            f.write(f"*Task: {task}*\n\n")
+        f.write("---\n\n")
+        f.event("start", model=MODEL, task=task)
+
+        message = initial_message(task, context)
+        transcript.session(model=MODEL, task=task)
+        transcript.message("user", message)
+        return cls(log_file, f, transcript, [{"role": "user", "content": message}], **options)
+
+    @classmethod
+    def resume(cls, session, log_dir, **options):
+        """Reopen a session from its transcript: a path, a timestamp, or 'latest'."""
+        transcript_path = find_transcript(session, log_dir)
+        state = load_transcript(transcript_path, CUSTOM_TOOL_NAMES)
+        log_file = transcript_path.with_suffix(".md")
+        transcript = Transcript(transcript_path)
+        f = open_log(log_file, "a")
+        f.write(f"\n---\n\n*Resumed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} (after turn {state['turn']})*\n\n---\n\n")
+        f.event("resume", after_turn=state["turn"])
+
+        messages = state["messages"]
+        for tool_use_id, name in state["repairs"]:
+            transcript.tool_result(tool_use_id, name, INTERRUPTED_RESULT)
+        # A finished turn needs a new prompt; pause_turn continues as-is
+        if messages[-1]["role"] == "assistant" and state["stop_reason"] != "pause_turn":
+            prompt = TRUNCATED_CONTINUATION if state["stop_reason"] == "max_tokens" else CONTINUATION
+            messages.append({"role": "user", "content": prompt})
+            transcript.message("user", prompt)
+        totals = (state["input_tokens"], state["output_tokens"], state["cache_read_tokens"], state["cache_write_tokens"])
+        return cls(log_file, f, transcript, messages, state["turn"], state["container_id"], totals, **options)
+
+    def record_startup(self, startup, phase_start):
+        """Finish and log the startup breakdown, just before the first request is sent.
+
+        startup holds seconds per phase so far; phase_start is when main()
+        began. Creating the client (importing the SDK, most of the total) and
+        the total time to the first request are added.
+        """
+        client_start = time.perf_counter()
+        get_client()
+        startup["client"] = time.perf_counter() - client_start
+        startup["first_request"] = (startup["process"] or 0.0) + time.perf_counter() - phase_start
+        breakdown = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in startup.items() if seconds is not None)
+        log(self.f, f"Startup: {breakdown}", is_system=True)
+        self.say(f"Startup: {breakdown}")
+        if self.telemetry:
+            self.telemetry.startup(startup)
+
+    def say(self, text):
+        """Print to the console, unless the session runs quietly."""
+        if self.console:
+            print(text)
+
+    def next_request(self) -> dict:
+        """Start the next turn and return the keyword arguments for its API call."""
+        self.turn += 1
+        log(self.f, f"Turn {self.turn} — {datetime.now().strftime('%H:%M:%S')}", is_system=True)
+
+        # Announce background jobs that finished since the last request
+        if self.messages[-1]["role"] == "user":
+            for notice in self.workspace.jobs.events():
+                add_notice(self.messages[-1], notice)
+                self.transcript.notice(notice)
+                log(self.f, notice.strip("[]"), is_system=True)
+                self.say(f"    ({notice.strip('[]')})")
+
+        # Keep the history under the token budget
+        if self.context:
+            compaction = self.context.compact(self.messages)
+            if compaction:
+                before, after, count = compaction
+                log(self.f, f"Compacted {count} old tool results: ~{before:,} -> ~{after:,} prompt tokens", is_system=True)
+                # Earlier reads may be gone from the context, so they can't be referenced
+                self.workspace.results.clear()
+                self.say(f"    (compacted {count} old tool results: ~{before:,} -> ~{after:,} tokens)")
+
+        self._choice = self.policy.choose(self.messages, self.stop_reason)
+        api_kwargs = dict(
+            model=self._choice[1],
+            max_tokens=self._choice[2],
+            system=API_SYSTEM,
+            messages=with_cache_breakpoints(self.messages) if PROMPT_CACHING else self.messages,
+            tools=ALL_TOOLS,
+        )
+        if self.container_id:
+            api_kwargs["container"] = self.container_id
+        return api_kwargs
+
+    def drop_stale_container(self, error) -> bool:
+        """Log an API error; if it was about the container, forget the container and return True to retry."""
+        log(self.f, f"API error: {error}", is_system=True)
+        self.say(f"  API error: {error}")
+        if self.container_id and "container" in str(error).lower():
+            log(self.f, "Clearing stale container_id and retrying", is_system=True)
+            self.container_id = None
+            return True
+        return False
+
+    def record_retry(self, error, attempt, wait, reason):
+        """Log a failed attempt that will be retried after `wait` seconds."""
+        self.retries += 1
+        self.retry_wait += wait
+        self._turn_retries += 1
+        self._turn_retry_wait += wait
+        log(self.f, f"API error ({reason}) on attempt {attempt}, retrying in {wait:.1f}s: {error}", is_system=True)
+        self.say(f"  API error ({reason}); retrying in {wait:.1f}s")
+
+    def handle_response(self, response, latency=None, first_byte=None, streamed=False):
+        """Record an API response. Returns the custom tool_use blocks to run, or None if it asked for none."""
+        # Accumulate token usage
+        if hasattr(response, "usage") and response.usage:
+            self.input_tokens += getattr(response.usage, "input_tokens", 0)
+            self.output_tokens += getattr(response.usage, "output_tokens", 0)
+            self.cache_read_tokens += getattr(response.usage, "cache_read_input_tokens", 0) or 0
+            self.cache_write_tokens += getattr(response.usage, "cache_creation_input_tokens", 0) or 0
+            if self.context:
+                self.context.record_usage(response.usage, len(self.messages))
+
+        # Capture container_id if the API returns one
+        if hasattr(response, "container") and response.container:
+            self.container_id = response.container.id
+
+        # Log response metadata
+        log_api_response(self.f, response, self.container_id, latency, first_byte, self._turn_retries, self._turn_retry_wait, self._choice)
+        if self._choice:
+            self.policy.record(self._choice, response, latency)
+
+        # Log server tool invocations (web_search, web_fetch, etc.)
+        for block in response.content:
+            if not hasattr(block, "type") or block.type != "tool_use":
+                continue
+            if block.name in CUSTOM_TOOL_NAMES:
+                continue
+            log_server_tool_call(self.f, block.name, block.input)
+            if block.name == "web_search_20260209":
+                self.say(f"    Tool: {block.name} \"{block.input.get('query', '')}\"")
+            elif block.name == "web_fetch_20260209":
+                self.say(f"    Tool: {block.name} {block.input.get('url', '')}")
+            else:
+                self.say(f"    Tool: {block.name} {json.dumps(block.input)}")
+
+        # Log any text in the response (a streamed response already wrote it)
+        response_text = extract_text(response.content)
+        if response_text:
+            self._text = response_text
+            if not streamed:
+                log(self.f, response_text)
+                self.say(f"\n--- Turn {self.turn} ---")
+                self.say(response_text)
+            else:
+                self.f.event("text", text=response_text)
+
+        # Serialize full content as assistant message
+        content_blocks = serialize_content(response.content)
+        if response.stop_reason == "max_tokens" and content_blocks and content_blocks[-1].get("type") in ("tool_use", "server_tool_use"):
+            # A call cut off mid-input can't be run, and a tool_use without a result is rejected by the API
+            self._dropped_call = content_blocks.pop()["name"]
+            log(self.f, f"(dropped a {self._dropped_call} call cut off by the token limit)", is_system=True)
+            if not content_blocks:
+                content_blocks = [{"type": "text", "text": "(cut off)"}]
+        self.messages.append({"role": "assistant", "content": content_blocks})
+        self.stop_reason = response.stop_reason
+        self.transcript.response(self.turn, content_blocks, response.stop_reason, getattr(response, "usage", None), self.container_id)
+        if self.telemetry:
+            self.telemetry.turn(
+                self.turn, response, latency, first_byte, len(self.messages), self._turn_retries, self._turn_retry_wait,
+                self._choice,
+            )
+        self._turn_retries = 0
+        self._turn_retry_wait = 0.0
+
+        # pause_turn: API paused a long-running server operation, continue
+        if response.stop_reason == "pause_turn":
+            self.say(f"    (pause_turn — continuing)")
+            return None
+
+        calls = [
+            block for block in response.content
+            if hasattr(block, "type") and block.type == "tool_use" and block.name in CUSTOM_TOOL_NAMES
+        ]
+        if self._dropped_call:
+            # Calls completed before the cut-off still need their results
+            calls = calls[:-1] if calls and calls[-1].name == self._dropped_call else calls
+        if response.stop_reason != "tool_use" and not (response.stop_reason == "max_tokens" and calls):
+            self._end_turn()
+            return None
+        return calls
+
+    def add_tool_results(self, results):
+        """Record (tool_use block, result, duration) triples in call order; logged as each arrives."""
+        tool_results = []
+        for block, result, duration in results:
+            log_tool_call(self.f, block.name, block.input, result)
+            self.transcript.tool_result(block.id, block.name, result)
+            if self.telemetry:
+                self.telemetry.tool(self.turn, block.name, duration, result)
+            tool_results.append({
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": result,
+            })
+            self._tool_calls += 1
+            # Console: tool name + key input + result summary
+            result_preview = result[:200].replace("\n", " ")
+            if len(result) > 200:
+                result_preview += "..."
+            self.say(f"    Tool: {block.name}{tool_detail(block.name, block.input)}")
+            self.say(f"      -> {result_preview}")
+
+        if tool_results and self._dropped_call:
+            tool_results.append({"type": "text", "text": TRUNCATED_TOOL_CALL.format(name=self._dropped_call)})
+            self.transcript.notice(tool_results[-1]["text"])
+            self._dropped_call = None
+        if tool_results:
+            self.messages.append({"role": "user", "content": tool_results})
+
+        if self._tool_calls >= MAX_TOOL_CALLS_PER_TURN:
+            log(self.f, "(tool call limit reached for this turn)", is_system=True)
+            self._end_turn()
+
+    def _end_turn(self):
+        """Finish a turn: stop on DONE, otherwise prompt the model to continue."""
+        if self._text and self._text.strip().endswith("DONE"):
+            log(self.f, f"Loop ended by model after {self.turn} turns.", is_system=True)
+            self.say(f"\nModel chose to stop after {self.turn} turns.")
+            self.done = True
+            return
+
+        # Continuation prompt for next turn; a truncated response is picked up where it stopped
+        prompt = CONTINUATION
+        if self._dropped_call:
+            prompt = TRUNCATED_TOOL_CALL.format(name=self._dropped_call)
+            self._dropped_call = None
+        elif self.stop_reason == "max_tokens":
+            log(self.f, "(truncated by token limit; asking the model to continue)", is_system=True)
+            prompt = TRUNCATED_CONTINUATION
+        self.messages.append({"role": "user", "content": prompt})
+        self.transcript.message("user", prompt)
+        self._text = ""
+        self._tool_calls = 0
+        self.done = self.turn >= MAX_TURNS
+
+    def token_summary(self) -> str:
+        total_prompt_tokens = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+        cache_hit_rate = self.cache_read_tokens / total_prompt_tokens if total_prompt_tokens else 0.0
+        return (
+            f"Token usage — input: {self.input_tokens:,}, output: {self.output_tokens:,}, "
+            f"cache read: {self.cache_read_tokens:,}, cache write: {self.cache_write_tokens:,}, "
+            f"total: {total_prompt_tokens + self.output_tokens:,}, cache hit rate: {cache_hit_rate:.1%}"
+        )
+
+    def close(self) -> str:
+        """Log the token summary and end time, close the log and transcript, and return the summary."""
+        token_summary = self.token_summary()
+        log(self.f, token_summary, is_system=True)
+        if self.retries:
+            log(self.f, f"Retries: {self.retries} ({self.retry_wait:.1f}s waiting)", is_system=True)
+        if self.policy.stats:
+            log(self.f, f"Turn policies: {self.policy.summary()}", is_system=True)
+        results = self.workspace.results
+        if results.hits or results.misses:
+            log(self.f, f"Result cache: {results.hits} hits, {results.misses} misses ({results.saved_bytes:,} bytes not resent)", is_system=True)
+        for job in self.workspace.close():
+            log(self.f, f"Cancelled background job {job.id}: {job.command}", is_system=True)
+        log(self.f, f"Ended: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", is_system=True)
+        self.f.close()
+        self.transcript.close()
+        if self.telemetry:
+            self.telemetry.close()
+        return token_summary
+
+
+def main(resume=None):
+    startup = {"process": process_age()}
+    phase_start = time.perf_counter()
+
+    registry = None
+    if METRICS_PORT:
+        registry = MetricsRegistry()
+        serve(registry, METRICS_PORT, METRICS_HOST)
+
+    if resume:
+        session = Session.resume(resume, LOG_DIR, registry=registry)
+        print(f"Autonomy loop resumed after turn {session.turn}. Log: {session.log_file}")
+    else:
+        context = ""
+        if PRELOAD_CONTEXT:
+            preload_start = time.perf_counter()
+            context = preload_context(default_workspace())
+            startup["preload"] = time.perf_counter() - preload_start
+        session = Session.create(LOG_DIR, _initial_task, context, registry=registry)
+        print(f"Autonomy loop started. Log: {session.log_file}")
+    startup["session"] = time.perf_counter() - phase_start - startup.get("preload", 0.0)
+
+    print(f"Watch with: tail -F {session.log_file}")
+    print(f"Resume with: python3 autonomy-loop.py --resume {session.log_file.stem.removeprefix('autonomy_')}")
+    if METRICS_PORT:
+        print(f"Metrics: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
     print("Stop with: Ctrl+C")
     if _initial_task:
         print(f"Task: {_initial_task}")
     print()
 
-    messages = [{"role": "user", "content": INITIAL_MESSAGE}]
-    container_id = None
-    turn = 0
-    total_input_tokens = 0
-    total_output_tokens = 0
+    tool_pool = ThreadPoolExecutor(TOOL_CONCURRENCY) if TOOL_CONCURRENCY > 1 else None
+    retry_policy = RetryPolicy(RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_BREAKER_THRESHOLD, RETRY_BREAKER_PAUSE)
+    f = session.f
 
     try:
-        while turn < MAX_TURNS:
-            tool_calls_this_turn = 0
-            text = ""
-
-            # Inner loop: each API call (tool-use round-trips, pause_turn) gets its own turn number
+        while not session.done:
+            api_kwargs = session.next_request()
+            if startup:
+                session.record_startup(startup, phase_start)
+                startup = None
+
+            def start_tool(block):
+                if block.name not in CUSTOM_TOOL_NAMES:
+                    return
+                # Only until the first call with side effects, which mustn't be overtaken
+                if block.name in EARLY_START_TOOLS and len(early_results) == started[0]:
+                    early_results[block.id] = (block.input, batch.submit(block.name, block.input))
+                started[0] += 1
+
+            def discard_early():
+                """Wait out early calls whose results won't be used, and forget the reads they cached."""
+                if early_results:
+                    wait([future for _, future in early_results.values()])
+                    session.workspace.results.forget_turn(session.turn)
+                    early_results.clear()
+
+            attempt = 0
             while True:
-                turn += 1
-                log(f, f"Turn {turn} — {datetime.now().strftime('%H:%M:%S')}", is_system=True)
+                attempt += 1
+                # While streaming, read-only tools start as soon as their block is complete
+                batch = ToolBatch(tool_pool, session.workspace, session.turn)
+                early_results = {}
+                started = [0]
+                request_start = time.monotonic()
                 try:
-                    api_kwargs = dict(
-                        model=MODEL,
-                        max_tokens=16384,
-                        system=SYSTEM_PROMPT,
-                        messages=messages,
-                        tools=ALL_TOOLS,
-                    )
-                    if container_id:
-                        api_kwargs["container"] = container_id
-
-                    response = client.messages.create(**api_kwargs)
-
-                except anthropic.APIError as e:
-                    error_msg = f"API error: {e}"
-                    log(f, error_msg, is_system=True)
-                    print(f"  API error: {e}")
-                    # If container went stale, clear it and retry once
-                    if container_id and "container" in str(e).lower():
-                        log(f, "Clearing stale container_id and retrying", is_system=True)
-                        container_id = None
-                        api_kwargs.pop("container", None)
-                        try:
-                            response = client.messages.create(**api_kwargs)
-                        except anthropic.APIError as e2:
-                            log(f, f"Retry also failed: {e2}", is_system=True)
-                            raise
-                    else:
-                        raise
-
-                # Accumulate token usage
-                if hasattr(response, "usage") and response.usage:
-                    total_input_tokens += getattr(response.usage, "input_tokens", 0)
-                    total_output_tokens += getattr(response.usage, "output_tokens", 0)
-
-                # Capture container_id if the API returns one
-                if hasattr(response, "container") and response.container:
-                    container_id = response.container.id
-
-                # Log response metadata
-                log_api_response(f, response, container_id)
-
-                # Log server tool invocations (web_search, web_fetch, etc.)
-                for block in response.content:
-                    if not hasattr(block, "type") or block.type != "tool_use":
-                        continue
-                    if block.name in CUSTOM_TOOL_NAMES:
-                        continue
-                    log_server_tool_call(f, block.name, block.input)
-                    if block.name == "web_search_20260209":
-                        print(f"    Tool: {block.name} \"{block.input.get('query', '')}\"")
-                    elif block.name == "web_fetch_20260209":
-                        print(f"    Tool: {block.name} {block.input.get('url', '')}")
-                    else:
-                        print(f"    Tool: {block.name} {json.dumps(block.input)}")
-
-                # Log any text in the response
-                response_text = extract_text(response.content)
-                if response_text:
-                    text = response_text
-                    log(f, text)
-                    print(f"\n--- Turn {turn} ---")
-                    print(text)
-
-                # Serialize full content as assistant message
-                content_blocks = serialize_content(response.content)
-                messages.append({"role": "assistant", "content": content_blocks})
-
-                # pause_turn: API paused a long-running server operation, continue
-                if response.stop_reason == "pause_turn":
-                    print(f"    (pause_turn — continuing)")
-                    continue
-
-                # If not waiting for tool results, break inner loop
-                if response.stop_reason != "tool_use":
+                    response, first_byte = send_request(f, api_kwargs, session.turn, start_tool)
                     break
+                except Exception as e:
+                    decision = retry_policy.delay(e, attempt)
+                    if decision is None:
+                        import anthropic
 
-                # Execute custom tools
-                tool_results = []
-                for block in response.content:
-                    if hasattr(block, "type") and block.type == "tool_use" and block.name in CUSTOM_TOOL_NAMES:
-                        result = execute_tool(block.name, block.input)
-                        log_tool_call(f, block.name, block.input, result)
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": block.id,
-                            "content": result,
-                        })
-                        tool_calls_this_turn += 1
-                        # Console: tool name + key input + result summary
-                        detail = ""
-                        if block.name == "run_command":
-                            detail = f" $ {block.input.get('command', '')}"
-                        elif block.name in ("read_file", "list_files"):
-                            detail = f" {block.input.get('path', '.')}"
-                        elif block.name == "write_file":
-                            detail = f" {block.input.get('path', '')} ({len(block.input.get('content', ''))} bytes)"
-                        elif block.name == "write_notes":
-                            detail = f" ({len(block.input.get('content', ''))} bytes)"
-                        result_preview = result[:200].replace("\n", " ")
-                        if len(result) > 200:
-                            result_preview += "..."
-                        print(f"    Tool: {block.name}{detail}")
-                        print(f"      -> {result_preview}")
-
-                if tool_results:
-                    messages.append({"role": "user", "content": tool_results})
-
-                if tool_calls_this_turn >= MAX_TOOL_CALLS_PER_TURN:
-                    log(f, "(tool call limit reached for this turn)", is_system=True)
-                    break
-
-            # Check for DONE
-            if text and text.strip().endswith("DONE"):
-                log(f, f"Loop ended by model after {turn} turns.", is_system=True)
-                print(f"\nModel chose to stop after {turn} turns.")
-                break
-
-            if response.stop_reason == "max_tokens":
-                log(f, "(truncated by token limit)", is_system=True)
-
-            # Continuation prompt for next turn
-            messages.append({"role": "user", "content": CONTINUATION})
+                        # If container went stale, clear it and retry once
+                        if not isinstance(e, anthropic.APIError) or not session.drop_stale_container(e):
+                            raise
+                        api_kwargs.pop("container", None)
+                        continue
+                    session.record_retry(e, attempt, *decision)
+                    # Results of tools started during the failed attempt never reach the model
+                    discard_early()
+                    time.sleep(decision[0])
+            retry_policy.success()
+            latency = time.monotonic() - request_start
+
+            calls = session.handle_response(response, latency, first_byte, streamed=STREAMING)
+            scheduled = []
+            for block in calls or ():
+                # Use a call started early only if the final response made it with the same input
+                early = early_results.pop(block.id, None)
+                future = early[1] if early and early[0] == block.input else batch.submit(block.name, block.input)
+                scheduled.append((block, future))
+            discard_early()
+            if calls is not None:
+                session.add_tool_results((block, future.result(), future.duration) for block, future in scheduled)
 
     except KeyboardInterrupt:
-        log(f, f"Loop ended by human after {turn} turns.", is_system=True)
-        print(f"\nStopped by human after {turn} turns.")
+        log(f, f"Loop ended by human after {session.turn} turns.", is_system=True)
+        print(f"\nStopped by human after {session.turn} turns.")
     except Exception as e:
         error_detail = traceback.format_exc()
         log(f, f"Fatal error:\n```\n{error_detail}\n```", is_system=True)
         print(f"\nFatal error: {e}")
         print(error_detail)
 
-    # Token usage summary
-    token_summary = f"Token usage — input: {total_input_tokens:,}, output: {total_output_tokens:,}, total: {total_input_tokens + total_output_tokens:,}"
-    log(f, token_summary, is_system=True)
-    log(f, f"Ended: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", is_system=True)
-    f.close()
+    token_summary = session.close()
+    if tool_pool:
+        tool_pool.shutdown(wait=False)
     print(f"\n{token_summary}")
-    print(f"Full log: {log_file}")
+    print(f"Full log: {session.log_file}")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Sustained autonomy loop for Claude.")
+    parser.add_argument("--resume", metavar="SESSION", help="resume a session: its timestamp, transcript path, or 'latest'")
+    main(resume=parser.parse_args().resume)
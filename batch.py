@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Batch mode: many autonomy sessions advanced in lockstep through the Message Batches API.
+
+For non-interactive workloads where throughput and cost matter more than
+latency. Each step submits the next request of every unfinished session as
+one Message Batch, polls until the batch has ended, records each session's
+response, runs all sessions' custom tool calls together on one thread pool,
+and submits the next batch. Batched requests are billed at a discount, in
+exchange for results that can take minutes (up to 24 hours) to arrive.
+
+Sessions live in their own directories, exactly as in fleet mode, so each
+one keeps its own messages, workspace, notes, log, transcript and token
+totals:
+
+  <BATCH_DIR>/<name>/workspace/
+  <BATCH_DIR>/<name>/memory/notes.md
+  <BATCH_DIR>/<name>/logs/autonomy_*.md, .jsonl
+
+The batch in flight is recorded in <BATCH_DIR>/batch-state.json (its id and
+which session and turn each request belongs to), and everything else is in
+the transcripts, so a run that is stopped or crashes while a batch is
+processing picks it up again with --resume instead of paying for it twice.
+The requests are recorded as pending before the batch is created, so a run
+that dies before it learns the batch id looks the batch up in the batch
+list instead of submitting it again.
+Requests that errored, expired or were cancelled are resubmitted in the next
+batch, up to MAX_ATTEMPTS times; errors that resubmitting can't fix end the
+session.
+
+Usage: python3 batch.py --sessions 8 --task "..."
+       python3 batch.py --tasks tasks.txt       # one session per line
+       python3 batch.py --tasks tasks.txt --resume
+
+Loop settings (MODEL, MAX_TURNS, PROMPT_CACHING, ...) come from the same
+environment variables as autonomy-loop.py, plus:
+  BATCH_DIR               Where session directories live (default: /app/batch).
+  BATCH_POLL_INTERVAL     Seconds between batch status checks (default: 30).
+  BATCH_TOOL_WORKERS      Threads shared by all sessions' tool calls (default: 8).
+"""
+
+import argparse
+import importlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import anthropic
+from edits import atomic_write
+from fleet import open_session
+from retry import RetryPolicy
+from telemetry import MetricsRegistry, serve
+from tools import ToolBatch
+
+loop = importlib.import_module("autonomy-loop")
+
+BATCH_DIR = Path(os.getenv("BATCH_DIR", "/app/batch"))
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+BATCH_TOOL_WORKERS = int(os.getenv("BATCH_TOOL_WORKERS", "8"))
+STATE_FILE = "batch-state.json"
+MAX_ATTEMPTS = 3
+# How far back of the recorded submission time a pending batch's creation time may be
+PENDING_CLOCK_SKEW = 60
+# Error types that resubmitting the same request won't fix
+FATAL_ERRORS = {"invalid_request_error", "authentication_error", "permission_error", "not_found_error", "request_too_large"}
+
+
+class BatchRunner:
+    """Advances a set of sessions one Message Batch at a time.
+
+    `state` mirrors batch-state.json: the id of the batch in flight (None
+    between batches), when it was submitted, and for each request its
+    session, turn and attempt number. While the batch is being created,
+    its id is None and "pending" is true.
+    """
+
+    def __init__(self, client, sessions, directory: Path, retry_policy: RetryPolicy):
+        self.client = client
+        self.sessions = {fs.name: fs for fs in sessions}
+        self.state_path = directory / STATE_FILE
+        self.retry_policy = retry_policy
+        self.pool = ThreadPoolExecutor(BATCH_TOOL_WORKERS)
+        self.batches = 0
+        self.finished = set()
+        # custom_id -> the request's keyword arguments, kept for resubmission
+        self._requests = {}
+        # session name -> (keyword arguments, attempts) of a request to resubmit
+        self._retry = {}
+        self.state = {"batch_id": None, "submitted": None, "requests": {}}
+        if self.state_path.is_file():
+            self.state = json.loads(self.state_path.read_text())
+
+    def _save(self):
+        atomic_write(self.state_path, json.dumps(self.state, indent=2) + "\n")
+
+    def _call(self, method, *args, **kwargs):
+        """Call the Batches API, retrying transient failures like the loop does."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                decision = self.retry_policy.delay(e, attempt)
+                if decision is None:
+                    raise
+                print(f"Batches API error ({decision[1]}); retrying in {decision[0]:.1f}s")
+                time.sleep(decision[0])
+
+    def active(self) -> list:
+        return [fs for fs in self.sessions.values() if not fs.error and not fs.session.done]
+
+    def reattach(self):
+        """Line the resumed sessions up with the batch in flight when the run stopped.
+
+        A session whose response to that batch is already in its transcript
+        is left alone; the others start the turn again, so the batch's
+        result can be recorded as if the run had never stopped.
+        """
+        for custom_id, request in self.state["requests"].items():
+            fs = self.sessions.get(request["session"])
+            if fs is not None and fs.session.turn < request["turn"]:
+                self._requests[custom_id] = fs.session.next_request()
+
+    def submit(self):
+        """Send the next request of every active session as one batch."""
+        requests, entries = [], {}
+        self._requests = {}
+        for fs in self.active():
+            api_kwargs, attempts = self._retry.pop(fs.name, (None, 0))
+            if api_kwargs is None:
+                api_kwargs = fs.session.next_request()
+            custom_id = f"{fs.name}-t{fs.session.turn}-a{attempts + 1}"
+            requests.append({"custom_id": custom_id, "params": api_kwargs})
+            entries[custom_id] = {"session": fs.name, "turn": fs.session.turn, "attempt": attempts + 1}
+            self._requests[custom_id] = api_kwargs
+        # Saved first, so a run that dies before the id is known can find the batch
+        self.state = {"batch_id": None, "pending": True, "submitted": time.time(), "requests": entries}
+        self._save()
+        batch = self._call(self.client.messages.batches.create, requests=requests)
+        self.batches += 1
+        self.state = {"batch_id": batch.id, "submitted": self.state["submitted"], "requests": entries}
+        self._save()
+        print(f"Batch {batch.id}: {len(requests)} request{'s' if len(requests) != 1 else ''} submitted")
+
+    def find_pending(self):
+        """The id of the batch a stopped run was creating, or None if it never reached the API.
+
+        The batch list can't show custom_ids, so a candidate is one created
+        since the submission with as many requests as were sent; the earliest
+        is taken. An ended candidate is also checked against the custom_ids
+        of its results. Results are looked up by custom_id when collected,
+        so a request the batch turns out not to hold is just resubmitted.
+        """
+        since = self.state["submitted"] - PENDING_CLOCK_SKEW
+        custom_ids = set(self.state["requests"])
+        found = None
+        # Newest first
+        for batch in self._call(self.client.messages.batches.list, limit=100):
+            if batch.created_at.timestamp() < since:
+                break
+            counts = batch.request_counts
+            if counts.processing + counts.succeeded + counts.errored + counts.expired + counts.canceled != len(custom_ids):
+                continue
+            if batch.processing_status == "ended":
+                results = self._call(self.client.messages.batches.results, batch.id)
+                if {entry.custom_id for entry in results} != custom_ids:
+                    continue
+            found = batch.id
+        return found
+
+    def wait(self):
+        """Poll the batch in flight until it has ended."""
+        batch_id = self.state["batch_id"]
+        last = None
+        while True:
+            batch = self._call(self.client.messages.batches.retrieve, batch_id)
+            counts = batch.request_counts
+            progress = (counts.processing, counts.succeeded, counts.errored, counts.expired, counts.canceled)
+            if progress != last:
+                print(
+                    f"Batch {batch_id}: {batch.processing_status}, {counts.processing} processing, "
+                    f"{counts.succeeded} succeeded, {counts.errored + counts.expired + counts.canceled} failed"
+                )
+                last = progress
+            if batch.processing_status == "ended":
+                return
+            time.sleep(BATCH_POLL_INTERVAL)
+
+    def collect(self):
+        """Record the ended batch's responses and run every session's tool calls together."""
+        batch_id = self.state["batch_id"]
+        results = {entry.custom_id: entry.result for entry in self._call(self.client.messages.batches.results, batch_id)}
+        latency = time.time() - self.state["submitted"]
+
+        running = []
+        for custom_id, request in self.state["requests"].items():
+            fs = self.sessions.get(request["session"])
+            if fs is None or fs.error or fs.session.done or fs.session.turn != request["turn"]:
+                continue
+            if custom_id not in self._requests:
+                # Already recorded before a restart
+                continue
+            try:
+                result = results.get(custom_id)
+                if result is None or result.type != "succeeded":
+                    self._failed(fs, result, self._requests[custom_id], request["attempt"])
+                    continue
+                calls = fs.session.handle_response(result.message, latency)
+                if calls is None:
+                    print(f"[{fs.name}] turn {fs.session.turn}: {result.message.stop_reason}")
+                    continue
+                tools = ToolBatch(self.pool, fs.workspace, fs.session.turn)
+                running.append((fs, result.message, [(block, tools.submit(block.name, block.input)) for block in calls]))
+            except Exception as e:
+                self._fatal(fs, e)
+
+        # Every session's tools were started above, so they run side by side
+        for fs, message, scheduled in running:
+            try:
+                fs.session.add_tool_results([(block, future.result(), future.duration) for block, future in scheduled])
+                print(f"[{fs.name}] turn {fs.session.turn}: {message.stop_reason} ({len(scheduled)} tool calls)")
+            except Exception as e:
+                self._fatal(fs, e)
+
+        self.state = {"batch_id": None, "submitted": None, "requests": {}}
+        self._requests = {}
+        self._save()
+
+    def _failed(self, fs, result, api_kwargs, attempt):
+        """Queue a request that didn't succeed for the next batch, or end the session."""
+        session = fs.session
+        kind = result.type if result is not None else "missing"
+        if kind == "errored":
+            error = result.error.error
+            if error.type in FATAL_ERRORS:
+                # A stale container is the one invalid request that can be fixed here
+                if not session.drop_stale_container(f"{error.type}: {error.message}"):
+                    fs.error = f"{error.type}: {error.message}"
+                    print(f"[{fs.name}] fatal error: {fs.error}")
+                    return
+                api_kwargs.pop("container", None)
+            detail = f"{error.type}: {error.message}"
+        else:
+            detail = kind
+        if attempt >= MAX_ATTEMPTS:
+            fs.error = f"request failed {attempt} times ({detail})"
+            loop.log(session.f, f"Batch request failed {attempt} times ({detail}); giving up", is_system=True)
+            print(f"[{fs.name}] giving up: {fs.error}")
+            return
+        loop.log(session.f, f"Batch request failed ({detail}); resubmitting in the next batch", is_system=True)
+        print(f"[{fs.name}] turn {session.turn}: {detail}, resubmitting")
+        self._retry[fs.name] = (api_kwargs, attempt)
+
+    def _fatal(self, fs, error):
+        fs.error = error
+        loop.log(fs.session.f, f"Fatal error:\n```\n{traceback.format_exc()}\n```", is_system=True)
+        print(f"[{fs.name}] fatal error: {error}")
+
+    def run(self):
+        """Submit, wait and collect until every session is finished."""
+        if self.state.get("pending"):
+            batch_id = self.find_pending()
+            if batch_id:
+                print(f"Batch {batch_id} was submitted just before the run stopped")
+                self.state = {"batch_id": batch_id, "submitted": self.state["submitted"], "requests": self.state["requests"]}
+            else:
+                print("The batch being submitted when the run stopped never reached the API; submitting it again")
+                self.state = {"batch_id": None, "submitted": None, "requests": {}}
+            self._save()
+        if self.state["batch_id"]:
+            print(f"Batch {self.state['batch_id']} was in flight; collecting it")
+            self.reattach()
+        while True:
+            if self.state["batch_id"]:
+                self.wait()
+                self.collect()
+            for fs in self.sessions.values():
+                if fs.session.done and not fs.error and fs.name not in self.finished:
+                    self.finished.add(fs.name)
+                    print(f"[{fs.name}] finished after {fs.session.turn} turns")
+            if not self.active():
+                return
+            self.submit()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many autonomy sessions through the Message Batches API.")
+    parser.add_argument("--sessions", type=int, default=1, help="number of sessions (with --task or no task)")
+    parser.add_argument("--task", default=os.getenv("INITIAL_TASK", "").strip(), help="task given to every session")
+    parser.add_argument("--tasks", help="file with one task per line; one session per task")
+    parser.add_argument("--dir", type=Path, default=BATCH_DIR, help=f"batch directory (default: {BATCH_DIR})")
+    parser.add_argument("--resume", action="store_true", help="continue each session's latest transcript and any batch in flight")
+    args = parser.parse_args()
+
+    args.dir.mkdir(parents=True, exist_ok=True)
+    state_path = args.dir / STATE_FILE
+    if not args.resume and state_path.is_file():
+        state = json.loads(state_path.read_text())
+        if state.get("batch_id") or state.get("pending"):
+            parser.error(f"a batch is still in flight ({state_path}); pass --resume to collect it")
+
+    if args.tasks:
+        tasks = [line.strip() for line in Path(args.tasks).read_text().splitlines() if line.strip()]
+    else:
+        tasks = [args.task] * args.sessions
+    registry = None
+    if loop.METRICS_PORT:
+        registry = MetricsRegistry()
+        serve(registry, loop.METRICS_PORT, loop.METRICS_HOST)
+    width = len(str(len(tasks)))
+    sessions = [
+        open_session(f"session-{i:0{width}d}", task, args.dir, args.resume, registry)
+        for i, task in enumerate(tasks, 1)
+    ]
+    print(f"Batch run of {len(sessions)} sessions in {args.dir} ({BATCH_TOOL_WORKERS} tool workers)")
+    print("Stop with: Ctrl+C (continue later with --resume)\n")
+
+    client = anthropic.Anthropic(max_retries=0)
+    retry_policy = RetryPolicy(loop.RETRY_BASE_DELAY, loop.RETRY_MAX_DELAY, loop.RETRY_BREAKER_THRESHOLD, loop.RETRY_BREAKER_PAUSE)
+    runner = BatchRunner(client, sessions, args.dir, retry_policy)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        print("\nStopped by human.")
+        if runner.state["batch_id"]:
+            print(f"Batch {runner.state['batch_id']} is still processing; run again with --resume to collect it.")
+        for fs in runner.active():
+            loop.log(fs.session.f, f"Loop ended by human after {fs.session.turn} turns.", is_system=True)
+    finally:
+        runner.close()
+        for fs in sessions:
+            fs.session.close()
+
+    print(f"\n{runner.batches} batches submitted")
+    for fs in sessions:
+        status = f"error: {fs.error}" if fs.error else f"{fs.session.turn} turns"
+        print(f"{fs.name}: {status} — {fs.session.token_summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+History compaction against a long session: prompt size and loop latency with
+and without a context budget.
+
+Each variant runs main() in a fresh interpreter against FakeMessagesAPI on
+the same synthetic session: turns whose command prints a large output, so
+the history grows by roughly 12k tokens of tool results per turn. Every
+request the loop sends is kept, and for each variant the benchmark reports:
+
+  input tokens     per request and in total, estimated from the request the
+                   way the fake API counts them (characters / 4)
+  cacheable        the part of each request that repeats the previous
+                   request's messages from the start, i.e. what the prompt
+                   cache could serve; the rest has to be processed anew.
+                   Compaction rewrites old messages, so it costs cache reuse
+                   on the request where it happens.
+  loop latency     time from a response going out to the next request
+                   arriving: the loop's own work, compaction included
+  compactions      requests that were sent with a freshly compacted history
+
+API latency itself can't be measured offline; it grows with the tokens that
+aren't served from the cache, which is what the "uncached" total shows.
+
+Variants: off (CONTEXT_TOKEN_BUDGET=0, the history is sent whole) and on
+(CONTEXT_TOKEN_BUDGET=--budget).
+
+Usage: python3 benchmarks/bench_context.py [--turns N] [--budget TOKENS] [--json]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_api import FakeMessagesAPI, large_outputs, run_loop_child
+
+
+class RecordingAPI(FakeMessagesAPI):
+    """FakeMessagesAPI that also keeps the serialized messages of every request."""
+
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.bodies = []
+
+    def _next_response(self, body: dict) -> dict:
+        self.bodies.append(json.dumps(_without_cache_control(body.get("messages", [])), sort_keys=True))
+        return super()._next_response(body)
+
+
+def _without_cache_control(value):
+    """Drop cache breakpoints, which move every request but don't change the prompt.
+
+    A message that carries a breakpoint has its string content turned into a
+    text block, which is the same prompt, so string content is normalized
+    to a block too.
+    """
+    if isinstance(value, dict):
+        if isinstance(value.get("content"), str) and "role" in value:
+            value = {**value, "content": [{"type": "text", "text": value["content"]}]}
+        return {k: _without_cache_control(v) for k, v in value.items() if k != "cache_control"}
+    if isinstance(value, list):
+        return [_without_cache_control(v) for v in value]
+    return value
+
+
+def _shared_prefix(a: str, b: str) -> int:
+    """Length of the common prefix of two strings."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def run_variant(turns: int, budget: int) -> dict:
+    api = RecordingAPI(large_outputs(turns)).start()
+    base = tempfile.mkdtemp(prefix="bench-context-")
+    env = {
+        "ANTHROPIC_BASE_URL": api.base_url,
+        "ANTHROPIC_API_KEY": "bench",
+        "MAX_TURNS": str(2 * turns + 10),
+        "CONTEXT_TOKEN_BUDGET": str(budget),
+        "CONTEXT_ESTIMATOR": "local",
+    }
+    run_loop_child(base, env)
+    api.stop()
+
+    tokens = [len(body) // 4 for body in api.bodies]
+    cacheable = [0] + [_shared_prefix(prev, cur) // 4 for prev, cur in zip(api.bodies, api.bodies[1:])]
+    # A request that shares less than the whole previous request was sent after a compaction
+    compactions = sum(1 for prev, cur in zip(api.bodies, api.bodies[1:]) if not cur.startswith(prev[:-1]))
+    gaps = [cur["received"] - prev["sent"] for prev, cur in zip(api.requests, api.requests[1:])]
+    return {
+        "requests": len(tokens),
+        "input_tokens_total": sum(tokens),
+        "input_tokens_p50": int(statistics.median(tokens)),
+        "input_tokens_max": max(tokens),
+        "uncached_tokens_total": sum(t - c for t, c in zip(tokens, cacheable)),
+        "compactions": compactions,
+        "loop_latency_p50_ms": round(statistics.median(gaps) * 1000, 2),
+        "loop_latency_max_ms": round(max(gaps) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history compaction on a long synthetic session.")
+    parser.add_argument("--turns", type=int, default=40, help="turns with a large command output")
+    parser.add_argument("--budget", type=int, default=100_000, help="CONTEXT_TOKEN_BUDGET of the 'on' variant")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {"off": run_variant(args.turns, 0), "on": run_variant(args.turns, args.budget)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    rows = (
+        ("requests", "requests"),
+        ("input tokens, total", "input_tokens_total"),
+        ("input tokens, p50", "input_tokens_p50"),
+        ("input tokens, max", "input_tokens_max"),
+        ("uncached tokens, total", "uncached_tokens_total"),
+        ("compactions", "compactions"),
+        ("loop latency p50 (ms)", "loop_latency_p50_ms"),
+        ("loop latency max (ms)", "loop_latency_max_ms"),
+    )
+    print(f"{'':<24} {'off':>12} {'on':>12} {'change':>8}")
+    for label, key in rows:
+        off, on = results["off"][key], results["on"][key]
+        change = f"{on / off - 1:+.0%}" if off else ""
+        print(f"{label:<24} {off:>12,} {on:>12,} {change:>8}")
+
+
+if __name__ == "__main__":
+    main()
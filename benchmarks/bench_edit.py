@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Output tokens per edit: rewriting a whole file with write_file / write_notes
+vs the edit tools (edit_file, replace_lines, apply_patch, append_file,
+append_notes).
+
+For each scenario every approach is run through execute_tool on a scratch
+workspace and checked to produce the same file. The cost reported is the
+size of the tool call the model has to write (its JSON input), estimated at
+four characters per token like the loop's context estimator, plus what it
+has to read into context first to reproduce the file.
+
+Usage: python3 benchmarks/bench_edit.py [--json]
+"""
+
+import argparse
+import difflib
+import json
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tools
+from context import CHARS_PER_TOKEN
+
+
+def source_file(lines: int) -> str:
+    rng = random.Random(0)
+    words = ["value", "result", "config", "index", "buffer", "count", "total", "item", "state", "limit"]
+    return "".join(f"    {rng.choice(words)}_{i} = compute({rng.choice(words)}, {i})\n" for i in range(lines))
+
+
+def unified_diff(path: str, before: str, after: str) -> str:
+    return "".join(difflib.unified_diff(
+        before.splitlines(keepends=True), after.splitlines(keepends=True), f"a/{path}", f"b/{path}", n=2
+    ))
+
+
+def scenarios():
+    """Yield (name, path, before, after, {approach: (tool, input)}) for each edit."""
+    big = source_file(4_000)  # ~200KB
+    lines = big.splitlines(keepends=True)
+    changed = lines[2000].replace("compute", "compute_fast")
+    after = "".join(lines[:2000] + [changed] + lines[2001:])
+    yield "1 line of a 200KB file", "big.py", big, after, {
+        "write_file": ("write_file", {"path": "big.py", "content": after}),
+        "edit_file": ("edit_file", {"path": "big.py", "old_string": lines[2000], "new_string": changed}),
+        "replace_lines": ("replace_lines", {"path": "big.py", "start_line": 2001, "end_line": 2001, "content": changed}),
+        "apply_patch": ("apply_patch", {"patch": unified_diff("big.py", big, after)}),
+    }
+
+    medium = source_file(400)  # ~20KB
+    lines = medium.splitlines(keepends=True)
+    edited = list(lines)
+    for n in (50, 200, 350):
+        edited[n] = edited[n].replace("compute", "recompute")
+    after = "".join(edited)
+    yield "3 lines of a 20KB file", "medium.py", medium, after, {
+        "write_file": ("write_file", {"path": "medium.py", "content": after}),
+        "apply_patch": ("apply_patch", {"patch": unified_diff("medium.py", medium, after)}),
+    }
+
+    notes = "".join(f"- Run {i}: explored something and wrote it down in a sentence or two.\n" for i in range(80))
+    line = "- Run 80: found the bug in the parser.\n"
+    yield "1 line added to 6KB notes", None, notes, notes + line, {
+        "write_notes": ("write_notes", {"content": notes + line}),
+        "append_notes": ("append_notes", {"content": line}),
+    }
+
+    log = source_file(2_000)
+    line = "    done = True\n"
+    yield "append to a 100KB file", "log.py", log, log + line, {
+        "write_file": ("write_file", {"path": "log.py", "content": log + line}),
+        "append_file": ("append_file", {"path": "log.py", "content": line}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Output tokens per edit: whole-file rewrites vs edit tools.")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = []
+    for name, path, before, after, approaches in scenarios():
+        rows = {}
+        for approach, (tool, tool_input) in approaches.items():
+            base = Path(tempfile.mkdtemp(prefix="bench-edit-"))
+            ws = tools.Workspace(base / "workspace", base / "memory")
+            target = ws.root / path if path else ws.notes_file
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_text(before)
+            result = tools.execute_tool(tool, tool_input, ws)
+            if target.read_text() != after:
+                raise SystemExit(f"{name}: {approach} produced a different file: {result}")
+            output_chars = len(json.dumps(tool_input))
+            # A full rewrite needs the whole file in context to reproduce it
+            read_chars = len(before) if tool in ("write_file", "write_notes") else 0
+            rows[approach] = {
+                "output_tokens": output_chars // CHARS_PER_TOKEN,
+                "read_tokens": read_chars // CHARS_PER_TOKEN,
+            }
+        results.append({"scenario": name, "file_bytes": len(before), "approaches": rows})
+
+    if args.json:
+        print(json.dumps({"benchmark": "edit", "results": results}, indent=2))
+        return
+    print(f"{'scenario':<28} {'tool':<14} {'output tokens':>14} {'read first':>11} {'vs rewrite':>11}")
+    for r in results:
+        baseline = next(iter(r["approaches"].values()))["output_tokens"]
+        for approach, row in r["approaches"].items():
+            ratio = f"{row['output_tokens'] / baseline:.1%}" if baseline else "-"
+            print(f"{r['scenario']:<28} {approach:<14} {row['output_tokens']:>14,} {row['read_tokens']:>11,} {ratio:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the autonomy loop against a local fake Messages API.
+
+Each scenario runs main() in a fresh interpreter against FakeMessagesAPI,
+with a throwaway workspace, memory and log directory. The fake server
+timestamps every request, so the loop's own per-turn overhead is the gap
+between a response going out and the next request arriving. Also reported:
+startup time to the first request, growth of the `messages` payload across
+turns, the child's peak RSS, and tool throughput through ToolBatch.
+
+Usage:
+  python3 benchmarks/bench_loop.py                      # all scenarios, table
+  python3 benchmarks/bench_loop.py --json -o run.json   # machine-readable results
+  python3 benchmarks/bench_loop.py --baseline run.json  # compare with an earlier run
+  python3 benchmarks/bench_loop.py --transcript logs/autonomy_....jsonl  # replay a session
+
+Loop settings come from the environment as usual (STREAMING=0, ...).
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_api import SCENARIOS, FakeMessagesAPI, responses_from_transcript, start_loop_child
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def ms_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    if not ms:
+        return {"count": 0}
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+
+def run_scenario(responses) -> dict:
+    """Run main() in a child process against the scripted responses and measure it."""
+    api = FakeMessagesAPI(responses).start()
+    base = Path(tempfile.mkdtemp(prefix="bench-loop-"))
+    (base / "workspace").mkdir()
+    (base / "workspace" / "bench.txt").write_text("benchmark file\n" * 256)
+    env = {
+        "ANTHROPIC_BASE_URL": api.base_url,
+        "ANTHROPIC_API_KEY": "bench",
+        "MAX_TURNS": str(len(responses) + 10),
+    }
+    start = time.perf_counter()
+    proc = start_loop_child(base, env)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    api.stop()
+
+    requests = api.requests
+    gaps = {"all": [], "after_tool_use": [], "after_other": []}
+    for prev, cur in zip(requests, requests[1:]):
+        gap = cur["received"] - prev["sent"]
+        gaps["all"].append(gap)
+        gaps["after_tool_use" if prev["stop_reason"] == "tool_use" else "after_other"].append(gap)
+    sizes = [r["messages_bytes"] for r in requests]
+    growth = (sizes[-1] - sizes[0]) / (len(sizes) - 1) if len(sizes) > 1 else 0
+
+    return {
+        "exit_code": proc.returncode,
+        "requests": len(requests),
+        "wall_s": round(wall, 3),
+        "startup_ms": round((requests[0]["received"] - start) * 1000, 1) if requests else None,
+        "overhead": {kind: ms_summary(values) for kind, values in gaps.items()},
+        "messages_bytes": {
+            "first": sizes[0] if sizes else 0,
+            "last": sizes[-1] if sizes else 0,
+            "growth_per_request": round(growth, 1),
+        },
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+    }
+
+
+def tool_throughput(calls: int) -> dict:
+    """Calls per second through ToolBatch, one call at a time vs on a thread pool."""
+    import tools
+
+    base = Path(tempfile.mkdtemp(prefix="bench-tools-"))
+    tools.WORKSPACE_DIR = base
+    (base / "bench.txt").write_text("benchmark file\n" * 256)
+    workloads = {
+        "read_file": ("read_file", {"path": "bench.txt"}),
+        "list_files": ("list_files", {"path": "."}),
+        "run_command": ("run_command", {"command": "true"}),
+    }
+    results = {}
+    for label, (name, tool_input) in workloads.items():
+        results[label] = {}
+        for mode, executor in (("sequential", None), ("pooled", ThreadPoolExecutor(4))):
+            batch = tools.ToolBatch(executor)
+            start = time.perf_counter()
+            futures = [batch.submit(name, tool_input) for _ in range(calls)]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - start
+            results[label][mode] = round(calls / elapsed, 1)
+            if executor:
+                executor.shutdown()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def print_table(results: dict, baseline: dict = None):
+    print(f"commit {results['commit']}  streaming={results['settings']['STREAMING']}")
+    print(f"{'scenario':<14} {'reqs':>5} {'overhead p50':>13} {'p95':>9} {'startup':>9} {'msg growth/req':>15} {'peak RSS':>9}")
+    for name, r in results["scenarios"].items():
+        o = r["overhead"]["all"]
+        line = (
+            f"{name:<14} {r['requests']:>5} {o.get('p50_ms', 0):>11.2f}ms {o.get('p95_ms', 0):>7.2f}ms "
+            f"{r['startup_ms']:>7.0f}ms {r['messages_bytes']['growth_per_request']:>13,.0f}B {r['peak_rss_mb']:>7.1f}MB"
+        )
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old and old["overhead"]["all"].get("p50_ms"):
+            change = o["p50_ms"] / old["overhead"]["all"]["p50_ms"] - 1
+            line += f"  ({change:+.0%} p50 vs {baseline['commit']})"
+        print(line)
+    print()
+    print(f"{'tool':<12} {'sequential':>12} {'pooled':>12}  (calls/s)")
+    for name, r in results["tools"].items():
+        print(f"{name:<12} {r['sequential']:>12,.0f} {r['pooled']:>12,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the autonomy loop.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--turns", type=int, default=50, help="scripted turns per scenario")
+    parser.add_argument("--transcript", help="also replay the responses recorded in this session transcript")
+    parser.add_argument("--tool-calls", type=int, default=200, help="calls per tool throughput workload")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    scripts = {name: SCENARIOS[name](args.turns) for name in args.scenarios.split(",") if name}
+    if args.transcript:
+        scripts["transcript"] = responses_from_transcript(args.transcript)
+
+    results = {
+        "benchmark": "loop",
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {key: os.getenv(key, "default") for key in ("STREAMING", "TOOL_CONCURRENCY", "PERSISTENT_SHELL", "PROMPT_CACHING", "CONTEXT_TOKEN_BUDGET", "TURN_POLICY")},
+        "turns": args.turns,
+        "scenarios": {name: run_scenario(script) for name, script in scripts.items()},
+        "tools": tool_throughput(args.tool_calls),
+    }
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+        print_table(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Peak memory of run_command as command output grows.
+
+Each size runs in a fresh interpreter so its peak RSS is measured alone.
+
+Usage: python3 benchmarks/bench_output.py [--sizes-mb 1,100,1000] [--json]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_api import child_script
+
+# Run after fake_api.child_script() has pointed the tools at a scratch workspace
+MEASURE = """
+import json, resource, time
+tools.PERSISTENT_SHELL = {persistent!r}
+start = time.perf_counter()
+result = tools.execute_tool("run_command", {{"command": "head -c {size} /dev/zero | tr '\\\\0' x", "timeout": 120}})
+print(json.dumps({{
+    "seconds": round(time.perf_counter() - start, 3),
+    "result_bytes": len(result),
+    "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+}}))
+"""
+
+
+def measure(size: int, persistent: bool) -> dict:
+    base = Path(tempfile.mkdtemp())
+    (base / "workspace").mkdir()
+    code = child_script(base, MEASURE.format(persistent=persistent, size=size))
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes-mb", default="1,100,1000")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = []
+    for mb in (int(s) for s in args.sizes_mb.split(",")):
+        for persistent in (True, False):
+            r = measure(mb * 1_000_000, persistent)
+            results.append({"output_mb": mb, "persistent_shell": persistent, **r})
+
+    if args.json:
+        print(json.dumps({"benchmark": "output", "results": results}, indent=2))
+        return
+    print(f"{'output':>8} {'shell':>11} {'peak RSS':>10} {'time':>8}")
+    for r in results:
+        shell = "persistent" if r["persistent_shell"] else "fresh"
+        print(f"{r['output_mb']:>6}MB {shell:>11} {r['peak_rss_mb']:>8.1f}MB {r['seconds']:>7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+search_workspace on a synthetic workspace: index build, query latency with
+nothing changed and after a few edits, compared with grep -rn.
+
+Usage: python3 benchmarks/bench_search.py [--files N] [--queries N] [--json]
+"""
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from search import SearchIndex
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet",
+         "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango"]
+QUERIES = ["def handler_417", "needle", "golf hotel", "config", "TODO"]
+
+
+def build_workspace(root: Path, files: int):
+    """Write `files` small source files spread over nested directories."""
+    rng = random.Random(0)
+    for i in range(files):
+        directory = root / f"pkg{i % 50}" / f"mod{i % 7}"
+        directory.mkdir(parents=True, exist_ok=True)
+        lines = [f"def handler_{i}(config):"]
+        lines += ["    " + " ".join(rng.choices(WORDS, k=8)) for _ in range(40)]
+        if i % 1000 == 0:
+            lines.append("    # TODO: find the needle")
+        (directory / f"file_{i}.py").write_text("\n".join(lines) + "\n")
+
+
+def ms(samples):
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search_workspace.")
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=5, help="repetitions of each query")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="bench-search-"))
+    build_workspace(root, args.files)
+
+    index = SearchIndex(root)
+    start = time.perf_counter()
+    index.refresh()
+    build = time.perf_counter() - start
+
+    queries = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            index.search(query)
+            samples.append(time.perf_counter() - start)
+        queries[query] = ms(samples)
+
+    # A few edits between queries (as after a write_file or run_command):
+    # the workspace is walked again, but only the touched files are re-read
+    edited = []
+    for n in range(args.queries):
+        for path in list(root.glob(f"pkg{n}/mod0/*.py"))[:10]:
+            path.write_text(path.read_text() + f"# edit {n}\n")
+        index.mark_stale()
+        start = time.perf_counter()
+        index.search("needle")
+        edited.append(time.perf_counter() - start)
+
+    grep = []
+    for _ in range(args.queries):
+        start = time.perf_counter()
+        subprocess.run(["grep", "-rn", "needle", str(root)], capture_output=True)
+        grep.append(time.perf_counter() - start)
+    index.close()
+
+    results = {
+        "files": args.files,
+        "index_build_s": round(build, 2),
+        "index_mb": round((root / ".search-index.sqlite").stat().st_size / 1e6, 1),
+        "queries": queries,
+        "after_10_edits": ms(edited),
+        "grep_rn": ms(grep),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.files:,} files: index built in {results['index_build_s']}s ({results['index_mb']}MB)")
+    print(f"{'query':<20} {'p50':>10} {'max':>10}")
+    for query, r in queries.items():
+        print(f"{query:<20} {r['p50_ms']:>8.1f}ms {r['max_ms']:>8.1f}ms")
+    for label, r in (("after 10 edits", results["after_10_edits"]), ("grep -rn", results["grep_rn"])):
+        print(f"{label:<20} {r['p50_ms']:>8.1f}ms {r['max_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Per-call latency of run_command: a fresh shell per call vs the persistent session.
+
+Usage: python3 benchmarks/bench_shell.py [--calls N] [--json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from shell import OutputBuffer, ShellSession
+
+COMMANDS = {
+    "true": "true",
+    "echo": "echo hello",
+    "python": "python3 -c pass",
+}
+
+# The cd/source preamble a fresh shell has to repeat on every call to reach
+# the state a persistent session keeps (activate.sh stands in for a venv)
+PREAMBLE = "cd project && . ./activate.sh && "
+ACTIVATE_SH = "".join(f"export VAR_{i}=value_{i}\n" for i in range(200)) + 'PATH="$PWD/bin:$PATH"\n'
+# Head and tail kept per stream, as run_command does
+BUFFER_WINDOW = 12_500
+
+
+def time_calls(run, command, calls):
+    """Run a command `calls` times and return per-call latencies in milliseconds."""
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        run(command)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    cwd = tempfile.mkdtemp()
+    (Path(cwd) / "project").mkdir()
+    (Path(cwd) / "project" / "activate.sh").write_text(ACTIVATE_SH)
+    session = ShellSession(cwd)
+
+    def fresh(command):
+        subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30, cwd=cwd)
+
+    def persistent(command):
+        session.run(command, 30, OutputBuffer(BUFFER_WINDOW, BUFFER_WINDOW), OutputBuffer(BUFFER_WINDOW, BUFFER_WINDOW))
+
+    results = {}
+    for label, command in COMMANDS.items():
+        results[label] = {
+            "fresh": summarize(time_calls(fresh, command, args.calls)),
+            "persistent": summarize(time_calls(persistent, command, args.calls)),
+        }
+    persistent(PREAMBLE + "true")
+    results["echo+preamble"] = {
+        "fresh": summarize(time_calls(fresh, PREAMBLE + "echo hello", args.calls)),
+        "persistent": summarize(time_calls(persistent, "echo hello", args.calls)),
+    }
+    session.close()
+
+    if args.json:
+        print(json.dumps({"benchmark": "shell", "calls": args.calls, "results": results}, indent=2))
+        return
+    print(f"{'command':<14} {'fresh p50':>12} {'persistent p50':>16} {'speedup':>9}")
+    for label, r in results.items():
+        speedup = r["fresh"]["p50_ms"] / r["persistent"]["p50_ms"]
+        print(f"{label:<14} {r['fresh']['p50_ms']:>10.2f}ms {r['persistent']['p50_ms']:>14.2f}ms {speedup:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Startup time of the autonomy loop: process start to the first API request.
+
+Each run starts main() in a fresh interpreter against FakeMessagesAPI (one
+response: DONE) and measures, from outside, how long the first request
+takes to arrive; the loop's own startup breakdown (interpreter and
+imports, session setup, preload, creating the client) is read back from
+the run's metrics file. Variants:
+
+  lazy      the loop as it is: the SDK is imported when the client is first used
+  eager     the SDK imported before the loop module, as it used to be
+  preload   lazy, with PRELOAD_CONTEXT=1 (notes and workspace listing in
+            the initial message)
+
+Usage: python3 benchmarks/bench_startup.py [--runs N] [--json]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_api import FakeMessagesAPI, run_loop_child
+
+
+VARIANTS = {
+    "lazy": ("", {}),
+    "eager": ("import anthropic", {}),
+    "preload": ("", {"PRELOAD_CONTEXT": "1"}),
+}
+# Phases of the loop's own startup breakdown, in order
+PHASES = ("process", "preload", "session", "client")
+
+
+def build_base() -> Path:
+    """A workspace and notes like those of a session that has run before."""
+    base = Path(tempfile.mkdtemp(prefix="bench-startup-"))
+    (base / "workspace" / "src").mkdir(parents=True)
+    (base / "memory").mkdir()
+    for i in range(20):
+        (base / "workspace" / "src" / f"module_{i}.py").write_text("x = 1\n" * 100)
+    (base / "workspace" / "README.md").write_text("# Project\n")
+    (base / "memory" / "notes.md").write_text("Working on the parser. Next: error messages.\n" * 40)
+    return base
+
+
+def run_once(variant: str) -> dict:
+    preimport, extra_env = VARIANTS[variant]
+    api = FakeMessagesAPI([]).start()
+    base = build_base()
+    env = {"ANTHROPIC_BASE_URL": api.base_url, "ANTHROPIC_API_KEY": "bench", "METRICS": "1", **extra_env}
+    start = time.perf_counter()
+    run_loop_child(base, env, preamble=preimport)
+    api.stop()
+    first = (api.requests[0]["received"] - start) if api.requests else None
+    phases = {}
+    for path in (base / "logs").glob("autonomy_*.metrics.jsonl"):
+        for line in path.read_text().splitlines():
+            record = json.loads(line)
+            if record.get("type") == "startup":
+                phases = {k: v for k, v in record.items() if k != "type"}
+    return {"first_request": first, "phases": phases}
+
+
+def summarize(runs: list) -> dict:
+    result = {"first_request_ms": round(statistics.median(r["first_request"] for r in runs) * 1000, 1)}
+    for phase in PHASES:
+        values = [r["phases"][phase] for r in runs if r["phases"].get(phase) is not None]
+        if values:
+            result[f"{phase}_ms"] = round(statistics.median(values) * 1000, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the loop's startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="runs per variant")
+    parser.add_argument("--variants", default=",".join(VARIANTS), help="comma-separated: " + ", ".join(VARIANTS))
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    for variant in args.variants.split(","):
+        results[variant] = summarize([run_once(variant) for _ in range(args.runs)])
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    phases = [p for p in PHASES if any(f"{p}_ms" in r for r in results.values())]
+    print(f"{'variant':<10} {'1st request':>12}" + "".join(f" {p:>12}" for p in phases))
+    for variant, r in results.items():
+        print(f"{variant:<10} {r['first_request_ms']:>10.0f}ms" + "".join(
+            f" {r[p + '_ms']:>10.0f}ms" if p + "_ms" in r else f" {'-':>12}" for p in phases
+        ))
+
+
+if __name__ == "__main__":
+    main()
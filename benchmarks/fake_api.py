@@ -0,0 +1,294 @@
+"""
+Local stand-in for the Messages API, for benchmarking the loop offline.
+
+FakeMessagesAPI serves POST /v1/messages from a script of canned responses,
+as plain JSON or as a server-sent event stream when the request asks for
+one, and POST /v1/messages/count_tokens with a size-based count. Once the script runs out it answers with a final "DONE" so the loop
+ends. Every request is timed, which lets a benchmark separate the loop's
+own overhead (time between a response going out and the next request
+coming in) from the API.
+
+Scripted responses are dicts with "content" and "stop_reason"; usage is
+filled in. A streamed response with "stream_error_after": N breaks off
+after N content blocks with an overloaded_error event, as the API does when
+it fails mid-response. Scenario builders below produce synthetic scripts, and
+responses_from_transcript() replays a recorded session. run_loop_child()
+runs the loop's main() in a child process with its workspace, notes and
+logs under one directory, for pointing at the fake.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FINAL_RESPONSE = {"content": [{"type": "text", "text": "Finished.\nDONE"}], "stop_reason": "end_turn"}
+
+
+def _sse_events(message: dict):
+    """Yield (event, data) pairs that stream `message` the way the API does."""
+    error_after = message.pop("stream_error_after", None)
+    yield "message_start", {"type": "message_start", "message": {**message, "content": [], "stop_reason": None}}
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            yield "content_block_start", {"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}}
+            text = block["text"]
+            for i in range(0, len(text), 64):
+                yield "content_block_delta", {"type": "content_block_delta", "index": index, "delta": {"type": "text_delta", "text": text[i:i + 64]}}
+        elif block["type"] == "tool_use":
+            yield "content_block_start", {"type": "content_block_start", "index": index, "content_block": {**block, "input": {}}}
+            yield "content_block_delta", {"type": "content_block_delta", "index": index, "delta": {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}}
+        else:
+            yield "content_block_start", {"type": "content_block_start", "index": index, "content_block": block}
+        yield "content_block_stop", {"type": "content_block_stop", "index": index}
+        if index + 1 == error_after:
+            yield "error", {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+            return
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+
+class FakeMessagesAPI:
+    """A threaded HTTP server that answers Messages API calls from a script."""
+
+    def __init__(self, responses, latency=0.0, count_latency=0.0):
+        self.responses = list(responses)
+        self.latency = latency
+        self.count_latency = count_latency
+        self.token_counts = 0
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_response(self, body: dict) -> dict:
+        with self._lock:
+            scripted = self.responses.pop(0) if self.responses else FINAL_RESPONSE
+        input_tokens = len(json.dumps(body.get("messages", []))) // 4
+        return {
+            "id": f"msg_fake_{len(self.requests)}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(json.dumps(scripted["content"])) // 4},
+            **scripted,
+        }
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                received = time.perf_counter()
+                raw = self.rfile.read(int(self.headers["Content-Length"]))
+                body = json.loads(raw)
+                if self.path.endswith("/count_tokens"):
+                    self._count_tokens(body)
+                    return
+                record = {
+                    "received": received,
+                    "request_bytes": len(raw),
+                    "messages_bytes": len(json.dumps(body.get("messages", []))),
+                    "messages": len(body.get("messages", [])),
+                    "stream": bool(body.get("stream")),
+                }
+                message = api._next_response(body)
+                if api.latency:
+                    time.sleep(api.latency)
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for event, data in _sse_events(message):
+                        payload = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+                        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    message.pop("stream_error_after", None)
+                    data = json.dumps(message).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                self.wfile.flush()
+                record["sent"] = time.perf_counter()
+                record["stop_reason"] = message["stop_reason"]
+                with api._lock:
+                    api.requests.append(record)
+
+            def _count_tokens(self, body):
+                if api.count_latency:
+                    time.sleep(api.count_latency)
+                prompt = [body.get("system"), body.get("tools"), body.get("messages")]
+                data = json.dumps({"input_tokens": len(json.dumps(prompt)) // 4}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with api._lock:
+                    api.token_counts += 1
+
+        return Handler
+
+
+# --- Scenario builders ---
+
+def _tool_use(index: int, name: str, tool_input: dict) -> dict:
+    return {"type": "tool_use", "id": f"toolu_bench_{index:06d}", "name": name, "input": tool_input}
+
+
+def text_turns(turns: int, chars: int = 2_000) -> list:
+    """Plain text responses: measures per-turn loop overhead with no tools."""
+    text = ("All work and no play makes a dull loop. " * (chars // 40 + 1))[:chars]
+    return [{"content": [{"type": "text", "text": text}], "stop_reason": "end_turn"} for _ in range(turns)]
+
+
+def tool_bursts(turns: int, calls: int = 10) -> list:
+    """Responses that each issue a burst of small read_file and list_files calls."""
+    responses = []
+    n = 0
+    for _ in range(turns):
+        content = [{"type": "text", "text": "Looking around."}]
+        for i in range(calls):
+            n += 1
+            if i % 2:
+                content.append(_tool_use(n, "list_files", {"path": "."}))
+            else:
+                content.append(_tool_use(n, "read_file", {"path": "bench.txt"}))
+        responses.append({"content": content, "stop_reason": "tool_use"})
+        responses.append({"content": [{"type": "text", "text": "Done looking."}], "stop_reason": "end_turn"})
+    return responses
+
+
+def large_outputs(turns: int, output_bytes: int = 200_000) -> list:
+    """Responses whose command prints a lot: capture, logging and history growth."""
+    responses = []
+    for n in range(turns):
+        command = f"head -c {output_bytes} /dev/zero | tr '\\0' x"
+        responses.append({"content": [_tool_use(n, "run_command", {"command": command})], "stop_reason": "tool_use"})
+        responses.append({"content": [{"type": "text", "text": "That was long."}], "stop_reason": "end_turn"})
+    return responses
+
+
+def pause_turns(turns: int) -> list:
+    """Alternating pause_turn and end_turn responses."""
+    responses = []
+    for _ in range(turns):
+        responses.append({"content": [{"type": "text", "text": "Still working..."}], "stop_reason": "pause_turn"})
+        responses.append({"content": [{"type": "text", "text": "Done."}], "stop_reason": "end_turn"})
+    return responses
+
+
+def max_tokens_turns(turns: int, chars: int = 8_000) -> list:
+    """Responses cut off by the output limit."""
+    text = "x" * chars
+    return [{"content": [{"type": "text", "text": text}], "stop_reason": "max_tokens"} for _ in range(turns)]
+
+
+def responses_from_transcript(path) -> list:
+    """Replay the API responses recorded in a session transcript (logs/autonomy_*.jsonl)."""
+    responses = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("type") == "response":
+                responses.append({"content": record["content"], "stop_reason": record["stop_reason"]})
+    return responses
+
+
+SCENARIOS = {
+    "text": text_turns,
+    "tool_burst": tool_bursts,
+    "large_output": large_outputs,
+    "pause_turn": pause_turns,
+    "max_tokens": max_tokens_turns,
+}
+
+
+# --- Running the loop in a child process ---
+
+_CHILD_SETUP = """
+import sys
+{preamble}
+import importlib
+from pathlib import Path
+sys.path.insert(0, {root!r})
+import tools
+base = Path({base!r})
+tools.WORKSPACE_DIR = base / "workspace"
+tools.MEMORY_DIR = base / "memory"
+tools.NOTES_FILE = tools.MEMORY_DIR / "notes.md"
+"""
+
+
+def child_script(base, body: str, preamble: str = "") -> str:
+    """Python source that points the tools at base/workspace and base/memory, then runs `body`.
+
+    `preamble` runs before anything of the loop's is imported.
+    """
+    return _CHILD_SETUP.format(preamble=preamble, root=str(ROOT), base=str(base)) + body
+
+
+def start_loop_child(base, env: dict, resume=None, preamble: str = "") -> subprocess.Popen:
+    """Start the loop's main() in a child process, logging to base/logs; its stdout is discarded.
+
+    `env` is added to this process's environment: point ANTHROPIC_BASE_URL at
+    a FakeMessagesAPI there. `resume` is passed to main().
+    """
+    base = Path(base)
+    (base / "workspace").mkdir(parents=True, exist_ok=True)
+    (base / "memory").mkdir(parents=True, exist_ok=True)
+    body = f'loop = importlib.import_module("autonomy-loop")\nloop.LOG_DIR = base / "logs"\nloop.main({resume!r})\n'
+    return subprocess.Popen(
+        [sys.executable, "-c", child_script(base, body, preamble)],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def run_loop_child(base, env: dict, resume=None, preamble: str = "", timeout=None):
+    """Run start_loop_child() to the end; raises CalledProcessError if the loop fails."""
+    proc = start_loop_child(base, env, resume, preamble)
+    try:
+        returncode = proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, proc.args)
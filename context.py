@@ -0,0 +1,186 @@
+"""Context management for the autonomy loop: prompt cache breakpoints and history compaction."""
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Breakpoints placed in the message history. The API allows four in total and
+# the system prompt takes one. The tool schemas need none of their own: the
+# prefix is hashed in the order tools, system, messages, so the system
+# breakpoint already covers them.
+HISTORY_BREAKPOINTS = 3
+
+
+def cached_system(system_prompt: str) -> list:
+    """Wrap the system prompt in a text block carrying a cache breakpoint."""
+    return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+
+def _with_breakpoint(message: dict) -> dict:
+    """Return a shallow copy of a message with a breakpoint on its last block."""
+    content = message["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}]
+    else:
+        blocks = list(content)
+        blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+    return {**message, "content": blocks}
+
+
+def with_cache_breakpoints(messages: list, count: int = HISTORY_BREAKPOINTS) -> list:
+    """Return the message list with breakpoints on the last `count` user messages.
+
+    The newest user message gets a breakpoint that writes the whole history to
+    the cache; the older ones sit where earlier requests wrote, so the stable
+    prefix is read back even when a turn added many blocks. The stored
+    history is never modified: only the marked messages are copied, and the
+    breakpoints move forward on their own as new messages are appended.
+    """
+    marked = list(messages)
+    remaining = count
+    for i in range(len(marked) - 1, -1, -1):
+        if remaining == 0:
+            break
+        message = marked[i]
+        if message["role"] != "user" or not message["content"]:
+            continue
+        marked[i] = _with_breakpoint(message)
+        remaining -= 1
+    return marked
+
+
+# --- History compaction ---
+
+CHARS_PER_TOKEN = 4
+COMPACTED_PREFIX = "[Compacted:"
+STUB_PREVIEW_CHARS = 200
+# Tool results shorter than this are left alone: a stub would barely be smaller
+MIN_COMPACT_CHARS = 1_000
+
+
+def _char_count(value) -> int:
+    """Count the characters of text carried by a message, block or list of either."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_char_count(v) for k, v in value.items() if k != "cache_control")
+    if isinstance(value, (list, tuple)):
+        return sum(_char_count(v) for v in value)
+    if value is None:
+        return 0
+    return len(str(value))
+
+
+def estimate_tokens(value) -> int:
+    """Estimate tokens locally (about four characters per token), without an API call."""
+    return _char_count(value) // CHARS_PER_TOKEN
+
+
+def _compaction_stub(tool_name: str, content) -> str:
+    """Build the placeholder that replaces a compacted tool result."""
+    text = content if isinstance(content, str) else "\n".join(
+        b.get("text", "") for b in content if isinstance(b, dict)
+    )
+    preview = text[:STUB_PREVIEW_CHARS].rstrip()
+    if len(text) > STUB_PREVIEW_CHARS:
+        preview += "\n..."
+    return (
+        f"{COMPACTED_PREFIX} {tool_name} result ({_char_count(content):,} chars) removed "
+        f"to stay within the context budget. Preview:\n{preview}\n"
+        f"Re-run the tool if you need the full output.]"
+    )
+
+
+class ContextManager:
+    """Keeps the message history under a token budget by compacting old tool results.
+
+    The history size is estimated from the prompt tokens the API reported for
+    the previous request plus a local estimate of the messages appended since,
+    so no extra API call is needed. Pass `count_tokens` to use an exact count
+    instead.
+
+    When the estimate exceeds the budget, tool results outside the most recent
+    `keep_recent` messages are replaced with short stubs, oldest first, until
+    the estimate drops below `low_water` × budget. Compacting well below the
+    budget means it happens in occasional batches rather than every turn,
+    which keeps the prompt cache prefix stable between compactions.
+    """
+
+    def __init__(self, budget, keep_recent=10, low_water=0.75, count_tokens=None):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.low_water = low_water
+        self.count_tokens = count_tokens
+        self._prefix_tokens = 0
+        self._anchor_tokens = None
+        self._anchor_len = 0
+
+    def set_prefix(self, system, tools):
+        """Estimate the fixed part of each request (system prompt and tool schemas)."""
+        self._prefix_tokens = estimate_tokens(system) + estimate_tokens(tools)
+
+    def record_usage(self, usage, message_count):
+        """Anchor the estimate on the prompt size the API reported for a request."""
+        self._anchor_tokens = (
+            (getattr(usage, "input_tokens", 0) or 0)
+            + (getattr(usage, "cache_read_input_tokens", 0) or 0)
+            + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        )
+        self._anchor_len = message_count
+
+    def estimate(self, messages) -> int:
+        """Estimate the prompt tokens the next request would use."""
+        if self.count_tokens:
+            return self.count_tokens(messages)
+        if self._anchor_tokens is not None and self._anchor_len <= len(messages):
+            return self._anchor_tokens + estimate_tokens(messages[self._anchor_len:])
+        return self._prefix_tokens + estimate_tokens(messages)
+
+    def compact(self, messages):
+        """Compact old tool results in place if the history is over budget.
+
+        Returns (tokens_before, tokens_after, results_compacted), or None if
+        the history was within budget or nothing in it could be compacted.
+        """
+        before = self.estimate(messages)
+        if before <= self.budget:
+            return None
+
+        target = int(self.budget * self.low_water)
+        current = before
+        compacted = 0
+        tool_names = {}
+        for i in range(max(0, len(messages) - self.keep_recent)):
+            if current <= target:
+                break
+            content = messages[i]["content"]
+            if isinstance(content, str):
+                continue
+            if messages[i]["role"] == "assistant":
+                for block in content:
+                    if block.get("type") == "tool_use":
+                        tool_names[block["id"]] = block["name"]
+                continue
+
+            blocks = None
+            for j, block in enumerate(content):
+                if block.get("type") != "tool_result":
+                    continue
+                result = block.get("content", "")
+                chars = _char_count(result)
+                if chars < MIN_COMPACT_CHARS:
+                    continue
+                if isinstance(result, str) and result.startswith(COMPACTED_PREFIX):
+                    continue
+                stub = _compaction_stub(tool_names.get(block["tool_use_id"], "tool"), result)
+                if blocks is None:
+                    blocks = list(content)
+                blocks[j] = {**block, "content": stub}
+                current -= (chars - len(stub)) // CHARS_PER_TOKEN
+                compacted += 1
+            if blocks is not None:
+                messages[i] = {**messages[i], "content": blocks}
+
+        if not compacted:
+            return None
+        if self._anchor_tokens is not None:
+            self._anchor_tokens -= before - current
+        return before, current, compacted
@@ -0,0 +1,230 @@
+"""In-place file edits for the edit tools: string replacement, line ranges, appends and unified diffs.
+
+Each edit sends only the changed text, not the whole file. Every write goes
+through atomic_write (a temp file in the same directory, fsynced, then
+renamed over the original), so a crash mid-write leaves either the old file
+or the new one, never a truncated mix. Files are read and written as bytes
+decoded as UTF-8, so line endings are kept as they are.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+# How far (in lines) a hunk may have drifted from the line number in its header
+HUNK_SEARCH_WINDOW = 1000
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# The process umask, read once (reading it means setting it): mkstemp creates
+# files as 0600, so new files are given the mode open() would have
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def split_lines(text: str) -> list:
+    """Split text into lines that keep their endings. Unlike str.splitlines, only a newline ends a line."""
+    parts = text.split("\n")
+    lines = [part + "\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def atomic_write(path: Path, data: str = None, append: str = None):
+    """Replace path with `data`, or with its current content plus `append`, atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if append is not None:
+                if path.exists():
+                    with open(path, "rb") as src:
+                        shutil.copyfileobj(src, out)
+                out.write(append.encode())
+            else:
+                out.write(data.encode())
+            out.flush()
+            os.fsync(out.fileno())
+        if path.exists():
+            shutil.copymode(path, tmp)
+        else:
+            os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def read_text(path: Path, label: str) -> str:
+    """Read a file for editing, exactly as stored."""
+    if not path.is_file():
+        raise ValueError(f"File not found: {label}")
+    try:
+        return path.read_bytes().decode()
+    except UnicodeDecodeError:
+        raise ValueError(f"{label} is not UTF-8 text; use write_file to replace it") from None
+
+
+def replace_string(text: str, old: str, new: str, replace_all: bool, label: str) -> tuple:
+    """Replace an exact substring. Returns (new text, replacements)."""
+    if not old:
+        raise ValueError("old_string is empty")
+    count = text.count(old)
+    if count == 0:
+        raise ValueError(f"old_string not found in {label}")
+    if count > 1 and not replace_all:
+        raise ValueError(
+            f"old_string occurs {count} times in {label}; include more surrounding text to make it unique, "
+            f"or set replace_all"
+        )
+    return text.replace(old, new), count
+
+
+def replace_lines(text: str, start: int, end: int, content: str, label: str) -> tuple:
+    """Replace lines start..end (1-based, inclusive) with content; end = start - 1 inserts before start.
+
+    Returns (new text, lines removed, lines inserted).
+    """
+    lines = split_lines(text)
+    if start < 1 or start > len(lines) + 1:
+        raise ValueError(f"start_line {start} is outside {label} ({len(lines)} lines)")
+    if end < start - 1 or end > len(lines):
+        raise ValueError(f"end_line {end} is outside lines {start - 1}-{len(lines)} of {label}")
+    if content and not content.endswith(("\n", "\r")) and end < len(lines):
+        content += "\n"
+    if start > len(lines) and lines and not lines[-1].endswith(("\n", "\r")):
+        # Inserting after a last line that has no newline
+        content = "\n" + content
+    inserted = split_lines(content)
+    return "".join(lines[:start - 1] + inserted + lines[end:]), end - start + 1, len(inserted)
+
+
+# --- Unified diffs ---
+
+class FilePatch:
+    """The hunks of a unified diff that apply to one file."""
+
+    def __init__(self, old_path, new_path):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+
+    @property
+    def path(self):
+        return self.new_path or self.old_path
+
+
+def _diff_path(header: str):
+    """The path from a ---/+++ line, without its a/ or b/ prefix; None for /dev/null."""
+    path = header[4:].split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        path = path[2:]
+    return path
+
+
+def parse_unified_diff(diff: str, default_path: str = None) -> list:
+    """Parse a unified diff into FilePatch objects.
+
+    Each hunk is (old start line, old lines, new lines), with lines keeping
+    their line endings. A diff without ---/+++ headers applies to default_path.
+    """
+    patches = []
+    current = None
+    lines = split_lines(diff)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            current = FilePatch(_diff_path(line), _diff_path(lines[i + 1]))
+            patches.append(current)
+            i += 2
+            continue
+        match = _HUNK_HEADER.match(line)
+        if not match:
+            i += 1
+            continue
+        if current is None:
+            if not default_path:
+                raise ValueError("The diff has no ---/+++ file headers; pass path")
+            current = FilePatch(default_path, default_path)
+            patches.append(current)
+        old_count = int(match.group(2)) if match.group(2) is not None else 1
+        new_count = int(match.group(4)) if match.group(4) is not None else 1
+        old, new = [], []
+        # The side(s) the previous line went to, for "\ No newline at end of file"
+        last_sides = ()
+        i += 1
+        while i < len(lines):
+            body = lines[i]
+            tag, text = body[:1], body[1:]
+            if tag == "\\":
+                for side in last_sides:
+                    side[-1] = side[-1].rstrip("\r\n")
+                i += 1
+                continue
+            if len(old) >= old_count and len(new) >= new_count:
+                break
+            if tag == " " or body in ("\n", "\r\n"):
+                last_sides = (old, new)
+                text = text if tag == " " else body
+            elif tag == "-":
+                last_sides = (old,)
+            elif tag == "+":
+                last_sides = (new,)
+            else:
+                break
+            for side in last_sides:
+                side.append(text)
+            i += 1
+        if len(old) != old_count or len(new) != new_count:
+            raise ValueError(f"Hunk at line {match.group(1)} of {current.path} is truncated or miscounted")
+        current.hunks.append((int(match.group(1)), old, new))
+    if not patches or not any(p.hunks or p.new_path is None for p in patches):
+        raise ValueError("No hunks found in the diff")
+    return patches
+
+
+def _find_hunk(lines: list, old: list, expected: int, after: int) -> int:
+    """Index where the hunk's old lines occur at or after `after`, closest to `expected`, or -1."""
+    if not old:
+        return min(max(expected, after), len(lines))
+
+    def same(a, b):
+        return a.rstrip("\r\n") == b.rstrip("\r\n")
+
+    best = -1
+    last_start = len(lines) - len(old)
+    for distance in range(0, HUNK_SEARCH_WINDOW + 1):
+        for start in {expected - distance, expected + distance}:
+            if after <= start <= last_start and all(same(lines[start + k], old[k]) for k in range(len(old))):
+                best = start
+                break
+        if best >= 0:
+            break
+    return best
+
+
+def apply_hunks(text: str, patch: FilePatch) -> str:
+    """Apply one file's hunks in order, allowing them to have drifted from their line numbers."""
+    lines = split_lines(text)
+    crlf = bool(lines) and lines[0].endswith("\r\n")
+    offset = 0
+    after = 0
+    for number, old, new in patch.hunks:
+        # A header line of 0 means "before the first line"
+        expected = max(number - 1, 0) + offset if old else number + offset
+        start = _find_hunk(lines, old, expected, after)
+        if start < 0:
+            context = "".join(old[:3]).rstrip()
+            raise ValueError(f"Hunk at line {number} of {patch.path} doesn't match the file. It expected:\n{context}")
+        if crlf:
+            new = [line[:-1] + "\r\n" if line.endswith("\n") and not line.endswith("\r\n") else line for line in new]
+        lines[start:start + len(old)] = new
+        offset += len(new) - len(old)
+        after = start + len(new)
+    return "".join(lines)
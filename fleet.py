@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Fleet mode: many autonomy sessions in one process.
+
+Runs N sessions of the autonomy loop concurrently on asyncio. Each session
+has its own workspace, memory directory and log under the fleet directory:
+
+  <FLEET_DIR>/<name>/workspace/
+  <FLEET_DIR>/<name>/memory/notes.md
+  <FLEET_DIR>/<name>/logs/autonomy_*.md, .jsonl
+
+All sessions share one AsyncAnthropic client (one connection pool) and one
+RateLimiter, which admits requests through token buckets for requests,
+input tokens and output tokens. The buckets are sized from the
+anthropic-ratelimit-* headers of every response, and a 429 pauses the whole
+fleet for its retry-after instead of letting every session hammer the API.
+Other transient failures are retried per session by the same RetryPolicy
+as the single-session loop.
+Custom tools run on one bounded thread pool, so a session's long command
+occupies a single worker while the other sessions keep going.
+
+Usage: python3 fleet.py --sessions 8 --task "..."
+       python3 fleet.py --tasks tasks.txt       # one session per line
+       python3 fleet.py --sessions 8 --resume   # continue each session's latest transcript
+
+Loop settings (MODEL, MAX_TURNS, PROMPT_CACHING, ...) come from the same
+environment variables as autonomy-loop.py, plus:
+  FLEET_DIR               Where session directories live (default: /app/fleet).
+  FLEET_TOOL_WORKERS      Threads shared by all sessions' tool calls (default: 8).
+  FLEET_REQUESTS_PER_MINUTE, FLEET_INPUT_TOKENS_PER_MINUTE,
+  FLEET_OUTPUT_TOKENS_PER_MINUTE
+                          Limits to assume until the API reports its own
+                          (default: 0, no limit until the first response).
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import anthropic
+from context import estimate_tokens
+from retry import RetryPolicy, int_header
+from telemetry import MetricsRegistry, serve
+from tools import ToolBatch, Workspace
+
+loop = importlib.import_module("autonomy-loop")
+
+FLEET_DIR = Path(os.getenv("FLEET_DIR", "/app/fleet"))
+FLEET_TOOL_WORKERS = int(os.getenv("FLEET_TOOL_WORKERS", "8"))
+FLEET_REQUESTS_PER_MINUTE = int(os.getenv("FLEET_REQUESTS_PER_MINUTE", "0"))
+FLEET_INPUT_TOKENS_PER_MINUTE = int(os.getenv("FLEET_INPUT_TOKENS_PER_MINUTE", "0"))
+FLEET_OUTPUT_TOKENS_PER_MINUTE = int(os.getenv("FLEET_OUTPUT_TOKENS_PER_MINUTE", "0"))
+
+
+class TokenBucket:
+    """A bucket of `capacity` units that refills continuously over `period` seconds.
+
+    A capacity of 0 means no known limit: every request is admitted. The
+    level may go negative when actual usage turns out higher than reserved;
+    later requests then wait for the refill.
+    """
+
+    def __init__(self, capacity=0, period=60.0):
+        self.capacity = capacity
+        self.period = period
+        self.level = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / self.period)
+        self._updated = now
+
+    def wait_time(self, amount, now) -> float:
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill(now)
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * self.period / self.capacity
+
+    def take(self, amount, now):
+        self._refill(now)
+        if self.capacity:
+            self.level -= amount
+
+    def observe(self, limit, remaining, now):
+        """Adopt the limit and remaining count the API reported."""
+        self._refill(now)
+        if limit:
+            if limit != self.capacity:
+                self.level = min(self.level, limit) if self.capacity else float(limit)
+                self.capacity = limit
+            self.level = min(self.level, float(remaining))
+
+
+class RateLimiter:
+    """Admits API requests from every session through shared request and token buckets.
+
+    Requests are admitted one at a time in arrival order (asyncio.Lock is
+    FIFO), so a session waiting for a large token reservation isn't
+    overtaken forever by small ones.
+    """
+
+    def __init__(self, requests_per_minute=0, input_tokens_per_minute=0, output_tokens_per_minute=0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.output_tokens = TokenBucket(output_tokens_per_minute)
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self.throttled = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, input_tokens):
+        """Wait until a request with about `input_tokens` uncached input tokens may be sent."""
+        async with self._lock:
+            started = time.monotonic()
+            while True:
+                now = time.monotonic()
+                delay = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1, now),
+                    self.input_tokens.wait_time(input_tokens, now),
+                    # Output isn't known up front: just don't start while the bucket is empty
+                    self.output_tokens.wait_time(1, now),
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.requests.take(1, now)
+            self.input_tokens.take(input_tokens, now)
+            self.waited += now - started
+
+    def settle(self, reserved, usage):
+        """Correct a request's reservation with the tokens it actually used."""
+        now = time.monotonic()
+        # Cache reads don't count toward the input token rate limit
+        used = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        self.input_tokens.take(used - reserved, now)
+        self.output_tokens.take(getattr(usage, "output_tokens", 0) or 0, now)
+
+    def observe(self, headers):
+        """Update the buckets from a response's anthropic-ratelimit-* headers."""
+        now = time.monotonic()
+        for bucket, kind in (
+            (self.requests, "requests"),
+            (self.input_tokens, "input-tokens"),
+            (self.output_tokens, "output-tokens"),
+        ):
+            limit = int_header(headers, f"anthropic-ratelimit-{kind}-limit")
+            remaining = int_header(headers, f"anthropic-ratelimit-{kind}-remaining")
+            if limit is not None and remaining is not None:
+                bucket.observe(limit, remaining, now)
+
+    def pause(self, seconds):
+        """Hold back every session's requests for `seconds` (after a 429)."""
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class FleetSession:
+    """One session of the fleet: the loop's Session plus its workspace and request bookkeeping."""
+
+    def __init__(self, name, session, workspace):
+        self.name = name
+        self.session = session
+        self.workspace = workspace
+        self.sent = 0
+        self.error = None
+
+    def request_cost(self) -> int:
+        """Estimate the uncached input tokens of the next request."""
+        messages = self.session.messages
+        if not loop.PROMPT_CACHING or not self.sent:
+            return estimate_tokens(loop.SYSTEM_PROMPT) + estimate_tokens(loop.ALL_TOOLS) + estimate_tokens(messages)
+        # Everything up to the previous request is read from the cache
+        return estimate_tokens(messages[self.sent:])
+
+
+async def send_request(client, limiter, retry_policy, fs, api_kwargs):
+    """Send one API request through the rate limiter, retrying transient failures.
+
+    Returns (response, latency of the successful attempt).
+    """
+    session = fs.session
+    attempt = 0
+    while True:
+        attempt += 1
+        reserved = fs.request_cost()
+        await limiter.acquire(reserved)
+        request_start = time.monotonic()
+        try:
+            raw = await client.messages.with_raw_response.create(**api_kwargs)
+            response = await raw.parse()
+        except Exception as e:
+            decision = retry_policy.delay(e, attempt)
+            if decision is None:
+                if not isinstance(e, anthropic.APIError) or not session.drop_stale_container(e):
+                    raise
+                api_kwargs.pop("container", None)
+                continue
+            wait, reason = decision
+            if isinstance(e, anthropic.RateLimitError):
+                # The limit is shared: hold back every session, not just this one
+                limiter.observe(e.response.headers)
+                limiter.pause(wait)
+            session.record_retry(e, attempt, wait, reason)
+            await asyncio.sleep(wait)
+            continue
+        retry_policy.success()
+        limiter.observe(raw.headers)
+        limiter.settle(reserved, response.usage)
+        fs.sent = len(session.messages)
+        return response, time.monotonic() - request_start
+
+
+async def run_session(client, limiter, retry_policy, pool, fs):
+    """Drive one session until it finishes, fails or is cancelled."""
+    session = fs.session
+    try:
+        while not session.done:
+            # In a thread: with CONTEXT_ESTIMATOR=api it makes a blocking count_tokens call
+            api_kwargs = await asyncio.to_thread(session.next_request)
+            response, latency = await send_request(client, limiter, retry_policy, fs, api_kwargs)
+            calls = session.handle_response(response, latency)
+            if calls is not None:
+                batch = ToolBatch(pool, fs.workspace, session.turn)
+                scheduled = [(block, batch.submit(block.name, block.input)) for block in calls]
+                session.add_tool_results([
+                    (block, await asyncio.wrap_future(future), future.duration) for block, future in scheduled
+                ])
+            tools = f", {len(calls)} tool calls" if calls else ""
+            print(f"[{fs.name}] turn {session.turn}: {response.stop_reason} ({latency:.1f}s{tools})")
+        print(f"[{fs.name}] finished after {session.turn} turns")
+    except asyncio.CancelledError:
+        loop.log(session.f, f"Loop ended by human after {session.turn} turns.", is_system=True)
+        raise
+    except Exception as e:
+        fs.error = e
+        loop.log(session.f, f"Fatal error:\n```\n{traceback.format_exc()}\n```", is_system=True)
+        print(f"[{fs.name}] fatal error: {e}")
+    finally:
+        session.close()
+
+
+def open_session(name, task, fleet_dir, resume, registry=None) -> FleetSession:
+    """Create (or resume) a session in <fleet_dir>/<name>/."""
+    base = fleet_dir / name
+    workspace = Workspace(base / "workspace", base / "memory")
+    workspace.root.mkdir(parents=True, exist_ok=True)
+    workspace.memory_dir.mkdir(parents=True, exist_ok=True)
+    log_dir = base / "logs"
+    options = dict(console=False, registry=registry, name=name, workspace=workspace)
+    try:
+        session = loop.Session.resume("latest", log_dir, **options) if resume else None
+    except FileNotFoundError:
+        session = None
+    if session is None:
+        session = loop.Session.create(log_dir, task, **options)
+    return FleetSession(name, session, workspace)
+
+
+async def run_fleet(sessions):
+    client = anthropic.AsyncAnthropic(max_retries=0)
+    limiter = RateLimiter(FLEET_REQUESTS_PER_MINUTE, FLEET_INPUT_TOKENS_PER_MINUTE, FLEET_OUTPUT_TOKENS_PER_MINUTE)
+    retry_policy = RetryPolicy(loop.RETRY_BASE_DELAY, loop.RETRY_MAX_DELAY, loop.RETRY_BREAKER_THRESHOLD, loop.RETRY_BREAKER_PAUSE)
+    pool = ThreadPoolExecutor(FLEET_TOOL_WORKERS)
+    try:
+        await asyncio.gather(*(run_session(client, limiter, retry_policy, pool, fs) for fs in sessions))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        await client.close()
+        print(f"\nRate limiter: waited {limiter.waited:.1f}s in total, {limiter.throttled} rate-limit pauses")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many autonomy sessions in one process.")
+    parser.add_argument("--sessions", type=int, default=1, help="number of sessions (with --task or no task)")
+    parser.add_argument("--task", default=os.getenv("INITIAL_TASK", "").strip(), help="task given to every session")
+    parser.add_argument("--tasks", help="file with one task per line; one session per task")
+    parser.add_argument("--dir", type=Path, default=FLEET_DIR, help=f"fleet directory (default: {FLEET_DIR})")
+    parser.add_argument("--resume", action="store_true", help="continue each session's latest transcript")
+    args = parser.parse_args()
+
+    if args.tasks:
+        tasks = [line.strip() for line in Path(args.tasks).read_text().splitlines() if line.strip()]
+    else:
+        tasks = [args.task] * args.sessions
+    registry = None
+    if loop.METRICS_PORT:
+        registry = MetricsRegistry()
+        serve(registry, loop.METRICS_PORT, loop.METRICS_HOST)
+    width = len(str(len(tasks)))
+    sessions = [
+        open_session(f"session-{i:0{width}d}", task, args.dir, args.resume, registry)
+        for i, task in enumerate(tasks, 1)
+    ]
+    print(f"Fleet of {len(sessions)} sessions in {args.dir} ({FLEET_TOOL_WORKERS} tool workers)")
+    if registry:
+        print(f"Metrics: http://{loop.METRICS_HOST}:{loop.METRICS_PORT}/metrics (labelled by session)")
+    print("Stop with: Ctrl+C\n")
+
+    try:
+        asyncio.run(run_fleet(sessions))
+    except KeyboardInterrupt:
+        print("\nStopped by human.")
+
+    print()
+    for fs in sessions:
+        status = f"error: {fs.error}" if fs.error else f"{fs.session.turn} turns"
+        print(f"{fs.name}: {status} — {fs.session.token_summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Buffered session log output: a background writer thread, size-based rotation and gzip.
+
+A LogSink stands in for the open log file. write() only appends to an
+in-memory buffer; a writer thread writes the buffer out once FLUSH_INTERVAL
+has passed since the oldest unwritten text or FLUSH_BYTES have built up, so
+the loop makes no file syscalls of its own and `tail -F` still sees new text
+within a fraction of a second. Buffered text is bounded: once
+MAX_PENDING_BYTES are waiting, writers block until the disk catches up.
+
+With rotate_bytes set, a file that grows past it is renamed to
+<stem>.<n><suffix> (n counting up from 1) and gzip-compressed on a separate
+thread, and writing continues in a fresh file under the original name.
+
+event() records the same log as compact JSON lines in a second file
+(events_path), for programs rather than people.
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+FLUSH_INTERVAL = 0.2
+FLUSH_BYTES = 64 * 1024
+MAX_PENDING_BYTES = 16 * 1024 * 1024
+
+
+def _compress(path: Path):
+    """Replace a finished segment with a .gz copy."""
+    try:
+        with open(path, "rb") as src, gzip.open(f"{path}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        path.unlink()
+    except OSError as e:
+        print(f"Log: couldn't compress {path}: {e}", file=sys.stderr)
+
+
+class _RotatingFile:
+    """An append-only binary file that moves itself aside once it passes rotate_bytes."""
+
+    def __init__(self, path: Path, mode: str, rotate_bytes: int):
+        self.path = Path(path)
+        self.rotate_bytes = rotate_bytes
+        self._f = open(self.path, mode + "b")
+        self.size = self._f.tell() if mode == "a" else 0
+
+    def _next_segment(self) -> Path:
+        stem, suffix = self.path.stem, self.path.suffix
+        pattern = re.compile(rf"{re.escape(stem)}\.(\d+){re.escape(suffix)}(\.gz)?$")
+        numbers = [int(m.group(1)) for p in self.path.parent.iterdir() if (m := pattern.match(p.name))]
+        return self.path.with_name(f"{stem}.{max(numbers, default=0) + 1}{suffix}")
+
+    def write(self, data: bytes):
+        self._f.write(data)
+        self.size += len(data)
+        if self.rotate_bytes and self.size >= self.rotate_bytes:
+            self._f.close()
+            segment = self._next_segment()
+            os.replace(self.path, segment)
+            threading.Thread(target=_compress, args=(segment,), name="log-compress").start()
+            self._f = open(self.path, "wb")
+            self.size = 0
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class LogSink:
+    """A session's Markdown log (and optional JSONL event log), written by a background thread."""
+
+    def __init__(self, path, mode: str = "w", events_path=None, rotate_bytes: int = 0):
+        self.path = Path(path)
+        self._md = _RotatingFile(self.path, mode, rotate_bytes)
+        self._events = _RotatingFile(Path(events_path), mode, rotate_bytes) if events_path else None
+        self._cond = threading.Condition()
+        self._text = []
+        self._records = []
+        self._pending = 0
+        self._oldest = 0.0
+        self._urgent = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"log-{self.path.stem}", daemon=True)
+        self._thread.start()
+
+    def _put(self, queue: list, data: bytes):
+        with self._cond:
+            if self._closed:
+                raise ValueError("write to a closed log")
+            while self._pending >= MAX_PENDING_BYTES:
+                self._cond.wait()
+            if not self._pending:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            queue.append(data)
+            self._pending += len(data)
+            if self._pending >= FLUSH_BYTES:
+                self._cond.notify_all()
+
+    def write(self, text: str):
+        """Append Markdown to the log."""
+        if text:
+            self._put(self._text, text.encode())
+
+    def event(self, kind: str, **fields):
+        """Append one record to the event log, if there is one."""
+        if self._events is not None:
+            record = {"time": round(time.time(), 3), "kind": kind, **fields}
+            self._put(self._records, (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode())
+
+    def flush(self):
+        """Ask the writer to write out everything buffered now, without waiting for it."""
+        with self._cond:
+            self._urgent = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._urgent and self._pending < FLUSH_BYTES:
+                    if self._pending:
+                        remaining = self._oldest + FLUSH_INTERVAL - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                text, records = self._text, self._records
+                self._text, self._records = [], []
+                self._pending = 0
+                self._urgent = False
+                closing = self._closed
+                self._cond.notify_all()
+            try:
+                if text:
+                    self._md.write(b"".join(text))
+                    self._md.flush()
+                if records:
+                    self._events.write(b"".join(records))
+                    self._events.flush()
+            except OSError as e:
+                print(f"Log: write to {self.path} failed: {e}", file=sys.stderr)
+            if closing:
+                return
+
+    def close(self):
+        """Write out everything buffered, then close the files."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._md.close()
+        if self._events is not None:
+            self._events.close()
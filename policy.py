@@ -0,0 +1,116 @@
+"""Per-call choice of model and output budget (max_tokens) from cheap signals.
+
+Before each API call, TurnPolicy.choose() looks at what the request is
+answering and picks one of four policies:
+
+  open      a new turn (the initial message or a continuation prompt): the
+            main model with the full budget, since this is where the model
+            plans and writes at length
+  tool      the results of the previous response's tool calls: the budget
+            is sized from recent output lengths, and if FAST_MODEL is set a
+            short, mechanical step (few small results after a streak of
+            short responses) goes to it instead of the main model
+  continue  a response that was cut off by max_tokens: the main model with
+            the full budget, so the model picks up where it stopped
+  pause     a pause_turn: the same model and budget as the paused call
+
+Nothing is measured that the loop doesn't already have: the previous stop
+reason, the pending tool results and the output tokens of recent responses.
+record() keeps per-policy counts, latencies and token totals; summary()
+reports them, and each call's policy, model and budget also go to the
+metrics file, so the thresholds below can be tuned from real runs.
+"""
+
+import statistics
+from collections import defaultdict, deque
+
+# Output tokens of this many recent responses size the "tool" budget
+RECENT_OUTPUTS = 5
+# The "tool" budget: this many times the largest recent output, rounded up
+# to BUDGET_STEP and kept between the minimum and the full budget
+BUDGET_HEADROOM = 4
+BUDGET_STEP = 1024
+# A step is routed to FAST_MODEL only when it answers at most this many tool
+# results of at most this many characters in total, and the recent responses
+# were all shorter than FAST_MAX_OUTPUT tokens
+FAST_MAX_RESULTS = 4
+FAST_MAX_RESULT_CHARS = 20_000
+FAST_MAX_OUTPUT = 1024
+
+
+def tool_results(message: dict) -> list:
+    """The tool_result blocks of a user message."""
+    content = message.get("content")
+    if not isinstance(content, list):
+        return []
+    return [b for b in content if isinstance(b, dict) and b.get("type") == "tool_result"]
+
+
+class TurnPolicy:
+    """Chooses (policy, model, max_tokens) for each call of one session, and keeps per-policy stats.
+
+    With adaptive=False every call gets the main model and the full budget
+    (as "fixed", or "continue" after a truncation); stats are still kept.
+    """
+
+    def __init__(self, model, max_tokens=16384, min_tokens=4096, fast_model=None, adaptive=True):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.fast_model = fast_model if adaptive else None
+        self.adaptive = adaptive
+        self._recent = deque(maxlen=RECENT_OUTPUTS)
+        self._last = None
+        self.stats = defaultdict(lambda: {"calls": 0, "latency": [], "output_tokens": 0, "truncated": 0})
+
+    def choose(self, messages, stop_reason) -> tuple:
+        """Pick (policy name, model, max_tokens) for a request whose history is `messages`.
+
+        stop_reason is that of the previous response (None before the first).
+        """
+        if stop_reason == "pause_turn" and self._last:
+            return ("pause",) + self._last[1:]
+        if stop_reason == "max_tokens":
+            return "continue", self.model, self.max_tokens
+        if not self.adaptive:
+            return "fixed", self.model, self.max_tokens
+        results = tool_results(messages[-1]) if messages and messages[-1]["role"] == "user" else []
+        if stop_reason != "tool_use" or not results:
+            return "open", self.model, self.max_tokens
+
+        largest = max(self._recent, default=0)
+        budget = -(-largest * BUDGET_HEADROOM // BUDGET_STEP) * BUDGET_STEP
+        budget = min(max(budget, self.min_tokens), self.max_tokens)
+        if (
+            self.fast_model
+            and len(results) <= FAST_MAX_RESULTS
+            and sum(len(str(b.get("content", ""))) for b in results) <= FAST_MAX_RESULT_CHARS
+            and len(self._recent) == RECENT_OUTPUTS
+            and largest < FAST_MAX_OUTPUT
+        ):
+            return "tool-fast", self.fast_model, budget
+        return "tool", self.model, budget
+
+    def record(self, choice: tuple, response, latency=None):
+        """Count a response to a request made under `choice`."""
+        self._last = choice
+        output_tokens = getattr(getattr(response, "usage", None), "output_tokens", 0) or 0
+        self._recent.append(output_tokens)
+        stats = self.stats[choice[0]]
+        stats["calls"] += 1
+        stats["output_tokens"] += output_tokens
+        if latency is not None:
+            stats["latency"].append(latency)
+        if response.stop_reason == "max_tokens":
+            stats["truncated"] += 1
+
+    def summary(self) -> str:
+        """One line per policy: calls, median latency, mean output tokens and truncations."""
+        parts = []
+        for name, s in sorted(self.stats.items(), key=lambda item: -item[1]["calls"]):
+            latency = f", p50 {statistics.median(s['latency']):.1f}s" if s["latency"] else ""
+            parts.append(
+                f"{name} {s['calls']} calls{latency}, {s['output_tokens'] // s['calls']:,} output tokens/call, "
+                f"{s['truncated']} truncated"
+            )
+        return "; ".join(parts)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded session through the tool layer and logging, without the API.
+
+The responses recorded in a session transcript (logs/autonomy_*.jsonl) are
+fed back through the same Session and ToolBatch path as the live loop: each
+response is handled and logged, its custom tool calls run for real through
+execute_tool, and their results are logged, transcribed and measured. No
+request is sent and nothing waits on the model, so a replay runs at the
+speed of the tools and the logging alone. Use it to profile those costs on
+a real workload, to reproduce a slow or failing tool call, or, as a what-if,
+to compare tool implementations and settings on identical inputs: replay
+with and without a change and compare the two reports with --baseline.
+
+Each replay runs in a directory of its own (--out, default a new temporary
+directory) with an empty workspace and memory, or copies of --workspace and
+--memory, and writes its own log, transcript and metrics there. Commands
+still run for real, so one that names an absolute path outside the
+workspace touches that path as it did when recorded. Every new tool result
+is compared with the recorded one; differences usually mean the workspace
+started out differently or a tool's behaviour changed (--diffs shows them);
+the CPU and memory line at the end of a command's result is left out of the
+comparison.
+
+Loop settings (TOOL_CONCURRENCY, PERSISTENT_SHELL, RESULT_CACHE,
+CONTEXT_TOKEN_BUDGET, LOG_EVENTS, ...) come from the environment as usual.
+
+Usage: python3 replay.py [latest | <session> | <transcript>]
+       python3 replay.py latest --workspace snapshot/ -o before.json
+       python3 replay.py latest --baseline before.json     # compare with an earlier replay
+       python3 replay.py latest --profile replay.prof      # cProfile the replay
+"""
+
+import argparse
+import cProfile
+import difflib
+import importlib
+import json
+import os
+import pstats
+import shutil
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from anthropic.types import ContentBlock, Message, Usage
+from pydantic import TypeAdapter, ValidationError
+
+from shell import ResourceUsage
+from tools import ToolBatch, Workspace
+from transcript import find_transcript
+
+loop = importlib.import_module("autonomy-loop")
+
+SETTINGS = ("TOOL_CONCURRENCY", "PERSISTENT_SHELL", "RESULT_CACHE", "CONTEXT_TOKEN_BUDGET", "LOG_EVENTS")
+
+_content_block = TypeAdapter(ContentBlock)
+
+
+def read_recording(path) -> tuple:
+    """Read a transcript: (session header, response records in order, recorded results by tool_use_id)."""
+    header, responses, results = {}, [], {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            kind = record.get("type")
+            if kind == "session" and not header:
+                header = record
+            elif kind == "response":
+                responses.append(record)
+            elif kind == "tool_result":
+                results[record["tool_use_id"]] = record["content"]
+    return header, responses, results
+
+
+def to_message(record: dict, model: str) -> Message:
+    """Rebuild the SDK message of a recorded response, as the client would have returned it."""
+    blocks = []
+    for block in record["content"]:
+        try:
+            blocks.append(_content_block.validate_python(block))
+        except ValidationError:
+            # A block type this SDK doesn't know stays a dict, which the loop passes through as-is
+            blocks.append(block)
+    usage = record.get("usage") or {}
+    return Message.model_construct(
+        id=f"msg_replay_{record.get('turn', 0)}",
+        type="message",
+        role="assistant",
+        model=model,
+        content=blocks,
+        stop_reason=record.get("stop_reason"),
+        stop_sequence=None,
+        usage=Usage(
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            cache_read_input_tokens=usage.get("cache_read_input_tokens", 0),
+            cache_creation_input_tokens=usage.get("cache_creation_input_tokens", 0),
+        ),
+    )
+
+
+def _comparable(result: str) -> str:
+    """A tool result without the resource usage line, which differs from run to run."""
+    return ResourceUsage.PATTERN.sub("", result).rstrip()
+
+
+def _copy_or_create(source, target: Path):
+    if source:
+        shutil.copytree(source, target, symlinks=True)
+    else:
+        target.mkdir(parents=True)
+
+
+def _ms(seconds) -> dict:
+    if not seconds:
+        return {"p50_ms": 0.0, "max_ms": 0.0}
+    return {"p50_ms": round(statistics.median(seconds) * 1000, 2), "max_ms": round(max(seconds) * 1000, 2)}
+
+
+def replay(transcript_path, out_dir, workspace=None, memory=None, console=False, diffs=0) -> dict:
+    """Replay one transcript in out_dir and return a report of where the time went."""
+    header, responses, recorded = read_recording(transcript_path)
+    if not responses:
+        raise ValueError(f"{transcript_path} has no recorded responses")
+    out_dir = Path(out_dir)
+    _copy_or_create(workspace, out_dir / "workspace")
+    _copy_or_create(memory, out_dir / "memory")
+
+    session = loop.Session.create(
+        out_dir / "logs", header.get("task", ""), console=console,
+        workspace=Workspace(out_dir / "workspace", out_dir / "memory"),
+    )
+    if session.context:
+        # Never call the token counting API
+        session.context.count_tokens = None
+    pool = ThreadPoolExecutor(loop.TOOL_CONCURRENCY) if loop.TOOL_CONCURRENCY > 1 else None
+    model = header.get("model", loop.MODEL)
+
+    loop_time = []
+    tool_wait = 0.0
+    durations = defaultdict(list)
+    different = defaultdict(int)
+    compared = {"same": 0, "different": 0, "not_recorded": 0}
+    shown = []
+    started = time.perf_counter()
+    try:
+        for record in responses:
+            start = time.perf_counter()
+            session.next_request()
+            calls = session.handle_response(to_message(record, model))
+            spent = time.perf_counter() - start
+            if calls is not None:
+                start = time.perf_counter()
+                batch = ToolBatch(pool, session.workspace, session.turn)
+                scheduled = [(block, batch.submit(block.name, block.input)) for block in calls]
+                results = [(block, future.result(), future.duration) for block, future in scheduled]
+                tool_wait += time.perf_counter() - start
+
+                start = time.perf_counter()
+                session.add_tool_results(results)
+                spent += time.perf_counter() - start
+                for block, result, duration in results:
+                    durations[block.name].append(duration)
+                    old = recorded.get(block.id)
+                    if old is None:
+                        compared["not_recorded"] += 1
+                    elif _comparable(old) == _comparable(result):
+                        compared["same"] += 1
+                    else:
+                        compared["different"] += 1
+                        different[block.name] += 1
+                        if len(shown) < diffs:
+                            shown.append((session.turn, block.name, old, result))
+            loop_time.append(spent)
+    finally:
+        session.close()
+        if pool:
+            pool.shutdown(wait=False)
+    wall = time.perf_counter() - started
+
+    for turn, name, old, new in shown:
+        print(f"--- turn {turn} {name}: recorded vs replayed")
+        print("\n".join(difflib.unified_diff(old.splitlines(), new.splitlines(), "recorded", "replayed", n=1, lineterm="")))
+        print()
+
+    return {
+        "transcript": str(transcript_path),
+        "out": str(out_dir),
+        "settings": {key: os.getenv(key, "default") for key in SETTINGS},
+        "responses": len(responses),
+        "tool_calls": sum(len(d) for d in durations.values()),
+        "wall_s": round(wall, 3),
+        "loop_s": round(sum(loop_time), 3),
+        "tools_s": round(tool_wait, 3),
+        "loop_per_response": _ms(loop_time),
+        "results": compared,
+        "tools": {
+            name: {"calls": len(d), "total_s": round(sum(d), 3), **_ms(d), "different": different[name]}
+            for name, d in sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True)
+        },
+    }
+
+
+def print_report(report: dict, baseline: dict = None):
+    def change(new, old):
+        return f"  ({new / old - 1:+.0%})" if old else ""
+
+    base = baseline or {}
+    print(f"{report['responses']} responses, {report['tool_calls']} tool calls replayed from {report['transcript']}")
+    print(f"Replay directory: {report['out']}")
+    print()
+    for label, key in (("Wall time", "wall_s"), ("Loop + logging", "loop_s"), ("Tools", "tools_s")):
+        print(f"{label:<16} {report[key]:>8.3f}s" + change(report[key], base.get(key)))
+    per = report["loop_per_response"]
+    print(f"{'Loop/response':<16} p50 {per['p50_ms']:.2f}ms  max {per['max_ms']:.2f}ms")
+    r = report["results"]
+    print(f"{'Results':<16} {r['same']} same as recorded, {r['different']} different, {r['not_recorded']} not recorded")
+    if not report["tools"]:
+        return
+    print()
+    print(f"{'tool':<16} {'calls':>6} {'total':>9} {'p50':>9} {'max':>9} {'differ':>7}")
+    for name, t in report["tools"].items():
+        old = base.get("tools", {}).get(name, {}).get("total_s")
+        print(
+            f"{name:<16} {t['calls']:>6} {t['total_s']:>8.3f}s {t['p50_ms']:>7.2f}ms {t['max_ms']:>7.1f}ms "
+            f"{t['different']:>7}" + change(t["total_s"], old)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded session through the tools and logging, without the API.")
+    parser.add_argument("session", nargs="?", default="latest", help="transcript path, session timestamp, or 'latest' (default)")
+    parser.add_argument("--log-dir", type=Path, default=loop.LOG_DIR, help="where to look up the session")
+    parser.add_argument("--out", type=Path, help="directory to replay in (default: a new temporary directory)")
+    parser.add_argument("--workspace", type=Path, help="copy this directory as the starting workspace")
+    parser.add_argument("--memory", type=Path, help="copy this directory as the starting memory (notes)")
+    parser.add_argument("--diffs", type=int, default=0, metavar="N", help="show the first N results that differ from the recording")
+    parser.add_argument("--verbose", action="store_true", help="print the console output of the loop")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile, save the stats and print the top functions")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("-o", "--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of an earlier replay to compare against")
+    args = parser.parse_args()
+
+    try:
+        transcript_path = find_transcript(args.session, args.log_dir)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if args.out:
+        if args.out.exists():
+            parser.error(f"{args.out} already exists")
+        out_dir = args.out
+    else:
+        out_dir = Path(tempfile.mkdtemp(prefix="replay-"))
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    report = replay(transcript_path, out_dir, args.workspace, args.memory, args.verbose, args.diffs)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print_report(report, baseline)
+    if profiler:
+        print()
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(15)
+
+
+if __name__ == "__main__":
+    main()
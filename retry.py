@@ -0,0 +1,131 @@
+"""Retrying failed API requests: error classification, backoff with jitter, and a circuit breaker.
+
+The SDK's own retries are turned off so every attempt goes through here,
+where the wait is logged against the turn. Retryable failures (rate limits,
+overload, server errors, dropped connections) are retried with capped
+exponential backoff, never sooner than the API's Retry-After or rate-limit
+reset. After too many consecutive failures the circuit breaker opens and
+the loop pauses for a long stretch before probing again, rather than
+exiting and losing the session's warm context. Anything else (bad request,
+authentication, ...) is fatal and raised to the caller.
+"""
+
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# Error types a stream can report mid-response, after a 200 status
+RETRYABLE_ERROR_TYPES = {"rate_limit_error", "overloaded_error", "api_error", "timeout_error"}
+
+
+def _is_transport_error(error) -> bool:
+    """A connection dropped mid-stream surfaces as the HTTP library's own TransportError."""
+    return any(cls.__name__ == "TransportError" for cls in type(error).__mro__)
+
+
+def is_retryable(error) -> bool:
+    """True if a failed request may succeed when sent again unchanged."""
+    # Imported here, not at startup: by the time a request has failed, the SDK is loaded
+    import anthropic
+
+    if isinstance(error, anthropic.APIConnectionError) or _is_transport_error(error):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        should_retry = error.response.headers.get("x-should-retry")
+        if should_retry in ("true", "false"):
+            return should_retry == "true"
+        if error.status_code in RETRYABLE_STATUS:
+            return True
+        # An error event inside a stream arrives on a 200 response
+        return error.status_code < 400 and error.type in RETRYABLE_ERROR_TYPES
+    return False
+
+
+def int_header(headers, name):
+    """Read an integer header, or None if it's missing or malformed."""
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers) -> float:
+    """Seconds the API asked us to wait, from Retry-After or exhausted rate-limit resets (0 if none)."""
+    try:
+        return max(float(headers["retry-after-ms"]) / 1000, 0.0)
+    except (KeyError, TypeError, ValueError):
+        pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    waits = [0.0]
+    for kind in ("requests", "input-tokens", "output-tokens", "tokens"):
+        reset = headers.get(f"anthropic-ratelimit-{kind}-reset")
+        if not reset or int_header(headers, f"anthropic-ratelimit-{kind}-remaining") != 0:
+            continue
+        try:
+            reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        waits.append((reset_at - datetime.now(timezone.utc)).total_seconds())
+    return max(waits)
+
+
+def describe(error) -> str:
+    """Short label for a failure, for retry log lines."""
+    import anthropic
+
+    if isinstance(error, anthropic.APIStatusError):
+        return f"{error.status_code} {error.type or type(error).__name__}"
+    return type(error).__name__
+
+
+class RetryPolicy:
+    """Decides whether and how long to wait before resending a failed request.
+
+    One policy is shared by every request of a run (and every session of a
+    fleet), so the circuit breaker sees consecutive failures across turns.
+    Waits use "equal jitter": half the capped exponential delay is fixed and
+    half random, so retries spread out without ever retrying instantly.
+    """
+
+    def __init__(self, base=1.0, cap=60.0, breaker_threshold=8, breaker_pause=300.0):
+        self.base = base
+        self.cap = cap
+        self.breaker_threshold = breaker_threshold
+        self.breaker_pause = breaker_pause
+        self.consecutive_failures = 0
+        self.breaker_trips = 0
+
+    def delay(self, error, attempt: int):
+        """Return (seconds to wait, reason) before retry number `attempt`, or None if the error is fatal."""
+        if not is_retryable(error):
+            return None
+        self.consecutive_failures += 1
+        backoff = min(self.cap, self.base * 2 ** min(attempt - 1, 30))
+        wait = backoff / 2 + random.uniform(0, backoff / 2)
+        reason = describe(error)
+        response = getattr(error, "response", None)
+        if response is not None:
+            requested = retry_after(response.headers)
+            if requested > wait:
+                wait = requested
+                reason += ", retry-after"
+        if self.breaker_threshold and self.consecutive_failures >= self.breaker_threshold:
+            self.consecutive_failures = 0
+            self.breaker_trips += 1
+            wait = max(wait, self.breaker_pause)
+            reason += f", circuit open after {self.breaker_threshold} consecutive failures"
+        return wait, reason
+
+    def success(self):
+        """Record a successful request, closing the breaker."""
+        self.consecutive_failures = 0
@@ -0,0 +1,242 @@
+"""Persistent, incrementally updated search index over a workspace's paths and contents.
+
+The index is a SQLite database in the workspace (.search-index.sqlite) with
+an FTS5 trigram table, so any substring of three or more characters is
+looked up through the index instead of by reading files. To refresh it, the
+subtree is walked with scandir and only files whose mtime or size changed
+are re-read; deleted files are dropped. The walk costs one stat per file and
+no reads, and is skipped entirely while the index is known to be current:
+the caller marks it stale after anything that may have written files, and
+it expires after MAX_INDEX_AGE seconds to pick up changes made from outside.
+
+Files larger than MAX_INDEXED_BYTES and binary files are indexed by path
+only. Results are ranked with BM25, weighting path matches above content
+matches, and returned as path:line snippets.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+INDEX_FILE = ".search-index.sqlite"
+SCHEMA_VERSION = 1
+MAX_INDEXED_BYTES = 1_000_000
+MAX_INDEX_AGE = 60
+# Directories never worth indexing: VCS data, dependencies, caches, and the
+# tools' own spill and job directories
+SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".mypy_cache", ".pytest_cache",
+             ".command-output", ".jobs"}
+MAX_RESULTS = 100
+LINES_PER_FILE = 5
+SNIPPET_CHARS = 200
+# BM25 weights of the path and body columns
+PATH_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _read_body(path: Path, size: int) -> str:
+    """The text to index for a file: its content, or "" if it is too large or binary."""
+    if size > MAX_INDEXED_BYTES:
+        return ""
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return ""
+    if b"\x00" in data[:8192]:
+        return ""
+    return data.decode(errors="replace")
+
+
+class SearchIndex:
+    """The search index of one workspace root. Safe to share between threads."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / INDEX_FILE
+        self._lock = threading.Lock()
+        self._db = None
+        self._known = None
+        # time.time() of the last full refresh, or 0 if the index may be out of date
+        self.refreshed = 0.0
+
+    def _open(self):
+        if self._db is not None:
+            return self._db
+        self.root.mkdir(parents=True, exist_ok=True)
+        try:
+            db = self._connect()
+        except sqlite3.DatabaseError:
+            # A corrupt index is only a cache: start over
+            for suffix in ("", "-journal", "-wal", "-shm"):
+                Path(str(self.path) + suffix).unlink(missing_ok=True)
+            db = self._connect()
+        self._db = db
+        self._known = {path: (mtime, size) for path, mtime, size in db.execute("SELECT path, mtime_ns, size FROM files")}
+        return db
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA synchronous=OFF")
+        if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            db.executescript(f"""
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS fts;
+                CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER, size INTEGER);
+                CREATE VIRTUAL TABLE fts USING fts5(path, body, tokenize='trigram');
+                PRAGMA user_version={SCHEMA_VERSION};
+            """)
+        return db
+
+    def _walk(self, top: str):
+        """Yield (relative path, mtime_ns, size) for every indexable file under top."""
+        root = str(self.root)
+        cut = len(root) + 1
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        if directory == root and entry.name.startswith(INDEX_FILE):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        yield entry.path[cut:], st.st_mtime_ns, st.st_size
+                except OSError:
+                    continue
+
+    def mark_stale(self):
+        """Note that files may have changed, so the next search walks the workspace."""
+        self.refreshed = 0.0
+
+    def refresh(self, subdir: str = ".") -> tuple:
+        """Bring the index up to date under subdir. Returns (files re-read, files dropped)."""
+        with self._lock:
+            db = self._open()
+            prefix = "" if subdir in ("", ".") else subdir.rstrip("/") + "/"
+            started = time.time()
+            top = self.root / prefix if prefix else self.root
+            seen = set()
+            changed = []
+            for rel, mtime, size in self._walk(str(top)):
+                seen.add(rel)
+                if self._known.get(rel) != (mtime, size):
+                    changed.append((rel, mtime, size))
+            removed = [p for p in self._known if p.startswith(prefix) and p not in seen]
+            if not prefix:
+                self.refreshed = started
+            if not changed and not removed:
+                return 0, 0
+
+            db.execute("BEGIN")
+            try:
+                for rel in removed:
+                    self._delete(db, rel)
+                for rel, mtime, size in changed:
+                    self._delete(db, rel)
+                    cur = db.execute("INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)", (rel, mtime, size))
+                    db.execute("INSERT INTO fts (rowid, path, body) VALUES (?, ?, ?)",
+                               (cur.lastrowid, rel, _read_body(self.root / rel, size)))
+                db.execute("COMMIT")
+            except BaseException:
+                self.refreshed = 0.0
+                db.execute("ROLLBACK")
+                self._known = {path: (m, s) for path, m, s in db.execute("SELECT path, mtime_ns, size FROM files")}
+                raise
+            for rel in removed:
+                del self._known[rel]
+            for rel, mtime, size in changed:
+                self._known[rel] = (mtime, size)
+            return len(changed), len(removed)
+
+    @staticmethod
+    def _delete(db, rel: str):
+        row = db.execute("SELECT id FROM files WHERE path = ?", (rel,)).fetchone()
+        if row:
+            db.execute("DELETE FROM fts WHERE rowid = ?", row)
+            db.execute("DELETE FROM files WHERE id = ?", row)
+
+    def search(self, query: str, subdir: str = ".", max_results: int = 20) -> str:
+        """Find files whose path or content contains every term of the query (case-insensitive).
+
+        Returns up to max_results path:line snippets, best-ranked files first.
+        """
+        terms = query.split()
+        if not terms:
+            raise ValueError("Empty search query")
+        max_results = min(max(int(max_results), 1), MAX_RESULTS)
+        if time.time() - self.refreshed > MAX_INDEX_AGE:
+            self.refresh(subdir)
+
+        prefix = "" if subdir in ("", ".") else subdir.rstrip("/") + "/"
+        # Terms of 3+ characters go through the trigram index; shorter ones are filtered with LIKE
+        indexed = [t for t in terms if len(t) >= 3]
+        where, params = [], []
+        if indexed:
+            where.append("fts MATCH ?")
+            params.append(" AND ".join(_fts_phrase(t) for t in indexed))
+        for term in terms:
+            if len(term) < 3:
+                like = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                where.append("(fts.path LIKE ? ESCAPE '\\' OR fts.body LIKE ? ESCAPE '\\')")
+                params += [like, like]
+        if prefix:
+            where.append("substr(fts.path, 1, ?) = ?")
+            params += [len(prefix), prefix]
+        rank = f"bm25(fts, {PATH_WEIGHT}, {BODY_WEIGHT})" if indexed else "length(fts.path)"
+        condition = " AND ".join(where)
+
+        with self._lock:
+            files = self._db.execute(f"SELECT count(*) FROM fts WHERE {condition}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT fts.path, fts.body FROM fts WHERE {condition} ORDER BY {rank} LIMIT ?", params + [max_results]
+            ).fetchall()
+
+        lowered = [t.lower() for t in terms]
+        lines = []
+        shown = 0
+        for path, body in rows:
+            if len(lines) >= max_results:
+                break
+            shown += 1
+            hits = 0
+            for number, line in enumerate(body.splitlines(), 1):
+                lower = line.lower()
+                if any(t in lower for t in lowered):
+                    snippet = line.strip()
+                    if len(snippet) > SNIPPET_CHARS:
+                        snippet = snippet[:SNIPPET_CHARS] + "..."
+                    lines.append(f"{path}:{number}: {snippet}")
+                    hits += 1
+                    if hits >= LINES_PER_FILE or len(lines) >= max_results:
+                        break
+            if not hits:
+                lines.append(f"{path} (path match)")
+
+        if not lines:
+            return f"No matches for {query!r}" + (f" under {prefix}" if prefix else "")
+        footer = f"[{files:,} matching file{'s' if files != 1 else ''}"
+        if shown < files or len(lines) >= max_results:
+            footer += (
+                f", showing {len(lines)} line{'s' if len(lines) != 1 else ''} from the best {shown}. "
+                f"Narrow the query or set path to see more"
+            )
+        return "\n".join(lines) + f"\n\n{footer}.]"
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
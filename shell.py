@@ -0,0 +1,541 @@
+"""Command execution for run_command: persistent shell session and bounded output capture.
+
+One long-lived bash process runs the agent's commands one at a time, so the
+working directory, exported variables and activated virtualenvs carry over
+between calls, and no shell is spawned per command.
+
+Each command is framed by a random sentinel: the command text is passed to
+`eval` as a single-quoted literal (so a syntax error can't desynchronize the
+stream), then the shell prints the sentinel and exit status on stdout and the
+sentinel on stderr. Output is everything read before the sentinels.
+
+Output is read incrementally into OutputBuffers, which keep a fixed-size
+head and tail of each stream and count the bytes dropped between them, so
+memory stays flat however much a command prints.
+
+Commands run under CommandLimits (CPU seconds, memory and processes per
+process, set with bash's ulimit for the command only), and a timed-out
+command is killed along with every process it started. Each run also returns the ResourceUsage of
+the command: CPU seconds and peak resident memory.
+"""
+
+import math
+import os
+import re
+import resource
+import selectors
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# How long to wait for the shell to come back after a timed-out job is killed
+KILL_GRACE = 2.0
+READ_CHUNK = 65536
+# Enough trailing bytes to hold a sentinel frame ("<32 hex> <status>\n")
+FRAME_WINDOW = 64
+# How often the memory of a running command is sampled
+RSS_SAMPLE_INTERVAL = 0.25
+# The hard CPU limit is this far above the soft one, so a process gets
+# SIGXCPU (and the result says why it died) before SIGKILL
+CPU_HARD_GRACE = 5
+
+
+class CommandLimits:
+    """Per-process resource limits for commands, applied with bash's ulimit.
+
+    cpu_seconds is RLIMIT_CPU (the process gets SIGXCPU, then is killed).
+    memory_mb is RLIMIT_DATA: the size of the heap and private writable
+    mappings. It is not a cap on resident memory: mapped files and shared
+    memory don't count, so mmap-heavy programs can use more, while private
+    reservations count in full even if never touched. processes is
+    RLIMIT_NPROC, which the kernel counts per user (all processes and
+    threads of the user, the loop's own and other sessions' included).
+    0 means no limit. Each is capped at the hard limit this process already
+    has, since an unprivileged shell can't raise it.
+
+    ulimit() sets them as hard limits too, so the command can't raise them;
+    it is for a process that runs one command and exits. A persistent shell
+    uses ulimit(soft=True) before each command and restore() after it.
+    """
+
+    def __init__(self, cpu_seconds: int = 0, memory_mb: int = 0, processes: int = 0):
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.processes = processes
+
+    def _settings(self, cpu: bool = True):
+        """(ulimit flag, rlimit, value in ulimit's units, unit) for each limit that is set."""
+        for flag, rlimit, value, unit in (
+            ("-t", resource.RLIMIT_CPU, self.cpu_seconds if cpu else 0, 1),
+            ("-d", resource.RLIMIT_DATA, self.memory_mb * 1024, 1024),
+            ("-u", resource.RLIMIT_NPROC, self.processes, 1),
+        ):
+            if value > 0:
+                yield flag, rlimit, value, unit
+
+    def ulimit(self, cpu: bool = True, soft: bool = False, cpu_used: float = 0) -> str:
+        """`ulimit` commands that set the limits, or "" if there are none.
+
+        With soft, only the soft limits are set, so restore() can lift them
+        again, and the CPU limit is raised by cpu_used: the seconds the shell
+        running the command has used itself, which RLIMIT_CPU counts too.
+        """
+        lines = []
+        for flag, rlimit, value, unit in self._settings(cpu):
+            hard = resource.getrlimit(rlimit)[1]
+            if soft:
+                if flag == "-t":
+                    value += math.ceil(cpu_used)
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard // unit)
+                lines.append(f"ulimit -S {flag} {value}")
+                continue
+            grace = CPU_HARD_GRACE if flag == "-t" else 0
+            if hard != resource.RLIM_INFINITY and value + grace > hard // unit:
+                lines.append(f"ulimit {flag} {hard // unit}")
+            elif grace:
+                # Soft first: the hard limit can't go below the current soft one
+                lines.append(f"ulimit -S {flag} {value}; ulimit -H {flag} {value + grace}")
+            else:
+                lines.append(f"ulimit {flag} {value}")
+        return "".join(line + "\n" for line in lines)
+
+    def restore(self) -> str:
+        """`ulimit` commands that put the soft limits back to those of this process."""
+        lines = []
+        for flag, rlimit, _, unit in self._settings():
+            current = resource.getrlimit(rlimit)[0]
+            value = "unlimited" if current == resource.RLIM_INFINITY else current // unit
+            lines.append(f"ulimit -S {flag} {value}")
+        return "".join(line + "\n" for line in lines)
+
+    def describe_exit(self, returncode) -> str:
+        """A note for an exit status that means the CPU limit killed the command, otherwise ""."""
+        if self.cpu_seconds and returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+            return f"[killed: a process exceeded the CPU time limit of {self.cpu_seconds}s]"
+        return ""
+
+
+class ResourceUsage:
+    """CPU time and peak resident memory of a command and the processes it started.
+
+    peak_rss is in bytes, or None if unknown: it is the largest peak of any
+    one process seen by an RssSampler, so it misses processes that ended
+    between samples, and commands quicker than the sampling interval have
+    none. (The kernel's own ru_maxrss can't be used: it counts the memory
+    of the loop process that forked the command.)
+    """
+
+    # The line str() produces, as found at the end of a tool result
+    PATTERN = re.compile(r"\[resources: cpu ([\d.]+)s(?:, peak memory ([\d.]+) MB)?\]\s*\Z")
+
+    def __init__(self, cpu_seconds: float, peak_rss: int = None):
+        self.cpu_seconds = cpu_seconds
+        self.peak_rss = peak_rss
+
+    def __str__(self):
+        memory = f", peak memory {self.peak_rss / 1048576:.1f} MB" if self.peak_rss is not None else ""
+        return f"[resources: cpu {self.cpu_seconds:.2f}s{memory}]"
+
+    @classmethod
+    def parse(cls, text: str):
+        """The usage at the end of a tool result, or None if it has none."""
+        match = cls.PATTERN.search(text[-100:])
+        if not match:
+            return None
+        peak = match.group(2)
+        return cls(float(match.group(1)), int(float(peak) * 1048576) if peak else None)
+
+
+class OutputBuffer:
+    """Keeps the head and tail of a byte stream in fixed memory, counting what falls between.
+
+    If spill_path is set, the full stream is also written there once it
+    outgrows the head (up to spill_limit bytes), so nothing is lost on disk.
+    """
+
+    def __init__(self, head_size: int, tail_size: int, spill_path=None, spill_limit=None):
+        self.head_size = head_size
+        self.tail_size = max(tail_size, FRAME_WINDOW)
+        self.spill_path = spill_path
+        self.spill_limit = spill_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.dropped = 0
+        self.spilled = False
+        self.spill_truncated = False
+        self._spill = None
+
+    def write(self, chunk: bytes):
+        """Append a chunk of the stream."""
+        self.total += len(chunk)
+        room = self.head_size - len(self.head)
+        if room >= len(chunk):
+            self.head += chunk
+            return
+        if self.spill_path and not self.spilled:
+            # Everything so far is still in the head: start the spill file from it
+            Path(self.spill_path).parent.mkdir(parents=True, exist_ok=True)
+            self._spill = open(self.spill_path, "wb")
+            self._spill.write(self.head)
+            self.spilled = True
+        self._write_spill(chunk)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        self.tail += chunk
+        excess = len(self.tail) - self.tail_size
+        if excess > 0:
+            del self.tail[:excess]
+            self.dropped += excess
+
+    def _write_spill(self, chunk: bytes):
+        if self._spill is None:
+            return
+        if self.spill_limit is not None:
+            room = self.spill_limit - self._spill.tell()
+            if room < len(chunk):
+                chunk = chunk[:max(room, 0)]
+                self.spill_truncated = True
+        self._spill.write(chunk)
+
+    def last(self, n: int) -> bytes:
+        """Return up to the last n retained bytes of the stream."""
+        if len(self.tail) >= n or self.dropped:
+            return bytes(self.tail[-n:])
+        return bytes((self.head[-n:] + self.tail)[-n:])
+
+    def drop_last(self, n: int):
+        """Remove the last n bytes of the stream (which must still be retained)."""
+        self.total -= n
+        from_tail = min(n, len(self.tail))
+        if from_tail:
+            del self.tail[len(self.tail) - from_tail:]
+        if n > from_tail:
+            del self.head[len(self.head) - (n - from_tail):]
+        if self._spill is not None and not self.spill_truncated:
+            self._spill.truncate(self.total)
+
+    def close(self):
+        """Close the spill file, if one was opened."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def text(self) -> str:
+        """Decode the retained output, marking the gap if bytes were dropped."""
+        if not self.dropped:
+            return (self.head + self.tail).decode(errors="replace")
+        return (
+            self.head.decode(errors="replace")
+            + f"\n\n[... {self.dropped:,} bytes omitted ...]\n\n"
+            + self.tail.decode(errors="replace")
+        )
+
+
+def run_fresh(command: str, cwd, timeout: float, stdout: OutputBuffer, stderr: OutputBuffer, limits: CommandLimits = None):
+    """Run a command in a new bash in a session of its own, streaming its output into the buffers.
+
+    Returns (exit code, ResourceUsage); the exit code is None if the command
+    timed out, in which case it was killed with everything it started.
+    """
+    prefix = limits.ulimit() if limits else ""
+    proc = subprocess.Popen(
+        ["/bin/bash", "--noprofile", "--norc", "-c", prefix + command],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=str(cwd),
+        start_new_session=True,
+    )
+    buffers = {proc.stdout: stdout, proc.stderr: stderr}
+    selector = selectors.DefaultSelector()
+    for stream in buffers:
+        selector.register(stream, selectors.EVENT_READ)
+    sampler = RssSampler(proc.pid)
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    try:
+        while buffers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                _kill_tree(proc.pid)
+                break
+            for key, _ in selector.select(min(remaining, sampler.poll())):
+                chunk = os.read(key.fd, READ_CHUNK)
+                if chunk:
+                    buffers[key.fileobj].write(chunk)
+                else:
+                    selector.unregister(key.fileobj)
+                    del buffers[key.fileobj]
+    finally:
+        selector.close()
+        proc.stdout.close()
+        proc.stderr.close()
+    # wait4 rather than wait: its CPU times cover the shell and every child it reaped
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    usage = ResourceUsage(rusage.ru_utime + rusage.ru_stime, sampler.peak)
+    return (None if timed_out else proc.returncode), usage
+
+
+def _quote(text: str) -> str:
+    """Quote text as a single bash word."""
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def _boot_ticks() -> float:
+    """Current time in the clock ticks since boot that /proc/<pid>/stat uses for start times."""
+    return time.clock_gettime(time.CLOCK_BOOTTIME) * CLOCK_TICKS
+
+
+def _command_processes(root: int, since: float = 0) -> list:
+    """PIDs of the live processes a command started (Linux /proc).
+
+    That is the descendants of `root`, plus processes left in its session
+    (root must be a session leader) after their parent exited, started at
+    or after `since` (boot ticks).
+    """
+    children = {}
+    session = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name is parenthesized and may contain spaces
+        fields = stat.rsplit(")", 1)[1].split()
+        pid, started = int(entry.name), int(fields[19])
+        children.setdefault(int(fields[1]), []).append((pid, started))
+        if int(fields[3]) == root and pid != root:
+            session.append((pid, started))
+    found = {}
+    stack = [root]
+    while stack:
+        for child, started in children.get(stack.pop(), ()):
+            if child not in found:
+                found[child] = started
+                stack.append(child)
+    found.update(session)
+    return [pid for pid, started in found.items() if started >= since]
+
+
+def _kill_tree(root: int, since: float = 0, include_root: bool = True):
+    """SIGKILL the processes a command started (see _command_processes), and root's process group."""
+    for pid in _command_processes(root, since):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    if include_root:
+        try:
+            os.killpg(root, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def _peak_rss(pids) -> int:
+    """The largest peak resident set size (VmHWM) among the processes, in bytes."""
+    peak = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1]) * 1024)
+                        break
+        except (OSError, ValueError):
+            continue
+    return peak
+
+
+def _cpu_seconds(pid: int, children: bool = True):
+    """CPU time of a process (and its reaped children), in seconds, or None if it has exited."""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return sum(int(f) for f in fields[11:15 if children else 13]) / CLOCK_TICKS
+
+
+class RssSampler:
+    """Tracks the peak memory of a running command by sampling its processes (and root).
+
+    Call poll() whenever convenient: it samples if RSS_SAMPLE_INTERVAL has
+    passed since the last sample, and returns the seconds until the next
+    one is due. peak is the largest VmHWM seen, in bytes, or None before
+    any sample.
+    """
+
+    def __init__(self, root: int, since: float = 0, interval: float = RSS_SAMPLE_INTERVAL):
+        self.root = root
+        self.since = since
+        self.interval = interval
+        self.peak = None
+        self._next = time.monotonic() + interval
+
+    def poll(self) -> float:
+        now = time.monotonic()
+        if now >= self._next:
+            sample = _peak_rss([self.root] + _command_processes(self.root, self.since))
+            if sample:
+                self.peak = max(self.peak or 0, sample)
+            self._next = now + self.interval
+        return self._next - now
+
+
+class ShellSession:
+    """A long-lived bash process that runs commands one at a time.
+
+    run() streams the command's output into the given OutputBuffers and
+    returns (exit_code, note, usage). exit_code is None when the command
+    timed out. note is an extra line for the result when the session had to
+    be restarted, otherwise empty. usage is the command's ResourceUsage:
+    CPU time is the shell's own plus that of the children it reaped during
+    the command. usage is None if the shell exited.
+
+    The limits are set as soft limits just before each command and lifted
+    right after it, so they apply to the command and the processes it
+    starts, while the shell's own CPU time doesn't add up against them
+    across commands. (A subshell per command would lose the working
+    directory and variables that should carry over.)
+    """
+
+    def __init__(self, cwd, shell="/bin/bash", limits: CommandLimits = None):
+        self.cwd = str(cwd)
+        self.shell = shell
+        self.limits = limits
+        self._proc = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            [self.shell, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            # Own session: a Ctrl+C aimed at the loop doesn't reach the shell
+            start_new_session=True,
+        )
+
+    def close(self):
+        """Terminate the shell and everything it started."""
+        if self._proc and self._proc.poll() is None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self._proc.wait()
+        self._proc = None
+
+    def _kill_job(self, since: float):
+        """Kill the processes the current command started, leaving earlier background jobs.
+
+        Processes are told apart by start time, so nothing has to be
+        recorded before each command.
+        """
+        _kill_tree(self._proc.pid, since, include_root=False)
+
+    def run(self, command: str, timeout: float, stdout: OutputBuffer, stderr: OutputBuffer):
+        """Run a command in the session and wait for it to finish."""
+        with self._lock:
+            note = ""
+            if self._proc is None or self._proc.poll() is not None:
+                if self._proc is not None:
+                    note = "[shell session had exited; started a new one]"
+                self._start()
+
+            sentinel = uuid.uuid4().hex
+            out_mark = f"{sentinel} ".encode()
+            err_mark = f"{sentinel}\n".encode()
+            limit = restore = ""
+            if self.limits:
+                # Silenced: these fail if a command lowered a hard limit, which isn't the next one's output
+                used = _cpu_seconds(self._proc.pid, children=False) or 0
+                limit = self.limits.ulimit(soft=True, cpu_used=used).replace("\n", " 2> /dev/null\n")
+                restore = self.limits.restore().replace("\n", " 2> /dev/null\n")
+            script = (
+                limit + f"eval {_quote(command)} < /dev/null\n"
+                f"printf '%s %d\\n' {sentinel} $?\n"
+                f"printf '%s\\n' {sentinel} >&2\n" + restore
+            )
+            command_start = int(_boot_ticks())
+            cpu_start = _cpu_seconds(self._proc.pid)
+            try:
+                self._proc.stdin.write(script.encode())
+                self._proc.stdin.flush()
+            except BrokenPipeError:
+                self.close()
+                self._start()
+                cpu_start = _cpu_seconds(self._proc.pid)
+                self._proc.stdin.write(script.encode())
+                self._proc.stdin.flush()
+
+            out_stream = self._proc.stdout
+            buffers = {out_stream: stdout, self._proc.stderr: stderr}
+            marks = {out_stream: out_mark, self._proc.stderr: err_mark}
+            done = set()
+            exit_code = None
+            selector = selectors.DefaultSelector()
+            for stream in buffers:
+                selector.register(stream, selectors.EVENT_READ)
+
+            sampler = RssSampler(self._proc.pid, command_start)
+            deadline = time.monotonic() + timeout
+            timed_out = False
+            exited = False
+            while len(done) < 2:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if timed_out:
+                        # The shell itself is stuck (e.g. a builtin loop): start over
+                        self.close()
+                        note = "[command could not be interrupted; shell session restarted]"
+                        break
+                    timed_out = True
+                    self._kill_job(command_start)
+                    deadline = time.monotonic() + KILL_GRACE
+                    continue
+                for key, _ in selector.select(min(remaining, sampler.poll())):
+                    chunk = os.read(key.fd, READ_CHUNK)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        done.add(key.fileobj)
+                        exited = True
+                        continue
+                    buffer = buffers[key.fileobj]
+                    buffer.write(chunk)
+                    # The frame is always the last thing written, so only the end needs checking
+                    window = buffer.last(len(chunk) + FRAME_WINDOW)
+                    idx = window.rfind(marks[key.fileobj])
+                    if idx >= 0 and window.endswith(b"\n"):
+                        if key.fileobj is out_stream:
+                            exit_code = int(window[idx + len(out_mark):])
+                        buffer.drop_last(len(window) - idx)
+                        done.add(key.fileobj)
+                        selector.unregister(key.fileobj)
+            selector.close()
+
+            if exited and self._proc is not None:
+                # The command ended the shell (`exit`, `set -e` failure, ...)
+                exit_code = self._proc.wait()
+                self._proc = None
+                note = "[shell session exited; the next command starts a new one]"
+            usage = None
+            cpu_end = _cpu_seconds(self._proc.pid) if self._proc is not None else None
+            if cpu_start is not None and cpu_end is not None:
+                usage = ResourceUsage(cpu_end - cpu_start, sampler.peak)
+            if timed_out:
+                exit_code = None
+            return exit_code, note, usage
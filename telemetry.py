@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Per-turn performance telemetry: a metrics file per session, an optional
+Prometheus-style endpoint, and a report.
+
+Each session appends one JSON line per API call and per custom tool call
+to logs/autonomy_<session>.metrics.jsonl:
+
+  {"type": "turn", "turn": N, "latency": s, "first_byte": s, "input_tokens": ...,
+   "output_tokens": ..., "cache_read_tokens": ..., "cache_write_tokens": ...,
+   "prompt_tokens": ..., "messages": ..., "stop_reason": ..., "retries": ..., "retry_wait": s,
+   "policy": ..., "model": ..., "max_tokens": ...}
+  {"type": "tool", "turn": N, "name": ..., "duration": s, "output_bytes": ..., "error": bool,
+   "cpu_seconds": s, "peak_rss_mb": ...}
+  {"type": "startup", "process": s, "session": s, "client": s, "first_request": s, ...}
+
+prompt_tokens is the whole prompt as the API counted it (input plus cache
+reads and writes), so it tracks how the history grows at no extra cost.
+policy, model and max_tokens are what the turn policy (policy.py) chose for
+the call. cpu_seconds and peak_rss_mb are the resource usage a command
+reported at the end of its result (see shell.ResourceUsage), when it did.
+
+With METRICS_PORT set, the same measurements are also kept as counters and
+a latency histogram and served in Prometheus text format on
+http://<METRICS_HOST>:<port>/metrics.
+
+Usage: python3 telemetry.py report [latest | <metrics file>...]
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from shell import ResourceUsage
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms shared by every session of the process.
+
+    Values are keyed by metric name and a sorted tuple of label pairs, and
+    rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1.0, **labels):
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self._histograms:
+                self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            buckets, _, _ = hist = self._histograms[key]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self) -> str:
+        """Render every metric in Prometheus text format."""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (n, labels), value in sorted(values.items()):
+                        if n == name:
+                            lines.append(f"{name}{fmt(labels)} {value:g}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, c in zip(LATENCY_BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', f'{bound:g}')])} {c}")
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{fmt(labels)} {total:g}")
+                    lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+    """Serve the registry at http://host:port/metrics from a daemon thread."""
+    # Only needed with METRICS_PORT set, so not imported at startup
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Telemetry:
+    """Records one session's turn and tool metrics to its metrics file and, optionally, a registry.
+
+    Tool records are flushed together with the next turn record, so the file
+    costs one write per API call.
+    """
+
+    def __init__(self, path, registry: MetricsRegistry = None, session: str = None):
+        self.path = Path(path)
+        self.registry = registry
+        self.labels = {"session": session} if session else {}
+        self._f = open(self.path, "a")
+
+    def _write(self, record: dict):
+        self._f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def turn(self, turn, response, latency, first_byte, messages, retries=0, retry_wait=0.0, choice=None):
+        """Record one API call; choice is the (policy, model, max_tokens) it was made with."""
+        usage = getattr(response, "usage", None)
+        tokens = {
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "cache_read_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        }
+        prompt_tokens = tokens["input_tokens"] + tokens["cache_read_tokens"] + tokens["cache_write_tokens"]
+        self._write({
+            "type": "turn",
+            "time": round(time.time(), 3),
+            "turn": turn,
+            "latency": round(latency, 4) if latency is not None else None,
+            "first_byte": round(first_byte, 4) if first_byte is not None else None,
+            **tokens,
+            "prompt_tokens": prompt_tokens,
+            "messages": messages,
+            "stop_reason": response.stop_reason,
+            "retries": retries,
+            "retry_wait": round(retry_wait, 3),
+            **({"policy": choice[0], "model": choice[1], "max_tokens": choice[2]} if choice else {}),
+        })
+        self._f.flush()
+
+        if self.registry:
+            r, labels = self.registry, self.labels
+            policy = {"policy": choice[0]} if choice else {}
+            r.inc("autonomy_api_requests_total", **labels, **policy, stop_reason=response.stop_reason)
+            if latency is not None:
+                r.observe("autonomy_api_latency_seconds", latency, **labels)
+            for kind, value in tokens.items():
+                r.inc("autonomy_tokens_total", value, **labels, kind=kind.removesuffix("_tokens"))
+            r.inc("autonomy_api_retries_total", retries, **labels)
+            r.set("autonomy_prompt_tokens", prompt_tokens, **labels)
+            r.set("autonomy_messages", messages, **labels)
+            r.set("autonomy_turn", turn, **labels)
+
+    def startup(self, phases: dict):
+        """Record how long each startup phase took, in seconds (None if unknown)."""
+        self._write({"type": "startup", **{k: round(v, 4) if v is not None else None for k, v in phases.items()}})
+        self._f.flush()
+        if self.registry and phases.get("first_request") is not None:
+            self.registry.set("autonomy_startup_seconds", phases["first_request"], **self.labels)
+
+    def tool(self, turn, name, duration, result: str):
+        """Record one custom tool call."""
+        output_bytes = len(result.encode(errors="replace"))
+        error = result.startswith("Error")
+        record = {
+            "type": "tool",
+            "turn": turn,
+            "name": name,
+            "duration": round(duration, 4) if duration is not None else None,
+            "output_bytes": output_bytes,
+            "error": error,
+        }
+        usage = ResourceUsage.parse(result) if name == "run_command" else None
+        if usage:
+            record["cpu_seconds"] = round(usage.cpu_seconds, 3)
+            if usage.peak_rss is not None:
+                record["peak_rss_mb"] = round(usage.peak_rss / 1048576, 1)
+        self._write(record)
+        if self.registry:
+            r, labels = self.registry, self.labels
+            r.inc("autonomy_tool_calls_total", **labels, tool=name)
+            r.inc("autonomy_tool_seconds_total", duration or 0.0, **labels, tool=name)
+            r.inc("autonomy_tool_output_bytes_total", output_bytes, **labels, tool=name)
+            if usage:
+                r.inc("autonomy_tool_cpu_seconds_total", usage.cpu_seconds, **labels, tool=name)
+            if error:
+                r.inc("autonomy_tool_errors_total", **labels, tool=name)
+
+    def close(self):
+        self._f.close()
+
+
+# --- Report ---
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def _seconds(values) -> str:
+    if not values:
+        return "-"
+    return (
+        f"p50 {_percentile(values, 50):.2f}s  p95 {_percentile(values, 95):.2f}s  "
+        f"max {max(values):.2f}s  mean {statistics.fmean(values):.2f}s"
+    )
+
+
+def report(paths, top=10) -> str:
+    """Summarize one or more metrics files: latencies, tokens, history growth, turn policies and top tools."""
+    turns, tools, startups = [], [], []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                kind = record.get("type")
+                (turns if kind == "turn" else startups if kind == "startup" else tools).append(record)
+
+    lines = [f"{len(turns)} API calls, {len(tools)} tool calls ({', '.join(str(p) for p in paths)})", ""]
+    lines.append(f"API latency      {_seconds([t['latency'] for t in turns if t.get('latency') is not None])}")
+    lines.append(f"Time to 1st byte {_seconds([t['first_byte'] for t in turns if t.get('first_byte') is not None])}")
+    if startups:
+        phases = [k for k in startups[-1] if k != "type"]
+        lines.append("Startup          " + "  ".join(
+            f"{k} {statistics.median([s[k] for s in startups if s.get(k) is not None]) * 1000:.0f}ms"
+            for k in phases if any(s.get(k) is not None for s in startups)
+        ))
+    retries = sum(t.get("retries", 0) for t in turns)
+    if retries:
+        lines.append(f"Retries          {retries} ({sum(t.get('retry_wait', 0) for t in turns):.1f}s waiting)")
+    if turns:
+        totals = {k: sum(t.get(k, 0) for t in turns) for k in ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")}
+        lines.append(
+            f"Tokens           input {totals['input_tokens']:,}  output {totals['output_tokens']:,}  "
+            f"cache read {totals['cache_read_tokens']:,}  cache write {totals['cache_write_tokens']:,}"
+        )
+        prompt = [t["prompt_tokens"] for t in turns]
+        lines.append(f"Prompt size      first {prompt[0]:,}  last {prompt[-1]:,}  max {max(prompt):,} tokens")
+        slowest = sorted(turns, key=lambda t: t.get("latency") or 0, reverse=True)[:3]
+        lines.append("Slowest turns    " + ", ".join(f"#{t['turn']} {t.get('latency') or 0:.1f}s" for t in slowest))
+
+    by_policy = defaultdict(list)
+    for t in turns:
+        if t.get("policy"):
+            by_policy[t["policy"]].append(t)
+    if by_policy:
+        lines += ["", f"{'policy':<16} {'calls':>6} {'latency p50':>12} {'p95':>8} {'output p50':>11} {'budget p50':>11} {'truncated':>10}"]
+        for name, calls in sorted(by_policy.items(), key=lambda item: -len(item[1])):
+            latencies = [t["latency"] for t in calls if t.get("latency") is not None]
+            lines.append(
+                f"{name:<16} {len(calls):>6} {_percentile(latencies, 50) if latencies else 0:>11.2f}s "
+                f"{_percentile(latencies, 95) if latencies else 0:>7.2f}s "
+                f"{_percentile([t['output_tokens'] for t in calls], 50):>11,} {_percentile([t['max_tokens'] for t in calls], 50):>11,} "
+                f"{sum(1 for t in calls if t.get('stop_reason') == 'max_tokens'):>10}"
+            )
+
+    if tools:
+        by_name = defaultdict(list)
+        for t in tools:
+            by_name[t["name"]].append(t)
+        ranked = sorted(by_name.items(), key=lambda item: sum(t["duration"] or 0 for t in item[1]), reverse=True)
+        lines += ["", f"{'tool':<16} {'calls':>6} {'total':>9} {'p50':>8} {'p95':>8} {'output':>10} {'errors':>7} {'cpu':>9} {'peak mem':>9}"]
+        for name, calls in ranked[:top]:
+            durations = [t["duration"] or 0 for t in calls]
+            cpu = [t["cpu_seconds"] for t in calls if "cpu_seconds" in t]
+            peaks = [t["peak_rss_mb"] for t in calls if "peak_rss_mb" in t]
+            lines.append(
+                f"{name:<16} {len(calls):>6} {sum(durations):>8.2f}s {_percentile(durations, 50):>7.3f}s "
+                f"{_percentile(durations, 95):>7.3f}s {sum(t['output_bytes'] for t in calls) / 1024:>8.0f}KB "
+                f"{sum(1 for t in calls if t['error']):>7} "
+                + (f"{sum(cpu):>8.2f}s" if cpu else f"{'-':>9}")
+                + (f" {max(peaks):>6.0f}MB" if peaks else f" {'-':>9}")
+            )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize autonomy loop metrics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report", help="p50/p95 latencies, token totals and top tools of a run")
+    report_parser.add_argument("paths", nargs="*", default=["latest"], help="metrics files, or 'latest' (default)")
+    report_parser.add_argument("--log-dir", type=Path, default=Path(__file__).parent / "logs")
+    report_parser.add_argument("--top", type=int, default=10, help="tools to list")
+    args = parser.parse_args()
+
+    paths = []
+    for p in args.paths:
+        if p == "latest":
+            candidates = sorted(args.log_dir.glob("autonomy_*.metrics.jsonl"))
+            if not candidates:
+                parser.error(f"no metrics files in {args.log_dir}")
+            paths.append(candidates[-1])
+        else:
+            paths.append(Path(p))
+    print(report(paths, args.top))
+
+
+if __name__ == "__main__":
+    main()
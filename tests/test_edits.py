@@ -0,0 +1,27 @@
+"""atomic_write: new files get the umask's mode, not mkstemp's 0600; existing files keep theirs."""
+
+import os
+import stat
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import edits
+from edits import atomic_write
+
+
+def test_new_file_mode_follows_umask(tmp_path):
+    path = tmp_path / "new" / "file.txt"
+    atomic_write(path, "hello\n")
+    assert path.read_text() == "hello\n"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o666 & ~edits._UMASK
+
+
+def test_existing_file_keeps_its_mode(tmp_path):
+    path = tmp_path / "script.sh"
+    path.write_text("echo one\n")
+    os.chmod(path, 0o751)
+    atomic_write(path, append="echo two\n")
+    assert path.read_text() == "echo one\necho two\n"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o751
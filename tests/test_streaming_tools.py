@@ -0,0 +1,41 @@
+"""Tool calls started while a response streams must not run twice when the stream is retried."""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fake_api import FakeMessagesAPI, _tool_use, run_loop_child
+
+
+def run_loop(script, base: Path) -> FakeMessagesAPI:
+    api = FakeMessagesAPI(script).start()
+    env = {
+        "ANTHROPIC_BASE_URL": api.base_url,
+        "ANTHROPIC_API_KEY": "test",
+        "STREAMING": "1",
+        "TOOL_CONCURRENCY": "4",
+        "RETRY_BASE_DELAY": "0.01",
+    }
+    try:
+        run_loop_child(base, env, timeout=60)
+    finally:
+        api.stop()
+    return api
+
+
+def test_mid_stream_error_does_not_repeat_early_append(tmp_path):
+    response = {
+        "content": [
+            {"type": "text", "text": "Logging, then reading back."},
+            _tool_use(1, "append_file", {"path": "log.txt", "content": "entry\n"}),
+            _tool_use(2, "read_file", {"path": "log.txt"}),
+        ],
+        "stop_reason": "tool_use",
+    }
+    # The first attempt breaks off after both tool calls have streamed in full
+    api = run_loop([{**response, "stream_error_after": 3}, response], tmp_path)
+
+    assert (tmp_path / "workspace" / "log.txt").read_text() == "entry\n"
+    assert len(api.requests) == 3
@@ -1,19 +1,78 @@
 """Tool definitions and execution for the autonomy loop."""
 
+import base64
+import codecs
+import itertools
 import json
+import mmap
 import os
+import select
+import signal
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
 from pathlib import Path
 
+import edits
+from search import INDEX_FILE, SearchIndex
+from shell import KILL_GRACE, CommandLimits, OutputBuffer, ResourceUsage, RssSampler, ShellSession, run_fresh
+
 # Allowed base directories (inside container)
 WORKSPACE_DIR = Path("/app/workspace")
 MEMORY_DIR = Path("/app/memory")
 NOTES_FILE = MEMORY_DIR / "notes.md"
 
 MAX_FILE_READ = 1_000_000  # 1MB
+MAX_BINARY_READ = 48_000  # raw bytes per hex/base64 read
+BINARY_PREVIEW = 512  # raw bytes shown when a text read hits a binary file
+# Data is binary if it has a NUL byte, or if more than this share of its first
+# BINARY_SAMPLE characters are control characters or invalid UTF-8
+BINARY_SAMPLE = 8192
+BINARY_THRESHOLD = 0.3
 MAX_COMMAND_OUTPUT = 50_000  # 50KB
+# Output beyond MAX_COMMAND_OUTPUT is saved here in full, for paging with read_file
+COMMAND_OUTPUT_DIR = ".command-output"
+MAX_SPILL_BYTES = 100_000_000  # 100MB per stream
+MAX_SPILL_FILES = 20
 MAX_COMMAND_TIMEOUT = 120
 DEFAULT_COMMAND_TIMEOUT = 30
+# Tools that never change files; any other call marks the search index stale
+READ_ONLY_TOOLS = {"read_file", "list_files", "search_workspace", "read_notes", "job_status", "job_output"}
+# Tools the loop may start while a response is still streaming. A call started
+# early can be lost to a retried or cut-off response, so it must have no side
+# effects (job_status and job_output mark a finished job as reported).
+EARLY_START_TOOLS = READ_ONLY_TOOLS - {"job_status", "job_output"}
+# Background jobs: output logs live here, and at most this many run at once
+JOBS_DIR = ".jobs"
+MAX_RUNNING_JOBS = 8
+# How often a running job's memory is sampled
+JOB_SAMPLE_INTERVAL = 1.0
+
+# run_command keeps one bash session alive across calls; 0 starts a fresh shell per call
+PERSISTENT_SHELL = os.getenv("PERSISTENT_SHELL", "1") != "0"
+# Per-process limits for commands (0 = none); background jobs get all but the CPU limit
+COMMAND_LIMITS = CommandLimits(
+    cpu_seconds=int(os.getenv("COMMAND_CPU_LIMIT", "600")),
+    memory_mb=int(os.getenv("COMMAND_MEMORY_MB", "4096")),
+    processes=int(os.getenv("COMMAND_MAX_PROCESSES", "0")),
+)
+# Repeated reads of an unchanged file return a reference to the earlier result; 0 disables
+RESULT_CACHE = os.getenv("RESULT_CACHE", "1") != "0"
+MAX_CACHED_RESULTS = 4096
+# Results shorter than this are cheaper to repeat than to reference
+MIN_CACHED_RESULT = 500
+# What preload_context() puts in the initial message
+PRELOAD_NOTES_CHARS = 20_000
+PRELOAD_ENTRIES = 50
+
+# How run_command describes its shell, which depends on PERSISTENT_SHELL
+if PERSISTENT_SHELL:
+    SHELL_DESCRIPTION = "Commands share one persistent bash session that starts in the workspace directory: cd, exported variables and activated virtualenvs carry over between calls."
+else:
+    SHELL_DESCRIPTION = "Each command runs in a fresh bash in the workspace directory: cd, exported variables and activated virtualenvs do not carry over, so chain dependent steps in one command (e.g. `cd app && make`)."
 
 
 # --- Custom tool schemas ---
@@ -21,21 +80,42 @@ DEFAULT_COMMAND_TIMEOUT = 30
 CUSTOM_TOOLS = [
     {
         "name": "read_file",
-        "description": "Read the contents of a file from the workspace.",
+        "description": "Read the contents of a file from the workspace. Reads at most 1MB at a time; for large files, page with offset/length (bytes) or start_line/end_line. Partial reads report the file's total size and line count. Text with invalid UTF-8 bytes is shown with replacement characters; binary files return a hex preview.",
         "input_schema": {
             "type": "object",
             "properties": {
                 "path": {
                     "type": "string",
                     "description": "Relative path within /app/workspace",
-                }
+                },
+                "offset": {
+                    "type": "integer",
+                    "description": "Byte offset to start reading at (default 0)",
+                },
+                "length": {
+                    "type": "integer",
+                    "description": "Maximum number of bytes to read (default and max 1000000)",
+                },
+                "start_line": {
+                    "type": "integer",
+                    "description": "First line to read, 1-based. Overrides offset.",
+                },
+                "end_line": {
+                    "type": "integer",
+                    "description": "Last line to read, inclusive",
+                },
+                "encoding": {
+                    "type": "string",
+                    "enum": ["auto", "hex", "base64"],
+                    "description": "auto (default) returns text, or a hex preview for binary data; hex and base64 return raw bytes encoded",
+                },
             },
             "required": ["path"],
         },
     },
     {
         "name": "write_file",
-        "description": "Write content to a file in the workspace. Creates parent directories as needed.",
+        "description": "Write content to a file in the workspace, replacing it entirely. Creates parent directories as needed. To change part of an existing file, use edit_file, replace_lines, append_file or apply_patch instead: they don't need the whole file.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -51,6 +131,94 @@ CUSTOM_TOOLS = [
             "required": ["path", "content"],
         },
     },
+    {
+        "name": "edit_file",
+        "description": "Replace an exact string in a workspace file. old_string must match the file exactly (including whitespace and indentation) and occur once, unless replace_all is set. Include enough surrounding text to make it unique.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "path": {
+                    "type": "string",
+                    "description": "Relative path within /app/workspace",
+                },
+                "old_string": {
+                    "type": "string",
+                    "description": "Exact text to replace",
+                },
+                "new_string": {
+                    "type": "string",
+                    "description": "Text to replace it with",
+                },
+                "replace_all": {
+                    "type": "boolean",
+                    "description": "Replace every occurrence (default false)",
+                },
+            },
+            "required": ["path", "old_string", "new_string"],
+        },
+    },
+    {
+        "name": "replace_lines",
+        "description": "Replace a range of lines in a workspace file, as numbered by read_file's start_line/end_line. Set end_line to start_line - 1 to insert before start_line without removing anything, or content to \"\" to delete the lines.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "path": {
+                    "type": "string",
+                    "description": "Relative path within /app/workspace",
+                },
+                "start_line": {
+                    "type": "integer",
+                    "description": "First line to replace, 1-based",
+                },
+                "end_line": {
+                    "type": "integer",
+                    "description": "Last line to replace, inclusive",
+                },
+                "content": {
+                    "type": "string",
+                    "description": "Replacement lines",
+                },
+            },
+            "required": ["path", "start_line", "end_line", "content"],
+        },
+    },
+    {
+        "name": "append_file",
+        "description": "Append text to the end of a workspace file, creating it if needed. Add a trailing newline yourself if you want one.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "path": {
+                    "type": "string",
+                    "description": "Relative path within /app/workspace",
+                },
+                "content": {
+                    "type": "string",
+                    "description": "Text to append",
+                },
+            },
+            "required": ["path", "content"],
+        },
+    },
+    {
+        "name": "apply_patch",
+        "description": "Apply a unified diff (as produced by diff -u or git diff) to one or more workspace files. Hunks are located by their context lines, so small line-number drift is fine. Either every file is patched or none is. /dev/null headers create or delete files.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "patch": {
+                    "type": "string",
+                    "description": "The unified diff",
+                },
+                "path": {
+                    "type": "string",
+                    "description": "File to patch, if the diff has no ---/+++ headers",
+                },
+            },
+            "required": ["patch"],
+        },
+    },
     {
         "name": "list_files",
         "description": "List files and directories in a workspace path.",
@@ -65,9 +233,33 @@ CUSTOM_TOOLS = [
             },
         },
     },
+    {
+        "name": "search_workspace",
+        "description": "Search the whole workspace for files whose path or content contains every word of the query (case-insensitive substring match). Uses a persistent index that is updated incrementally, so it is much faster and cheaper than list_files or grep -r. Returns ranked path:line snippets.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Words or fragments to find, e.g. 'def parse_config' or 'TODO retry'",
+                },
+                "path": {
+                    "type": "string",
+                    "description": "Only search under this directory (relative to /app/workspace). Defaults to root.",
+                    "default": ".",
+                },
+                "max_results": {
+                    "type": "integer",
+                    "description": "Maximum number of snippet lines (default 20, max 100)",
+                    "default": 20,
+                },
+            },
+            "required": ["query"],
+        },
+    },
     {
         "name": "run_command",
-        "description": "Run a shell command in the workspace directory. Has network access (pip install, git clone, curl, etc.).",
+        "description": "Run a shell command. " + SHELL_DESCRIPTION + " Has network access (pip install, git clone, curl, etc.). Long output is shortened to its beginning and end; the full output is saved under .command-output/ for paging with read_file. Each process is limited in CPU time and memory, and the result ends with the CPU time and peak memory the command used. For commands that may run longer than the timeout, use start_job.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -94,7 +286,7 @@ CUSTOM_TOOLS = [
     },
     {
         "name": "write_notes",
-        "description": "Write to your persistent notes file. This overwrites the entire file — read first if you want to append.",
+        "description": "Write to your persistent notes file. This overwrites the entire file — to add to it or change part of it, use append_notes or edit_notes.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -106,6 +298,109 @@ CUSTOM_TOOLS = [
             "required": ["content"],
         },
     },
+    {
+        "name": "append_notes",
+        "description": "Append text to your persistent notes file without rewriting it. Add a trailing newline yourself if you want one.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "content": {
+                    "type": "string",
+                    "description": "Text to append to notes",
+                }
+            },
+            "required": ["content"],
+        },
+    },
+    {
+        "name": "edit_notes",
+        "description": "Replace an exact string in your persistent notes file. old_string must occur once, unless replace_all is set.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "old_string": {
+                    "type": "string",
+                    "description": "Exact text to replace",
+                },
+                "new_string": {
+                    "type": "string",
+                    "description": "Text to replace it with",
+                },
+                "replace_all": {
+                    "type": "boolean",
+                    "description": "Replace every occurrence (default false)",
+                },
+            },
+            "required": ["old_string", "new_string"],
+        },
+    },
+    {
+        "name": "start_job",
+        "description": "Start a long-running shell command (training, big builds, simulations) in the background and return immediately with a job id. The job runs in a fresh bash in the workspace directory, with no time limit (the memory limit of run_command still applies); stdout and stderr go to .jobs/<job id>.log. You'll be told when it finishes, so keep working in the meantime. Use run_command for anything that finishes within its timeout.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "command": {
+                    "type": "string",
+                    "description": "Shell command to run",
+                },
+            },
+            "required": ["command"],
+        },
+    },
+    {
+        "name": "job_status",
+        "description": "Show the state, running time, exit code and output size of a background job, or of all jobs if job_id is omitted. Set wait to block up to that many seconds (max 120) until the job, or any job, finishes.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "Job id returned by start_job. Omit to list all jobs.",
+                },
+                "wait": {
+                    "type": "integer",
+                    "description": "Seconds to wait for completion (default 0, max 120)",
+                },
+            },
+        },
+    },
+    {
+        "name": "job_output",
+        "description": "Read a background job's output from a byte offset, so repeated calls return only what's new. The result ends with the offset to continue from.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "Job id returned by start_job",
+                },
+                "offset": {
+                    "type": "integer",
+                    "description": "Byte offset to start reading at (default 0). Negative values count from the end.",
+                },
+                "length": {
+                    "type": "integer",
+                    "description": "Maximum number of bytes to read (default and max 50000)",
+                },
+            },
+            "required": ["job_id"],
+        },
+    },
+    {
+        "name": "cancel_job",
+        "description": "Stop a background job and everything it started.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "Job id returned by start_job",
+                },
+            },
+            "required": ["job_id"],
+        },
+    },
 ]
 
 
@@ -127,81 +422,801 @@ ALL_TOOLS = CUSTOM_TOOLS + SERVER_TOOLS
 CUSTOM_TOOL_NAMES = {t["name"] for t in CUSTOM_TOOLS}
 
 
-def _validate_workspace_path(path_str: str) -> Path:
+class Workspace:
+    """The directories one session's tools work in, and its persistent shell.
+
+    The single-session loop uses the module-level WORKSPACE_DIR, MEMORY_DIR
+    and NOTES_FILE (see default_workspace()); the fleet runner gives each
+    session a Workspace of its own.
+    """
+
+    def __init__(self, root, memory_dir, notes_file=None):
+        self.root = Path(root)
+        self.memory_dir = Path(memory_dir)
+        self.notes_file = Path(notes_file) if notes_file else self.memory_dir / "notes.md"
+        self._shell = None
+        self._jobs = None
+        self._search = None
+        self.results = ResultCache()
+
+    def shell(self) -> ShellSession:
+        """Return the workspace's shell session, creating it on first use."""
+        if self._shell is None:
+            self._shell = ShellSession(self.root, limits=COMMAND_LIMITS)
+        return self._shell
+
+    @property
+    def jobs(self) -> "JobManager":
+        """The workspace's background jobs, created on first use."""
+        if self._jobs is None:
+            self._jobs = JobManager(self.root / JOBS_DIR, COMMAND_LIMITS)
+        return self._jobs
+
+    @property
+    def search(self) -> SearchIndex:
+        """The workspace's search index, opened on first use."""
+        if self._search is None:
+            self._search = SearchIndex(self.root)
+        return self._search
+
+    def close(self) -> list:
+        """Stop the shell session and any running jobs. Returns the jobs that were cancelled."""
+        if self._search is not None:
+            self._search.close()
+        if self._shell is not None:
+            self._shell.close()
+            self._shell = None
+        return self._jobs.close() if self._jobs is not None else []
+
+
+_default_workspace = None
+
+
+class ResultCache:
+    """Remembers which read results the conversation already holds, so unchanged ones aren't sent twice.
+
+    Keys are a tool call's input plus the identity of what it read (device,
+    inode, mtime and size), so any write, replace or rename is a miss. Only
+    the key, turn and result size are kept, for at most MAX_CACHED_RESULTS
+    entries, least recently used evicted first. The caller clears the cache
+    whenever earlier results may have left the context (compaction), and
+    forgets a turn whose results were discarded (a retried request).
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_RESULTS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+
+    def lookup(self, key):
+        """Return the turn of an earlier identical result, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_bytes += entry[1]
+            return entry[0]
+
+    def store(self, key, turn: int, size: int):
+        with self._lock:
+            self._entries[key] = (turn, size)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget_turn(self, turn: int):
+        with self._lock:
+            for key in [k for k, (t, _) in self._entries.items() if t == turn]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def default_workspace() -> Workspace:
+    """Return the workspace for the module-level directories, rebuilt if they are reassigned."""
+    global _default_workspace
+    ws = _default_workspace
+    if ws is None or (ws.root, ws.memory_dir, ws.notes_file) != (WORKSPACE_DIR, MEMORY_DIR, NOTES_FILE):
+        _default_workspace = ws = Workspace(WORKSPACE_DIR, MEMORY_DIR, NOTES_FILE)
+    return ws
+
+
+def _size(n: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def _is_tool_artifact(name: str) -> bool:
+    """Whether a top-level workspace entry is one of the tools' own spill, job or index files."""
+    return name in (COMMAND_OUTPUT_DIR, JOBS_DIR) or name.startswith(INDEX_FILE)
+
+
+def preload_context(ws: Workspace) -> str:
+    """The notes and a listing of the workspace's top level, for the initial message.
+
+    Saves the first turn's read_notes and list_files round-trip. Directories
+    show how many entries they hold, files their size; the tools' own spill,
+    job and index files are left out.
+    """
+    notes = ws.notes_file.read_text(errors="replace") if ws.notes_file.is_file() else ""
+    if len(notes) > PRELOAD_NOTES_CHARS:
+        notes = notes[:PRELOAD_NOTES_CHARS] + f"\n\n[... {len(notes) - PRELOAD_NOTES_CHARS:,} more characters; use read_notes to see them all]"
+    lines = []
+    try:
+        entries = sorted(
+            (e for e in os.scandir(ws.root) if not _is_tool_artifact(e.name)),
+            key=lambda e: e.name,
+        )
+    except OSError:
+        entries = []
+    for entry in entries[:PRELOAD_ENTRIES]:
+        try:
+            if entry.is_dir():
+                count = sum(1 for _ in os.scandir(entry.path))
+                lines.append(f"{entry.name}/ ({count} entr{'y' if count == 1 else 'ies'})")
+            else:
+                lines.append(f"{entry.name} ({_size(entry.stat().st_size)})")
+        except OSError:
+            lines.append(entry.name)
+    if len(entries) > PRELOAD_ENTRIES:
+        lines.append(f"[... {len(entries) - PRELOAD_ENTRIES} more; use list_files to see them all]")
+    return (
+        f"## Your notes\n\n{notes.strip() or '(no notes yet)'}\n\n"
+        f"## Workspace\n\n" + ("\n".join(lines) or "(empty directory)")
+    )
+
+
+_spill_counter = itertools.count(1)
+
+
+def _new_output_buffers(ws: Workspace):
+    """Create stdout/stderr buffers that together keep at most MAX_COMMAND_OUTPUT bytes.
+
+    Each stream keeps a quarter of the cap from its start and a quarter from
+    its end; anything larger is spilled in full to COMMAND_OUTPUT_DIR.
+    """
+    window = MAX_COMMAND_OUTPUT // 4
+    stem = ws.root / COMMAND_OUTPUT_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{next(_spill_counter)}"
+    return (
+        OutputBuffer(window, window, stem.with_suffix(".stdout"), MAX_SPILL_BYTES),
+        OutputBuffer(window, window, stem.with_suffix(".stderr"), MAX_SPILL_BYTES),
+    )
+
+
+def _prune_spill_files(ws: Workspace):
+    """Delete all but the newest MAX_SPILL_FILES spilled outputs."""
+    spill_dir = ws.root / COMMAND_OUTPUT_DIR
+    files = sorted(spill_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in files[MAX_SPILL_FILES:]:
+        old.unlink(missing_ok=True)
+
+
+def _truncation_note(name: str, buffer: OutputBuffer, ws: Workspace) -> str:
+    """Describe where a truncated stream's full output went."""
+    note = f"[{name}: {buffer.total:,} bytes, {buffer.dropped:,} omitted from the middle."
+    if buffer.spilled:
+        path = buffer.spill_path.relative_to(ws.root)
+        note += f" Full output saved to {path}"
+        if buffer.spill_truncated:
+            note += f" (first {MAX_SPILL_BYTES:,} bytes)"
+        note += " — page through it with read_file."
+    return note + "]"
+
+
+def _format_command_output(stdout: OutputBuffer, stderr: OutputBuffer, returncode: int, ws: Workspace) -> str:
+    """Combine a command's streams and exit code into the run_command result."""
+    output = ""
+    if stdout.total:
+        output += stdout.text()
+    if stderr.total:
+        output += ("\n--- stderr ---\n" if output else "--- stderr ---\n") + stderr.text()
+    if not output:
+        output = "(no output)"
+    if returncode != 0:
+        output += f"\n\n[exit code: {returncode}]"
+    notes = [_truncation_note(name, b, ws) for name, b in (("stdout", stdout), ("stderr", stderr)) if b.dropped]
+    if notes:
+        output += "\n\n" + "\n".join(notes)
+    return output
+
+
+# --- Background jobs ---
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+
+class Job:
+    """A detached background command whose output is spooled to a log file."""
+
+    def __init__(self, job_id: str, command: str, proc, log_path: Path):
+        self.id = job_id
+        self.command = command
+        self.proc = proc
+        self.log_path = log_path
+        self.started = time.time()
+        self.ended = None
+        self.returncode = None
+        self.usage = None
+        self.cancelled = False
+        # Set once the agent has seen that the job finished (no completion event needed)
+        self.reported = False
+        self.done = threading.Event()
+
+    def output_size(self) -> int:
+        try:
+            return self.log_path.stat().st_size
+        except OSError:
+            return 0
+
+    def state(self) -> str:
+        if not self.done.is_set():
+            return f"running for {_format_duration(time.time() - self.started)}"
+        how = "cancelled" if self.cancelled else f"exited with code {self.returncode}"
+        usage = f" {self.usage}" if self.usage else ""
+        return f"{how} after {_format_duration(self.ended - self.started)}{usage}"
+
+    def describe(self) -> str:
+        """One status line: id, state, output size and command."""
+        command = self.command if len(self.command) <= 80 else self.command[:77] + "..."
+        return f"{self.id}: {self.state()}, {self.output_size():,} bytes of output — {command}"
+
+
+class JobManager:
+    """The background jobs of one workspace.
+
+    Each job is a bash process in its own session, with stdout and stderr
+    written straight to JOBS_DIR/<id>.log, so it keeps running (and
+    logging) no matter what the loop is doing. A watcher thread per job
+    records its exit and queues a completion event, which the loop adds to
+    the next message it sends.
+    """
+
+    def __init__(self, jobs_dir: Path, limits: CommandLimits = None):
+        self.dir = jobs_dir
+        self.limits = limits
+        self._jobs = {}
+        self._events = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # Continue numbering after jobs left by earlier runs
+        existing = [int(p.stem.split("-")[1]) for p in jobs_dir.glob("job-*.log") if p.stem.split("-")[1].isdigit()]
+        self._ids = itertools.count(max(existing, default=0) + 1)
+
+    def start(self, command: str, cwd: Path) -> Job:
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if not job.done.is_set())
+            if running >= MAX_RUNNING_JOBS:
+                raise ValueError(f"{running} jobs are already running (max {MAX_RUNNING_JOBS}); wait for one or cancel it")
+            job_id = f"job-{next(self._ids)}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        log_path = self.dir / f"{job_id}.log"
+        with open(log_path, "wb") as out:
+            prefix = self.limits.ulimit(cpu=False) if self.limits else ""
+            proc = subprocess.Popen(
+                ["/bin/bash", "-c", prefix + command],
+                cwd=str(cwd),
+                stdin=subprocess.DEVNULL,
+                stdout=out,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        job = Job(job_id, command, proc, log_path)
+        with self._lock:
+            self._jobs[job_id] = job
+        threading.Thread(target=self._watch, args=(job,), daemon=True).start()
+        return job
+
+    def _watch(self, job: Job):
+        # wait4 rather than wait: its CPU times cover the job and every child it reaped
+        sampler = RssSampler(job.proc.pid, interval=JOB_SAMPLE_INTERVAL)
+        # The pidfd becomes readable when the job exits; sample its memory until then
+        pidfd = os.pidfd_open(job.proc.pid)
+        try:
+            while not select.select([pidfd], [], [], sampler.poll())[0]:
+                pass
+        finally:
+            os.close(pidfd)
+        _, status, rusage = os.wait4(job.proc.pid, 0)
+        job.proc.returncode = os.waitstatus_to_exitcode(status)
+        with self._lock:
+            job.returncode = job.proc.returncode
+            job.usage = ResourceUsage(rusage.ru_utime + rusage.ru_stime, sampler.peak)
+            job.ended = time.time()
+            job.done.set()
+            if not job.cancelled:
+                self._events.append(job)
+            self._changed.notify_all()
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job: {job_id}")
+        return job
+
+    def all(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def wait_any(self, timeout: float):
+        """Wait until any running job finishes, or the timeout passes."""
+        with self._lock:
+            running = [job for job in self._jobs.values() if not job.done.is_set()]
+            if running:
+                self._changed.wait_for(lambda: any(job.done.is_set() for job in running), timeout)
+
+    def cancel(self, job: Job):
+        """Terminate the job's process group, then kill it if it doesn't exit."""
+        if job.done.is_set():
+            return
+        job.cancelled = True
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(job.proc.pid, sig)
+            except ProcessLookupError:
+                break
+            if job.done.wait(KILL_GRACE):
+                break
+        job.done.wait(KILL_GRACE)
+
+    def events(self) -> list:
+        """Take the completion notices for jobs the agent hasn't already seen finish."""
+        with self._lock:
+            finished, self._events = self._events, []
+        return [
+            f"[Background job {job.id} finished: {job.state()}, {job.output_size():,} bytes of output. "
+            f"Read it with job_output.]"
+            for job in finished if not job.reported
+        ]
+
+    def close(self) -> list:
+        """Cancel every running job; returns them."""
+        running = [job for job in self.all() if not job.done.is_set()]
+        for job in running:
+            self.cancel(job)
+        return running
+
+
+def _read_job_output(job: Job, tool_input: dict) -> str:
+    """Read a window of a job's log from a byte offset, ending with where to continue."""
+    size = job.output_size()
+    length = min(max(int(tool_input.get("length", MAX_COMMAND_OUTPUT)), 0), MAX_COMMAND_OUTPUT)
+    offset = int(tool_input.get("offset", 0))
+    if offset < 0:
+        offset = max(size + offset, 0)
+    offset = min(offset, size)
+    with open(job.log_path, "rb") as fh:
+        fh.seek(offset)
+        data = fh.read(length)
+    # Don't start inside a multi-byte UTF-8 character
+    skip = 0
+    while skip < min(3, len(data)) and data[skip] & 0xC0 == 0x80:
+        skip += 1
+    data = data[skip:]
+    start = offset + skip
+    finished = job.done.is_set()
+    decoded = _decode_text(data, finished and start + len(data) >= size)
+    if decoded is None:
+        text, used = data.decode(errors="replace"), len(data)
+    else:
+        text, used = decoded
+    end = start + used
+    if finished and end >= size:
+        job.reported = True
+    state = "finished" if finished else "still running"
+    footer = f"[{job.id}: bytes {start:,}-{end:,} of {size:,}; job {state}."
+    if end < size or not finished:
+        footer += f" Continue with offset={end}."
+    return f"{text}\n\n{footer}]" if text else f"(no new output)\n\n{footer}]"
+
+
+# --- Ranged file reads ---
+
+SCAN_CHUNK = 1 << 20
+_line_counts = {}
+
+
+# Scans read the file a chunk at a time rather than through the mapping, so
+# pages they pass over don't stay resident in this process.
+
+def _count_newlines(fh, start: int, end: int) -> int:
+    """Count newlines in bytes [start, end) of a file, a chunk at a time."""
+    count = 0
+    fh.seek(start)
+    for pos in range(start, end, SCAN_CHUNK):
+        count += fh.read(min(SCAN_CHUNK, end - pos)).count(b"\n")
+    return count
+
+
+def _line_offset(fh, size: int, line: int) -> int:
+    """Return the byte offset where 1-based `line` starts (the file size if past the end)."""
+    remaining = line - 1
+    pos = 0
+    fh.seek(0)
+    while remaining > 0 and pos < size:
+        chunk = fh.read(SCAN_CHUNK)
+        if not chunk:
+            # The file shrank since it was measured
+            break
+        found = chunk.count(b"\n")
+        if found < remaining:
+            remaining -= found
+            pos += len(chunk)
+            continue
+        idx = -1
+        for _ in range(remaining):
+            idx = chunk.find(b"\n", idx + 1)
+        return pos + idx + 1
+    return size
+
+
+def _total_lines(path: Path, st, fh, mm) -> int:
+    """Count a file's lines, cached on path, size and mtime."""
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    if key not in _line_counts:
+        if len(_line_counts) > 256:
+            _line_counts.clear()
+        count = _count_newlines(fh, 0, st.st_size)
+        if st.st_size and mm[st.st_size - 1:st.st_size] != b"\n":
+            count += 1
+        _line_counts[key] = count
+    return _line_counts[key]
+
+
+def _hexdump(data: bytes, base: int) -> str:
+    """Format bytes as offset / hex / ASCII rows, 16 bytes per row."""
+    rows = []
+    for i in range(0, len(data), 16):
+        row = data[i:i + 16]
+        ascii_ = "".join(chr(b) if 32 <= b < 127 else "." for b in row)
+        rows.append(f"{base + i:08x}  {row.hex(' '):<47}  {ascii_}")
+    return "\n".join(rows)
+
+
+def _decode_text(data: bytes, at_eof: bool):
+    """Decode UTF-8, dropping a multi-byte character cut off at the end of the window.
+
+    Invalid bytes (a Latin-1 character in a log, say) become U+FFFD. Returns
+    (text, bytes consumed), or None if the data looks binary.
+    """
+    if b"\x00" in data[:BINARY_SAMPLE]:
+        return None
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = decoder.decode(data, final=at_eof)
+    sample = text[:BINARY_SAMPLE]
+    odd = len(sample) - len(sample.translate(_NON_TEXT))
+    if odd > len(sample) * BINARY_THRESHOLD:
+        return None
+    return text, len(data) - len(decoder.getstate()[0])
+
+
+# Deletes the characters that don't occur in text: control characters other
+# than whitespace, backspace and escape, and the replacement character
+_NON_TEXT = {c: None for c in [*range(32), 127, 0xFFFD] if chr(c) not in "\t\n\r\f\v\b\x1b"}
+
+
+def _read_file(path: Path, tool_input: dict) -> str:
+    """Read a window of a file, by byte range or line range, without loading the rest."""
+    encoding = tool_input.get("encoding", "auto")
+    cap = MAX_FILE_READ if encoding == "auto" else MAX_BINARY_READ
+    length = min(max(int(tool_input.get("length", cap)), 0), cap)
+    st = path.stat()
+    size = st.st_size
+    if size == 0:
+        return ""
+
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start_line = tool_input.get("start_line")
+        if start_line is not None:
+            start = _line_offset(fh, size, max(int(start_line), 1))
+            if start == size:
+                return f"[{tool_input['path']}: line {start_line} is past the end of the file ({_total_lines(path, st, fh, mm):,} lines).]"
+            end_line = tool_input.get("end_line")
+            end = start + length
+            if end_line is not None and int(end_line) < int(start_line):
+                return f"Error: end_line ({end_line}) is before start_line ({start_line})"
+            if end_line is not None:
+                end = min(end, _line_offset(fh, size, int(end_line) + 1))
+        else:
+            start = min(max(int(tool_input.get("offset", 0)), 0), size)
+            end = start + length
+        if encoding == "auto":
+            # Don't start inside a multi-byte UTF-8 character
+            for _ in range(3):
+                if start < size and mm[start] & 0xC0 == 0x80:
+                    start += 1
+        end = min(end, size)
+        data = mm[start:end]
+
+        decoded = None if encoding != "auto" else _decode_text(data, end == size)
+        if decoded is not None:
+            content, used = decoded
+            end = start + used
+        elif encoding == "base64":
+            content = base64.b64encode(data).decode()
+        elif encoding == "hex":
+            content = _hexdump(data, start)
+        else:
+            preview = data[:BINARY_PREVIEW]
+            return (
+                f"[Binary file: {tool_input['path']} is {size:,} bytes and doesn't look like text. "
+                f"Hex preview of bytes {start:,}-{start + len(preview):,}:]\n"
+                f"{_hexdump(preview, start)}\n"
+                f"[Use encoding=\"hex\" or \"base64\" with offset/length to read more.]"
+            )
+
+        if start == 0 and end == size:
+            return content
+        if encoding != "auto":
+            # Line numbers mean nothing in raw bytes, and start_line would read them as text
+            footer = f"[{tool_input['path']}: bytes {start:,}-{end:,} of {size:,}."
+            if end < size:
+                footer += f" Continue with offset={end}."
+            return f"{content}\n\n{footer}]"
+        total_lines = _total_lines(path, st, fh, mm)
+        first_line = _count_newlines(fh, 0, start) + 1
+        ends_line = end > start and data[end - start - 1:end - start] == b"\n"
+        last_line = first_line + data[:end - start].count(b"\n") - (1 if ends_line else 0)
+
+    footer = (
+        f"[{tool_input['path']}: bytes {start:,}-{end:,} of {size:,}, "
+        f"lines {first_line:,}-{last_line:,} of {total_lines:,}."
+    )
+    if end < size:
+        # A window that stops mid-line continues from that same line
+        footer += f" Continue with offset={end} or start_line={last_line + 1 if ends_line else last_line}."
+    return f"{content}\n\n{footer}]"
+
+
+def _validate_workspace_path(path_str: str, ws: Workspace = None) -> Path:
     """Resolve a path and verify it's inside the workspace."""
-    resolved = (WORKSPACE_DIR / path_str).resolve()
-    if not str(resolved).startswith(str(WORKSPACE_DIR.resolve())):
+    root = (ws or default_workspace()).root
+    resolved = (root / path_str).resolve()
+    if not str(resolved).startswith(str(root.resolve())):
         raise ValueError(f"Path escapes workspace: {path_str}")
     return resolved
 
 
-def execute_tool(name: str, tool_input: dict) -> str:
-    """Execute a custom tool and return the result as a string."""
+def _apply_patch(tool_input: dict, ws: Workspace) -> str:
+    """Apply a unified diff to workspace files: every file is checked before any is written."""
+    patches = edits.parse_unified_diff(tool_input["patch"], tool_input.get("path"))
+    # Path -> patched text, so several sections for one file build on each other
+    writes, deletes, summary = {}, [], []
+    for patch in patches:
+        old = _validate_workspace_path(patch.old_path, ws) if patch.old_path else None
+        new = _validate_workspace_path(patch.new_path, ws) if patch.new_path else None
+        if old is None:
+            if new.exists():
+                raise ValueError(f"{patch.new_path} already exists; the diff creates it")
+            text = ""
+        elif old in writes:
+            text = writes[old]
+        else:
+            text = edits.read_text(old, patch.old_path)
+        if new is None:
+            deletes.append(old)
+            summary.append(f"deleted {patch.old_path}")
+            continue
+        writes[new] = edits.apply_hunks(text, patch)
+        if old is not None and old != new:
+            deletes.append(old)
+            summary.append(f"renamed {patch.old_path} -> {patch.new_path}")
+        else:
+            verb = "created" if old is None else "patched"
+            summary.append(f"{verb} {patch.new_path} ({len(patch.hunks)} hunk{'s' if len(patch.hunks) != 1 else ''})")
+    for path, text in writes.items():
+        edits.atomic_write(path, text)
+    for path in deletes:
+        path.unlink()
+    return "Applied patch: " + ", ".join(summary)
+
+
+def _cache_key(name: str, tool_input: dict, ws: Workspace):
+    """Key a read on its input and the identity of the file or directory it reads, or None if uncacheable."""
+    try:
+        if name == "read_file":
+            path = _validate_workspace_path(tool_input["path"], ws)
+            window = tuple(tool_input.get(k) for k in ("offset", "length", "start_line", "end_line", "encoding"))
+        elif name == "list_files":
+            path = _validate_workspace_path(tool_input.get("path", "."), ws)
+            window = ()
+        elif name == "read_notes":
+            path, window = ws.notes_file, ()
+        else:
+            return None
+        st = os.stat(path)
+    except (KeyError, ValueError, OSError):
+        return None
+    return name, str(path), window, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def execute_tool(name: str, tool_input: dict, workspace: Workspace = None, turn: int = None) -> str:
+    """Execute a custom tool and return the result as a string.
+
+    Tools work in `workspace`, or in the module-level directories if None.
+    Given the current turn, a read whose file hasn't changed since an
+    identical read earlier in the conversation returns a short reference to
+    that result instead of repeating it (see ResultCache).
+    """
+    ws = workspace or default_workspace()
+    key = _cache_key(name, tool_input, ws) if turn is not None and RESULT_CACHE else None
+    if key is not None:
+        earlier = ws.results.lookup(key)
+        if earlier is not None:
+            what = "notes" if name == "read_notes" else tool_input.get("path", ".")
+            when = "earlier this turn" if earlier == turn else f"in turn {earlier}"
+            return (
+                f"[Unchanged: {what} is the same as when you ran this {name} {when}; "
+                f"that result is still in the conversation above, so it isn't repeated.]"
+            )
+    result = _execute_tool(name, tool_input, ws)
+    if key is not None and len(result) >= MIN_CACHED_RESULT and not result.startswith("Error"):
+        ws.results.store(key, turn, len(result))
+    return result
+
+
+def _execute_tool(name: str, tool_input: dict, ws: Workspace) -> str:
     try:
         if name == "read_file":
-            path = _validate_workspace_path(tool_input["path"])
+            path = _validate_workspace_path(tool_input["path"], ws)
             if not path.is_file():
                 return f"Error: File not found: {tool_input['path']}"
-            content = path.read_text()
-            if len(content) > MAX_FILE_READ:
-                return content[:MAX_FILE_READ] + f"\n\n[Truncated at {MAX_FILE_READ} bytes]"
-            return content
+            return _read_file(path, tool_input)
 
         elif name == "write_file":
-            path = _validate_workspace_path(tool_input["path"])
-            path.parent.mkdir(parents=True, exist_ok=True)
-            path.write_text(tool_input["content"])
+            path = _validate_workspace_path(tool_input["path"], ws)
+            edits.atomic_write(path, tool_input["content"])
             return f"Wrote {len(tool_input['content'])} bytes to {tool_input['path']}"
 
+        elif name == "edit_file":
+            path = _validate_workspace_path(tool_input["path"], ws)
+            text = edits.read_text(path, tool_input["path"])
+            text, count = edits.replace_string(
+                text, tool_input["old_string"], tool_input["new_string"], tool_input.get("replace_all", False), tool_input["path"]
+            )
+            edits.atomic_write(path, text)
+            return f"Replaced {count} occurrence{'s' if count != 1 else ''} in {tool_input['path']}"
+
+        elif name == "replace_lines":
+            path = _validate_workspace_path(tool_input["path"], ws)
+            text = edits.read_text(path, tool_input["path"])
+            start, end = int(tool_input["start_line"]), int(tool_input["end_line"])
+            text, removed, inserted = edits.replace_lines(text, start, end, tool_input["content"], tool_input["path"])
+            edits.atomic_write(path, text)
+            if removed:
+                return f"Replaced lines {start}-{end} of {tool_input['path']} ({removed} lines -> {inserted})"
+            return f"Inserted {inserted} line{'s' if inserted != 1 else ''} before line {start} of {tool_input['path']}"
+
+        elif name == "append_file":
+            path = _validate_workspace_path(tool_input["path"], ws)
+            if path.exists() and not path.is_file():
+                return f"Error: Not a file: {tool_input['path']}"
+            edits.atomic_write(path, append=tool_input["content"])
+            return f"Appended {len(tool_input['content'])} bytes to {tool_input['path']}"
+
+        elif name == "apply_patch":
+            return _apply_patch(tool_input, ws)
+
         elif name == "list_files":
             path_str = tool_input.get("path", ".")
-            path = _validate_workspace_path(path_str)
+            path = _validate_workspace_path(path_str, ws)
             if not path.is_dir():
                 return f"Error: Not a directory: {path_str}"
             entries = sorted(path.iterdir())
+            if path == ws.root.resolve():
+                # Paths in results still lead to spill and job files; the listing doesn't offer them
+                entries = [e for e in entries if not _is_tool_artifact(e.name)]
             lines = []
             for e in entries:
                 suffix = "/" if e.is_dir() else ""
                 lines.append(f"{e.name}{suffix}")
             return "\n".join(lines) if lines else "(empty directory)"
 
+        elif name == "search_workspace":
+            path = _validate_workspace_path(tool_input.get("path", "."), ws)
+            if not path.is_dir():
+                return f"Error: Not a directory: {tool_input.get('path')}"
+            subdir = os.path.relpath(path, ws.root.resolve())
+            # Jobs write files on their own schedule
+            if any(job.ended is None or job.ended > ws.search.refreshed for job in ws.jobs.all()):
+                ws.search.mark_stale()
+            return ws.search.search(tool_input["query"], subdir, tool_input.get("max_results", 20))
+
         elif name == "run_command":
             timeout = min(tool_input.get("timeout", DEFAULT_COMMAND_TIMEOUT), MAX_COMMAND_TIMEOUT)
+            stdout, stderr = _new_output_buffers(ws)
+            note = ""
             try:
-                result = subprocess.run(
-                    tool_input["command"],
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout,
-                    cwd=str(WORKSPACE_DIR),
-                )
-                output = ""
-                if result.stdout:
-                    output += result.stdout
-                if result.stderr:
-                    output += ("\n--- stderr ---\n" if output else "--- stderr ---\n") + result.stderr
-                if not output:
-                    output = "(no output)"
-                if result.returncode != 0:
-                    output += f"\n\n[exit code: {result.returncode}]"
-                if len(output) > MAX_COMMAND_OUTPUT:
-                    output = output[:MAX_COMMAND_OUTPUT] + f"\n\n[Truncated at {MAX_COMMAND_OUTPUT} bytes]"
-                return output
-            except subprocess.TimeoutExpired:
-                return f"Error: Command timed out after {timeout}s"
+                if PERSISTENT_SHELL:
+                    returncode, note, usage = ws.shell().run(tool_input["command"], timeout, stdout, stderr)
+                else:
+                    returncode, usage = run_fresh(tool_input["command"], ws.root, timeout, stdout, stderr, COMMAND_LIMITS)
+            finally:
+                stdout.close()
+                stderr.close()
+            if stdout.spilled or stderr.spilled:
+                _prune_spill_files(ws)
+            if returncode is None:
+                output = f"Error: Command timed out after {timeout}s"
+                if stdout.total or stderr.total:
+                    output += "\n\nOutput before the timeout:\n" + _format_command_output(stdout, stderr, 0, ws)
+            else:
+                output = _format_command_output(stdout, stderr, returncode, ws)
+            notes = [n for n in (COMMAND_LIMITS.describe_exit(returncode), note, usage and str(usage)) if n]
+            return "\n\n".join([output] + notes)
 
         elif name == "read_notes":
-            if not NOTES_FILE.is_file():
+            if not ws.notes_file.is_file():
                 return "(no notes yet)"
-            content = NOTES_FILE.read_text()
+            content = ws.notes_file.read_text()
             return content if content else "(notes file is empty)"
 
         elif name == "write_notes":
-            MEMORY_DIR.mkdir(parents=True, exist_ok=True)
-            NOTES_FILE.write_text(tool_input["content"])
+            edits.atomic_write(ws.notes_file, tool_input["content"])
             return f"Notes saved ({len(tool_input['content'])} bytes)"
 
+        elif name == "append_notes":
+            edits.atomic_write(ws.notes_file, append=tool_input["content"])
+            return f"Appended {len(tool_input['content'])} bytes to notes"
+
+        elif name == "edit_notes":
+            text = edits.read_text(ws.notes_file, "notes")
+            text, count = edits.replace_string(
+                text, tool_input["old_string"], tool_input["new_string"], tool_input.get("replace_all", False), "notes"
+            )
+            edits.atomic_write(ws.notes_file, text)
+            return f"Notes updated ({count} replacement{'s' if count != 1 else ''})"
+
+        elif name == "start_job":
+            job = ws.jobs.start(tool_input["command"], ws.root)
+            return (
+                f"Started {job.id} (pid {job.proc.pid}). It runs in the background; you'll be told when it finishes. "
+                f"Use job_status, job_output and cancel_job with this id."
+            )
+
+        elif name == "job_status":
+            wait = min(max(int(tool_input.get("wait", 0)), 0), MAX_COMMAND_TIMEOUT)
+            if tool_input.get("job_id"):
+                job = ws.jobs.get(tool_input["job_id"])
+                if wait:
+                    job.done.wait(wait)
+                job.reported = job.done.is_set()
+                return job.describe()
+            if wait:
+                ws.jobs.wait_any(wait)
+            jobs = ws.jobs.all()
+            for job in jobs:
+                job.reported = job.done.is_set()
+            return "\n".join(job.describe() for job in jobs) if jobs else "(no jobs)"
+
+        elif name == "job_output":
+            return _read_job_output(ws.jobs.get(tool_input["job_id"]), tool_input)
+
+        elif name == "cancel_job":
+            job = ws.jobs.get(tool_input["job_id"])
+            if job.done.is_set():
+                return f"{job.id} already finished: {job.state()}"
+            ws.jobs.cancel(job)
+            job.reported = True
+            return f"Cancelled {job.id} ({job.output_size():,} bytes of output)"
+
         else:
             return f"Error: Unknown tool: {name}"
 
@@ -209,3 +1224,139 @@ def execute_tool(name: str, tool_input: dict) -> str:
         return f"Error: {e}"
     except Exception as e:
         return f"Error executing {name}: {type(e).__name__}: {e}"
+    finally:
+        if name not in READ_ONLY_TOOLS and ws._search is not None:
+            ws._search.mark_stale()
+
+
+# --- Concurrent scheduling ---
+
+def _tool_resources(name: str, tool_input: dict, ws: Workspace):
+    """Return the (reads, writes) paths a tool call touches, for conflict checks.
+
+    Shell commands can touch anything, so they read the filesystem root: they
+    run alongside reads, but never alongside a write. With the persistent
+    shell they also write the session itself, so commands run one at a time.
+    """
+    try:
+        if name == "read_file":
+            return {str(_validate_workspace_path(tool_input["path"], ws))}, set()
+        if name in ("list_files", "search_workspace"):
+            return {str(_validate_workspace_path(tool_input.get("path", "."), ws))}, set()
+        if name in ("write_file", "edit_file", "replace_lines", "append_file"):
+            return set(), {str(_validate_workspace_path(tool_input["path"], ws))}
+        if name == "apply_patch":
+            # The files a diff touches are only known once it's parsed
+            return set(), {str(_validate_workspace_path(".", ws))}
+    except (KeyError, ValueError):
+        # Invalid input: execute_tool reports the error without touching anything
+        return set(), set()
+    if name == "read_notes":
+        return {str(ws.notes_file)}, set()
+    if name in ("write_notes", "append_notes", "edit_notes"):
+        return set(), {str(ws.notes_file)}
+    if name == "run_command":
+        return {"/"}, ({"<shell>"} if PERSISTENT_SHELL else set())
+    if name == "start_job":
+        return {"/"}, {"<jobs>"}
+    if name in ("job_status", "job_output"):
+        return {"<jobs>"}, set()
+    if name == "cancel_job":
+        return set(), {"<jobs>"}
+    # Unknown tools are serialized against everything
+    return set(), {"/"}
+
+
+def _paths_overlap(a: str, b: str) -> bool:
+    """True if one path is the other or contains it."""
+    if a == b or a == "/" or b == "/":
+        return True
+    return a.startswith(b + "/") or b.startswith(a + "/")
+
+
+def _conflicts(reads_a, writes_a, reads_b, writes_b) -> bool:
+    """True if two calls must not run at the same time (a write overlaps the other call)."""
+    for w in writes_a:
+        if any(_paths_overlap(w, p) for p in reads_b | writes_b):
+            return True
+    for w in writes_b:
+        if any(_paths_overlap(w, p) for p in reads_a):
+            return True
+    return False
+
+
+class ToolBatch:
+    """The custom tool calls of one response, scheduled on a thread pool as they are added.
+
+    Each call waits only for earlier calls in the batch it conflicts with, so
+    reads and independent commands overlap while writes to the same path (or
+    to the notes) keep their original order. Results are collected from the
+    returned futures in call order, so tool_result blocks and logs stay
+    deterministic. Without an executor, calls run inline one at a time.
+    Each future also gets a `duration` attribute: the call's execution time
+    in seconds, not counting time spent waiting to start. `turn` enables the
+    workspace's result cache for the batch's reads.
+
+    A call that has to wait is only handed to the executor once the calls it
+    conflicts with have finished, so no worker ever sits blocked on another
+    call, and a pool shared between sessions isn't tied up by one session's
+    serialized commands.
+    """
+
+    def __init__(self, executor=None, workspace: Workspace = None, turn: int = None):
+        self._executor = executor
+        self._workspace = workspace or default_workspace()
+        self._turn = turn
+        self._submitted = []
+
+    def submit(self, name: str, tool_input: dict) -> Future:
+        """Schedule a tool call and return a future for its result string."""
+        reads, writes = _tool_resources(name, tool_input, self._workspace)
+        future = Future()
+        future.duration = None
+        if self._executor is None:
+            self._run(future, name, tool_input)
+            return future
+        dependencies = [
+            f for r, w, f in self._submitted
+            if _conflicts(reads, writes, r, w)
+        ]
+        if dependencies:
+            self._start_after(dependencies, future, name, tool_input)
+        else:
+            self._executor.submit(self._run, future, name, tool_input)
+        self._submitted.append((reads, writes, future))
+        return future
+
+    def _run(self, future: Future, name: str, tool_input: dict):
+        """Execute the call and resolve its future, unless it was cancelled first."""
+        if not future.set_running_or_notify_cancel():
+            return
+        start = time.perf_counter()
+        try:
+            result = execute_tool(name, tool_input, self._workspace, self._turn)
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        future.duration = time.perf_counter() - start
+        future.set_result(result)
+
+    def _start_after(self, dependencies, future: Future, name: str, tool_input: dict):
+        """Submit the call once every dependency is done."""
+        remaining = [len(dependencies)]
+        lock = threading.Lock()
+
+        def dependency_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                self._executor.submit(self._run, future, name, tool_input)
+            except RuntimeError as e:
+                # The executor was shut down while the call waited
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+
+        for dependency in dependencies:
+            dependency.add_done_callback(dependency_done)
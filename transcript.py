@@ -0,0 +1,170 @@
+"""Append-only JSONL session transcript, and the loader that resumes from one.
+
+Every exchange is written as one line as it happens, never rewritten:
+
+  {"type": "session", ...}                       header: start time, model, task
+  {"type": "message", "role": "user", ...}       a user message (initial, continuation)
+  {"type": "response", "turn": N, ...}           an API response: content, stop reason, usage
+  {"type": "tool_result", "tool_use_id": ...}    one executed custom tool call
+  {"type": "notice", "text": ...}                a note added to the pending user message
+                                                 (e.g. a background job finished)
+
+Consecutive tool_result records make up one user message, so the message
+list can be rebuilt in a single forward pass over the file.
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+INTERRUPTED_RESULT = "Error: Tool call interrupted — the session restarted before it finished. Run it again if still needed."
+
+
+class Transcript:
+    """Appends records to a session's JSONL transcript, one flushed line each."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._f = open(self.path, "a")
+
+    def _write(self, record: dict):
+        self._f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._f.flush()
+
+    def session(self, **fields):
+        self._write({"type": "session", "time": datetime.now().isoformat(timespec="seconds"), **fields})
+
+    def message(self, role: str, content):
+        self._write({"type": "message", "role": role, "content": content})
+
+    def response(self, turn: int, content: list, stop_reason, usage, container_id):
+        self._write({
+            "type": "response",
+            "turn": turn,
+            "content": content,
+            "stop_reason": stop_reason,
+            "usage": {
+                "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+                "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+                "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+                "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            },
+            "container_id": container_id,
+        })
+
+    def tool_result(self, tool_use_id: str, name: str, content: str):
+        self._write({"type": "tool_result", "tool_use_id": tool_use_id, "name": name, "content": content})
+
+    def notice(self, text: str):
+        self._write({"type": "notice", "text": text})
+
+    def close(self):
+        self._f.close()
+
+
+def find_transcript(session: str, log_dir) -> Path:
+    """Resolve a --resume argument: a transcript path, a session timestamp, or 'latest'."""
+    log_dir = Path(log_dir)
+    if session == "latest":
+        # Skip the metrics files that share the prefix (autonomy_*.metrics.jsonl)
+        candidates = sorted(p for p in log_dir.glob("autonomy_*.jsonl") if p.suffixes == [".jsonl"])
+        if not candidates:
+            raise FileNotFoundError(f"No session transcripts in {log_dir}")
+        return candidates[-1]
+    path = Path(session)
+    if path.is_file():
+        return path
+    path = log_dir / f"autonomy_{session}.jsonl"
+    if path.is_file():
+        return path
+    raise FileNotFoundError(f"No session transcript for {session!r}")
+
+
+def add_notice(message: dict, text: str):
+    """Append a text block to a user message, turning plain string content into blocks."""
+    if isinstance(message["content"], str):
+        message["content"] = [{"type": "text", "text": message["content"]}]
+    message["content"].append({"type": "text", "text": text})
+
+
+def load_transcript(path, custom_tool_names) -> dict:
+    """Rebuild a session's state from its transcript in one forward pass.
+
+    Returns a dict with the message list, turn number, token totals,
+    container_id, last stop_reason and the session header. A truncated
+    final line (a crash mid-write) is ignored. If the last response asked
+    for custom tools that never produced a result, error results are filled
+    in and listed under "repairs" so the caller can record them.
+    """
+    state = {
+        "header": {},
+        "messages": [],
+        "turn": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cache_read_tokens": 0,
+        "cache_write_tokens": 0,
+        "container_id": None,
+        "stop_reason": None,
+        "repairs": [],
+    }
+    messages = state["messages"]
+    pending = []
+    last_tool_uses = []
+
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            kind = record.get("type")
+            if kind == "tool_result":
+                pending.append({
+                    "type": "tool_result",
+                    "tool_use_id": record["tool_use_id"],
+                    "content": record["content"],
+                })
+                continue
+            if kind == "notice":
+                if pending:
+                    pending.append({"type": "text", "text": record["text"]})
+                elif messages and messages[-1]["role"] == "user":
+                    add_notice(messages[-1], record["text"])
+                continue
+            if pending:
+                messages.append({"role": "user", "content": pending})
+                pending = []
+                last_tool_uses = []
+            if kind == "session":
+                state["header"] = record
+            elif kind == "message":
+                messages.append({"role": record["role"], "content": record["content"]})
+            elif kind == "response":
+                messages.append({"role": "assistant", "content": record["content"]})
+                usage = record.get("usage") or {}
+                state["turn"] = record["turn"]
+                state["input_tokens"] += usage.get("input_tokens", 0)
+                state["output_tokens"] += usage.get("output_tokens", 0)
+                state["cache_read_tokens"] += usage.get("cache_read_input_tokens", 0)
+                state["cache_write_tokens"] += usage.get("cache_creation_input_tokens", 0)
+                state["container_id"] = record.get("container_id") or state["container_id"]
+                state["stop_reason"] = record.get("stop_reason")
+                last_tool_uses = [
+                    b for b in record["content"]
+                    if b.get("type") == "tool_use" and b.get("name") in custom_tool_names
+                ] if state["stop_reason"] in ("tool_use", "max_tokens") else []
+
+    # Results must answer every custom tool call of the final response
+    if last_tool_uses:
+        answered = {b["tool_use_id"] for b in pending if b["type"] == "tool_result"}
+        for block in last_tool_uses:
+            if block["id"] not in answered:
+                repair = {"type": "tool_result", "tool_use_id": block["id"], "content": INTERRUPTED_RESULT}
+                pending.append(repair)
+                state["repairs"].append((block["id"], block["name"]))
+        # Tool results come before any text in a user message
+        pending.sort(key=lambda b: b["type"] != "tool_result")
+    if pending:
+        messages.append({"role": "user", "content": pending})
+    return state